@@ -0,0 +1,175 @@
+"""Aggregation of OCR ticks
+
+Turns per-tick bid/ask sums into the rolling window ratios shown in the main
+window and decides which alarms fire. It has no GUI dependency so that the
+same code runs in the headless daemon.
+"""
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+# `step_cnt` wraps once per day, 60sec * 60min * 24hour = 86400sec
+STEP_CNT_RESET = 86400
+
+
+def column_values(cells):
+    """Sum the values of OCR cells.
+
+    Args
+    :cells: `ocr_records.CELL_DTYPE` array of one column, sorted from top to bottom
+
+    Returns
+    :sum_: Sum of the values
+    :values: Values from top to bottom. Cells that are not a number are skipped.
+    """
+    values = cells['value']
+    values = values[~np.isnan(values)]
+    return float(values.sum()), values.tolist()
+
+
+class Aggregator:
+    def __init__(self, config):
+        """Rolling windows over the bid and ask sums.
+
+        Args
+        :config: App config. `time_periods`, `interval` and the alarm settings
+                 are read from it.
+
+        Attributes
+        :step_cnt: Number of ticks, used to refresh each period on its boundary
+        :history: {period: {'bid': deque, 'ask': deque}} last `period` sums
+        :newest: {'bid': sum, 'ask': sum} of the latest tick
+        :ratios: {period: (bid_ratio, ask_ratio)} as displayed, NaN if empty
+        """
+        self.config = config
+        self.step_cnt = 0
+        self.periods = [int(x) for x in config['time_periods']]
+        self.reset()
+
+    def reset(self):
+        self.step_cnt = 0
+        self.history = {}
+        for period in self.periods:
+            self.history[period] = {
+                'bid': deque([0] * period, maxlen=period),
+                'ask': deque([0] * period, maxlen=period),
+            }
+        self.newest = {'bid': 0, 'ask': 0}
+        self.ratios = {period: (math.nan, math.nan) for period in self.periods}
+
+    def update(self, bid, ask, timestamp=None):
+        """Add the sums of one tick.
+
+        Args
+        :bid: Sum of the bid column
+        :ask: Sum of the ask column
+        :timestamp: Time of the tick, defaults to now
+
+        Returns
+        :tick: A dict with
+            timestamp, step
+            newest: (bid, ask)
+            ratios: {period: (bid_ratio, ask_ratio)}
+            refreshed: Periods whose ratio was recomputed on this tick
+            alarms: [(slot, side, value)] where slot 0 is the newest value and
+                    slot i is the i-th time period
+        """
+        config = self.config
+        self.newest = {'bid': bid, 'ask': ask}
+        for period in self.periods:
+            self.history[period]['bid'].append(bid)
+            self.history[period]['ask'].append(ask)
+        self.step_cnt += 1
+
+        alarms = []
+        if self.step_cnt % config['interval'] == 0:
+            if config['alarm_active'][0] == True:
+                if bid >= config['alarm_threshold_bid'][0]:
+                    alarms.append((0, 'bid', bid))
+                if ask >= config['alarm_threshold_ask'][0]:
+                    alarms.append((0, 'ask', ask))
+
+        refreshed = []
+        for i, period in enumerate(self.periods, 1):	# i start from 1
+            if self.step_cnt % period != 0:
+                continue
+            refreshed.append(period)
+            ratio = self.ratios[period] = self._ratio(period)
+            if math.isnan(ratio[0]):
+                continue
+
+            if config['alarm_active'][i] == True:
+                if ratio[0] >= config['alarm_threshold_bid'][i]:
+                    alarms.append((i, 'bid', ratio[0]))
+                if ratio[1] >= config['alarm_threshold_ask'][i]:
+                    alarms.append((i, 'ask', ratio[1]))
+
+        tick = {
+            'timestamp': time.time() if timestamp is None else timestamp,
+            'step': self.step_cnt,
+            'newest': (bid, ask),
+            'ratios': dict(self.ratios),
+            'refreshed': refreshed,
+            'alarms': alarms,
+        }
+        if self.step_cnt == STEP_CNT_RESET:
+            self.step_cnt = 0
+        return tick
+
+    def _ratio(self, period):
+        acc_bid = sum(self.history[period]['bid'])
+        acc_ask = sum(self.history[period]['ask'])
+        if acc_bid == 0 or acc_ask == 0:
+            return (math.nan, math.nan)
+        if acc_bid > acc_ask:
+            return (round(acc_bid / acc_ask, 2), 1.0)
+        if acc_ask > acc_bid:
+            return (1.0, round(acc_ask / acc_bid, 2))
+        return (1.0, 1.0)
+
+    def set_periods(self, periods):
+        """Change the time periods without losing the history.
+
+        Kept periods keep their window. A new period is filled with the most
+        recent samples of the longest current window, and zeros where that
+        is too short, and its ratio is computed at once.
+
+        Returns the new periods.
+        """
+        periods = [int(x) for x in periods]
+        longest = self.history[max(self.periods)]
+        history = {}
+        ratios = {}
+        for period in periods:
+            if period in self.history:
+                history[period] = self.history[period]
+                ratios[period] = self.ratios[period]
+                continue
+            history[period] = {}
+            for side in ('bid', 'ask'):
+                samples = list(longest[side])[-period:]
+                history[period][side] = deque([0] * (period - len(samples)) + samples, maxlen=period)
+        self.periods = periods
+        self.history = history
+        self.ratios = {}
+        for period in periods:
+            if period in ratios:
+                self.ratios[period] = ratios[period]
+            else:
+                self.ratios[period] = self._ratio(period) if self.step_cnt else (math.nan, math.nan)
+        return periods
+
+
+def tick_record(tick, sums, rows, instrument=None):
+    """JSON-serializable view of a tick. Empty windows are None."""
+    return {
+        'timestamp': tick['timestamp'],
+        'instrument': instrument,
+        'sums': sums,
+        'rows': rows,
+        'ratios': {str(period): None if math.isnan(ratio[0]) else list(ratio)
+                   for period, ratio in tick['ratios'].items()},
+        'alarms': [{'slot': slot, 'side': side, 'value': value} for slot, side, value in tick['alarms']],
+    }
@@ -0,0 +1,332 @@
+"""Alert dispatcher
+
+Alarms of the rule engine (`Aggregator.update`) become `AlertEvent`s that are
+handed to an `AlertDispatcher`. Submitting never blocks the caller: a
+dispatcher thread takes the events in priority order, drops repeats and
+routes the rest to its sinks:
+
+- sound: plays alarm.mp3 through pygame, on a free mixer channel so alarms
+  firing together are all heard. pygame is imported on the first alert.
+- log: a warning in the app log
+- zmq: JSON messages on a ZeroMQ PUB socket, topic 'alert.<instrument>'
+- desktop: a desktop notification through plyer or notify-send if available
+- webhook: POSTs the event as JSON to a URL
+- file: appends the event as a JSON line to `alarm_log`
+
+Rules are named after the alarm slot and side, e.g. 'newest.bid' or
+'60s.ask' (see `alarm_events`). Per rule, an event is dropped when
+
+- the same value was sent within `dedup_window` seconds, or
+- `rate_limit` events were already sent within `rate_window` seconds.
+
+A replay dispatcher (`replay=True`, see replay.py) sends in the caller
+thread and measures these windows on the event timestamps, so that a session
+replayed faster than real time drops the same events as it did live.
+"""
+import json
+import time
+import queue
+import shutil
+import logging
+import itertools
+import threading
+import subprocess
+import urllib.request
+from collections import namedtuple, defaultdict, deque
+
+from metrics import metrics
+
+logger = logging.getLogger('root')
+
+# Pending events. When the sinks are slower than that, events are dropped.
+QUEUE_SIZE = 256
+
+# Priorities, higher is more urgent
+LOW, NORMAL, HIGH = 0, 1, 2
+
+AlertEvent = namedtuple('AlertEvent', 'rule value timestamp priority instrument')
+AlertEvent.__new__.__defaults__ = (NORMAL, None)
+
+
+def rule_name(slot, periods):
+    """Name of the rule of an alarm slot, 'newest' for slot 0 or e.g. '60s'."""
+    return 'newest' if slot == 0 else f'{periods[slot - 1]}s'
+
+
+def alarm_events(tick, periods, priorities=None, instrument=None):
+    """Turn the alarms of a tick into alert events.
+
+    Args
+    :tick: Result of `Aggregator.update`
+    :periods: Time periods of the aggregator, to name the rules
+    :priorities: {rule or slot name: priority}, e.g. {'newest': 2, '60s.ask': 0}
+    :instrument: Instrument name put on the events
+    """
+    priorities = priorities or {}
+    events = []
+    for slot, side, value in tick['alarms']:
+        name = rule_name(slot, periods)
+        rule = f'{name}.{side}'
+        priority = priorities.get(rule, priorities.get(name, NORMAL))
+        events.append(AlertEvent(rule, value, tick['timestamp'], priority, instrument))
+    return events
+
+
+def _describe(event):
+    where = f'{event.instrument} ' if event.instrument else ''
+    return f'Alarm on {where}{event.rule}: {event.value:.2f}'
+
+
+class LogSink:
+    name = 'log'
+
+    def send(self, event):
+        logger.warning(_describe(event))
+
+
+class SoundSink:
+    name = 'sound'
+
+    def __init__(self, path='alarm.mp3', channels=8):
+        """Play a sound per alert, initializing the pygame mixer on first use.
+
+        Alerts firing together play on separate channels. When all channels
+        are busy, the sound is queued after the oldest one.
+        """
+        self.path = path
+        self.channels = channels
+        self.sound = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        with self.lock:
+            if self.sound is None:
+                import pygame
+                pygame.mixer.init()
+                pygame.mixer.set_num_channels(self.channels)
+                self.sound = pygame.mixer.Sound(self.path)
+        return self.sound
+
+    def send(self, event):
+        import pygame
+        sound = self.open()
+        channel = pygame.mixer.find_channel()
+        if channel is not None:
+            channel.play(sound)
+        else:
+            pygame.mixer.Channel(0).queue(sound)
+
+
+class ZmqSink:
+    name = 'zmq'
+
+    def __init__(self, endpoint='tcp://127.0.0.1:5557'):
+        """Publish alerts as JSON on a ZeroMQ PUB socket, bound on first use."""
+        self.endpoint = endpoint
+        self.socket = None
+
+    def send(self, event):
+        import zmq
+        if self.socket is None:
+            self.socket = zmq.Context.instance().socket(zmq.PUB)
+            self.socket.setsockopt(zmq.LINGER, 0)
+            self.socket.bind(self.endpoint)
+            logger.info(f'Alert publisher bound to {self.endpoint}')
+        topic = f'alert.{event.instrument or "default"}'.encode('utf-8')
+        try:
+            self.socket.send_multipart([topic, json.dumps(event._asdict()).encode('utf-8')], zmq.NOBLOCK)
+        except zmq.Again:
+            metrics.incr('alerts_dropped')
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+
+
+class DesktopSink:
+    name = 'desktop'
+
+    def __init__(self, title='Snipping Tool alarm'):
+        """Show a desktop notification through plyer, or notify-send on Linux."""
+        self.title = title
+        self.notify = None
+
+    def _backend(self):
+        try:
+            from plyer import notification
+            return lambda message: notification.notify(title=self.title, message=message, timeout=5)
+        except ImportError:
+            pass
+        if shutil.which('notify-send'):
+            return lambda message: subprocess.run(['notify-send', self.title, message], timeout=5)
+        raise RuntimeError('no notification backend, install plyer')
+
+    def send(self, event):
+        if self.notify is None:
+            self.notify = self._backend()
+        self.notify(_describe(event))
+
+
+class WebhookSink:
+    name = 'webhook'
+
+    def __init__(self, url, timeout=2):
+        """POST each alert as JSON to `url`."""
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, event):
+        request = urllib.request.Request(self.url, json.dumps(event._asdict()).encode('utf-8'),
+                                         {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class FileSink:
+    name = 'file'
+
+    def __init__(self, path):
+        """Append each alert as a JSON line to `path`."""
+        self.path = path
+        self.stream = None
+
+    def send(self, event):
+        if self.stream is None:
+            self.stream = open(self.path, 'a')
+        self.stream.write(json.dumps(event._asdict()) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+
+class AlertDispatcher:
+    def __init__(self, sinks, rate_limit=3, rate_window=60, dedup_window=10, priorities=None, replay=False):
+        """Route alert events to sinks on a background thread.
+
+        Args
+        :sinks: Objects with a `send(event)` method and a `name`
+        :rate_limit: Events sent per rule within `rate_window`, 0 for no limit
+        :rate_window: Seconds
+        :dedup_window: Seconds in which the same value of a rule is sent once
+        :priorities: {rule or slot name: priority} used by `submit_tick`
+        :replay: Send in the caller thread, in submission order, and measure
+                 the windows on the event timestamps instead of the clock
+        """
+        self.sinks = list(sinks)
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.dedup_window = dedup_window
+        self.priorities = priorities or {}
+        self.sent = defaultdict(deque)
+        self.last_value = {}
+        self.order = itertools.count()
+        self.replay = replay
+        self.queue = queue.PriorityQueue(maxsize=QUEUE_SIZE)
+        self.thread = None
+        if not replay:
+            self.thread = threading.Thread(target=self._dispatch, name='alerts', daemon=True)
+            self.thread.start()
+
+    @classmethod
+    def from_config(cls, config, exclude=(), sinks=None, replay=False):
+        """Create a dispatcher from the `alerts` config section.
+
+        Args
+        :exclude: Sink names not to create, e.g. ('sound',) without a GUI
+        :sinks: Sinks to use instead of the configured ones
+        :replay: See `AlertDispatcher`
+        """
+        options = config.get('alerts') or {}
+        names = [] if sinks is not None else options.get('sinks', ['sound', 'log'])
+        sinks = list(sinks or [])
+        for name in names:
+            if name in exclude:
+                continue
+            if name == 'sound':
+                sinks.append(SoundSink(options.get('sound_file', 'alarm.mp3')))
+            elif name == 'log':
+                sinks.append(LogSink())
+            elif name == 'zmq':
+                sinks.append(ZmqSink(options.get('zmq_endpoint', 'tcp://127.0.0.1:5557')))
+            elif name == 'desktop':
+                sinks.append(DesktopSink())
+            elif name == 'webhook' and options.get('webhook_url'):
+                sinks.append(WebhookSink(options['webhook_url']))
+            elif name == 'file' and options.get('alarm_log'):
+                sinks.append(FileSink(options['alarm_log']))
+            else:
+                logger.error(f'Unknown or unconfigured alert sink: {name}')
+        return cls(sinks,
+                   options.get('rate_limit', 3),
+                   options.get('rate_window', 60),
+                   options.get('dedup_window', 10),
+                   options.get('priorities'),
+                   replay)
+
+    def submit(self, event):
+        """Queue an event, never blocks. A replay dispatcher sends it at once."""
+        if self.replay:
+            self._send(event, event.timestamp)
+            return
+        try:
+            self.queue.put_nowait((-event.priority, next(self.order), event))
+        except queue.Full:
+            metrics.incr('alerts_dropped')
+
+    def submit_tick(self, tick, periods, instrument=None):
+        """Queue the alarms of an aggregator tick."""
+        for event in alarm_events(tick, periods, self.priorities, instrument):
+            self.submit(event)
+
+    def preload(self):
+        """Open the sinks that are slow to start, e.g. the audio device."""
+        for sink in self.sinks:
+            if hasattr(sink, 'open'):
+                try:
+                    sink.open()
+                except Exception as e:
+                    logger.error(f'Failed when opening alert sink {sink.name}: {e}')
+
+    def _allowed(self, event, now):
+        key = (event.instrument, event.rule)
+        last = self.last_value.get(key)
+        if last is not None and last[0] == event.value and now - last[1] < self.dedup_window:
+            return False
+        sent = self.sent[key]
+        while sent and sent[0] <= now - self.rate_window:
+            sent.popleft()
+        if self.rate_limit and len(sent) >= self.rate_limit:
+            return False
+        sent.append(now)
+        self.last_value[key] = (event.value, now)
+        return True
+
+    def _dispatch(self):
+        while True:
+            _, _, event = self.queue.get()
+            if event is None:
+                break
+            self._send(event, time.monotonic())
+
+    def _send(self, event, now):
+        if not self._allowed(event, now):
+            metrics.incr('alerts_suppressed')
+            return
+        metrics.incr('alerts_sent')
+        for sink in self.sinks:
+            try:
+                sink.send(event)
+            except Exception as e:
+                logger.error(f'Failed when sending alert to {sink.name}: {e}')
+
+    def close(self):
+        """Stop the thread after the queued events."""
+        if self.thread is not None:
+            # Sorts after every event
+            self.queue.put((float('inf'), next(self.order), None))
+            self.thread.join(5)
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
@@ -0,0 +1,382 @@
+"""End-to-end latency benchmark
+
+Measures how long a number takes from appearing on screen to being parsed,
+aggregated, shown in the main window and alarmed on. Runs headless, without
+a screen. PyQt5, if installed, only draws the main window offscreen.
+
+Usage
+    python bench_latency.py
+    python bench_latency.py --versions 100 --json latency.json
+    python bench_latency.py --compare latency.json    # against an earlier run
+
+A synthetic source draws a ladder of known numbers with cv2.putText. The
+numbers change to a new version every `--hold` ticks, and every
+`--alarm-every`-th version the bid column is large enough to fire the newest
+value alarm. The frames go through `daemon.run` with the OCR settings of
+config.yaml (engine, presets, ladder layout, color key, consensus, RoI
+tracking). The alarms go through an AlertDispatcher thread without rate
+limits.
+
+Latency of a version is measured from the moment it appears on screen to
+
+- parsed: the end of the OCR of the first tick that read both sums right
+- aggregated: the aggregator update of that tick
+- shown: the main window showing it. Its timer reads the sums once a second,
+  aggregates them and sets the labels; `main.MainWindow.update_sums` and the
+  repaint are run on the sums of every tick under the offscreen Qt platform
+  and timed (gui_update). Without PyQt5, shown is taken from the
+  aggregation and the update is left out.
+- alarm: the alert sink receiving the alarm of a spike version
+
+Two waits are drawn from `--seed` instead of measured, so that runs can be
+compared: from appearing to the next capture (uniform within `interval`)
+and from parsing to the next main window timer tick (uniform within a
+second). They are listed as modeled in the output and the JSON results. The
+pipeline runs as fast as possible and a live run is put together from it: a
+version first read on its n-th tick adds n - 1 intervals, which the live
+loop would have waited, to the wall time of that tick. Ticks are taken to
+start on time, one that runs longer than `interval` would delay the next.
+Versions not read right before they change are counted as misses.
+
+Ladder layouts and color keys are learned in a temporary directory. The first
+`--warmup` versions, which include the calibrations, are left out.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import cv2
+import numpy as np
+
+from alerts import AlertDispatcher
+from config_utils import load_config
+from daemon import run
+
+logger = logging.getLogger('root')
+
+FRAME_SIZE = (320, 400)
+ROIS = {'left': [20, 30, 120, 390], 'right': [180, 30, 280, 390]}
+N_ROWS = 12
+# Sum of a column that fires the newest value alarm, normal versions stay under it
+SPIKE = 20000
+# Period of the main window timer that reads the sums
+GUI_PERIOD = 1.0
+
+STAGES = ('capture_wait', 'ocr_tick', 'parsed', 'aggregated', 'gui_update', 'shown', 'alarm')
+# What of each stage is drawn from the seed rather than measured
+MODELED = {
+    'capture_wait': 'wait from appearing to the next capture, uniform within interval',
+    'shown': 'wait from parsing to the next main window timer tick, uniform within GUI_PERIOD',
+}
+
+
+def make_versions(n_versions, alarm_every, rng):
+    """[(bid rows, ask rows)] of each version, every `alarm_every`-th one a bid spike."""
+    versions = []
+    for v in range(n_versions):
+        spike = alarm_every and v % alarm_every == alarm_every - 1
+        bid = rng.integers(2000, 5000, N_ROWS) if spike else rng.integers(100, 1000, N_ROWS)
+        ask = rng.integers(100, 1000, N_ROWS)
+        versions.append((bid.tolist(), ask.tolist()))
+    return versions
+
+
+def render(version):
+    """BGRA frame of one version: dark numbers on white, gray grid lines between the rows."""
+    w, h = FRAME_SIZE
+    frame = np.full((h, w, 4), 255, np.uint8)
+    for values, (x1, y1, x2, y2) in zip(version, (ROIS['left'], ROIS['right'])):
+        pitch = (y2 - y1) / N_ROWS
+        for i, value in enumerate(values):
+            top = int(y1 + i * pitch)
+            frame[top, x1:x2] = (200, 200, 200, 255)
+            cv2.putText(frame, f'{value:,}', (x1 + 6, int(top + pitch / 2 + 6)), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5, (0, 0, 0, 255), 1, cv2.LINE_AA)
+    return frame
+
+
+class SyntheticSource:
+    def __init__(self, versions, hold, interval):
+        """Frame source that shows each version for `hold` ticks.
+
+        Frames are rendered beforehand, so drawing is not part of the latency.
+        `timestamp` is the simulated time of the tick, see `daemon.run`.
+        """
+        self.frames = [render(version) for version in versions]
+        self.hold = hold
+        self.interval = interval
+        self.n_ticks = 0
+        self.timestamp = None
+
+    def grab(self):
+        version = self.n_ticks // self.hold
+        if version >= len(self.frames):
+            return None
+        self.timestamp = self.n_ticks * self.interval
+        self.n_ticks += 1
+        return self.frames[version]
+
+    def close(self):
+        pass
+
+
+class Trace:
+    def __init__(self):
+        """perf_counter times of each tick at each stage of `daemon.run`."""
+        self.times = {'captured': [], 'parsed': [], 'aggregated': []}
+
+    def __call__(self, stage):
+        self.times[stage].append(time.perf_counter())
+
+
+class MainWindowProbe:
+    def __init__(self, config):
+        """The main window under the offscreen Qt platform, updated like its timer does.
+
+        Its alarms are not sent, those of `daemon.run` are measured.
+        """
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5 import QtWidgets
+        import main
+        self.main = main
+        self.app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(['bench_latency'])
+        main.config = config
+        main.sums = main.new_sums()
+        main.global_alerts = _NoAlerts()
+        main.publisher_tried = True
+        self.window = main.MainWindow()
+        self.window.show()
+        self.app.processEvents()
+
+    @classmethod
+    def create(cls, config):
+        """Return a probe, or None without PyQt5."""
+        try:
+            return cls(config)
+        except ImportError as e:
+            logger.warning(f'Main window update not measured: {e}')
+            return None
+
+    def update(self, sums):
+        """Give the window the sums of a tick, return the seconds of `update_sums` and the repaint."""
+        with self.main.show_lock:
+            self.main.sums['bid'].appendleft(sums['bid'])
+            self.main.sums['ask'].appendleft(sums['ask'])
+        t0 = time.perf_counter()
+        self.window.update_sums()
+        self.app.processEvents()
+        return time.perf_counter() - t0
+
+    def close(self):
+        self.window.close()
+        self.app.processEvents()
+
+
+class _NoAlerts:
+    def submit_tick(self, tick, periods, instrument=None):
+        pass
+
+
+class SumsSink:
+    def __init__(self, probe=None):
+        """Tick sink keeping the sums of every tick.
+
+        Args
+        :probe: MainWindowProbe given the sums of every tick, if set
+        """
+        self.instrument = None
+        self.sums = []
+        self.probe = probe
+        self.gui_times = []
+
+    def write(self, tick, sums, rows, instrument=None):
+        self.sums.append((sums['bid'], sums['ask']))
+        if self.probe is not None:
+            self.gui_times.append(self.probe.update(sums))
+
+    def close(self):
+        pass
+
+
+class AlarmSink:
+    name = 'bench'
+
+    def __init__(self, interval):
+        """Alert sink keeping the tick and arrival time of every alarm."""
+        self.interval = interval
+        self.received = []
+
+    def send(self, event):
+        self.received.append((int(round(event.timestamp / self.interval)), event.rule, time.perf_counter()))
+
+
+def bench_config(config, work_dir):
+    """Copy of the config with the synthetic RoIs, the newest value alarm only
+    and calibration files in `work_dir`."""
+    config = copy.deepcopy(config)
+    n_slots = len(config['time_periods']) + 1
+    config['rois'] = copy.deepcopy(ROIS)
+    config['interval'] = 1
+    config['debug'] = False
+    config['alarm_active'] = [True] + [False] * (n_slots - 1)
+    config['alarm_threshold_bid'] = [SPIKE] * n_slots
+    config['alarm_threshold_ask'] = [SPIKE] * n_slots
+    for section, name in (('ladder_layout', 'ladder_layout.json'), ('color_key', 'color_key.json')):
+        config[section] = dict(config.get(section) or {}, file=f'{work_dir}/{name}')
+    return config
+
+
+def measure(config, versions, hold, interval, seed, warmup, gui=True):
+    """Run the pipeline over the versions.
+
+    Args
+    :gui: Also time the main window update, see `MainWindowProbe`
+
+    Returns ({stage: [seconds]}, misses).
+    """
+    work_dir = tempfile.mkdtemp(prefix='bench_latency_')
+    probe = None
+    try:
+        config = bench_config(config, work_dir)
+        probe = MainWindowProbe.create(config) if gui else None
+        source = SyntheticSource(versions, hold, interval)
+        sink = SumsSink(probe)
+        alarms = AlarmSink(interval)
+        alerts = AlertDispatcher([alarms], rate_limit=0, dedup_window=0)
+        trace = Trace()
+        try:
+            run(config, source, sink, 0, alerts=alerts, trace=trace)
+        finally:
+            alerts.close()
+    finally:
+        if probe is not None:
+            probe.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    rng = np.random.default_rng(seed)
+    capture_waits = rng.uniform(0, interval, len(versions))
+    gui_waits = rng.uniform(0, GUI_PERIOD, len(versions))
+    times = trace.times
+    first_alarm = {}
+    for k, rule, received in alarms.received:
+        if rule == 'newest.bid' and k not in first_alarm:
+            first_alarm[k] = received
+
+    latencies = {stage: [] for stage in STAGES}
+    latencies['ocr_tick'] = [parsed - captured for captured, parsed in zip(times['captured'], times['parsed'])]
+    misses = 0
+    for v, (bid, ask) in enumerate(versions):
+        if v < warmup:
+            continue
+        ticks = range(v * hold, (v + 1) * hold)
+        latencies['capture_wait'].append(capture_waits[v])
+        right = [k for k in ticks if abs(sink.sums[k][0] - sum(bid)) < 0.5 and abs(sink.sums[k][1] - sum(ask)) < 0.5]
+        if not right:
+            misses += 1
+            continue
+        k = right[0]
+        # On the clock of tick k, the ticks before it waited `interval` each in a live run
+        appeared = times['captured'][k] - capture_waits[v] - (k - ticks[0]) * interval
+        latencies['parsed'].append(times['parsed'][k] - appeared)
+        latencies['aggregated'].append(times['aggregated'][k] - appeared)
+        if sink.gui_times:
+            # The window timer reads the sums the worker parsed, then aggregates and paints
+            latencies['gui_update'].append(sink.gui_times[k])
+            latencies['shown'].append(times['parsed'][k] - appeared + gui_waits[v] + sink.gui_times[k])
+        else:
+            latencies['shown'].append(times['aggregated'][k] - appeared + gui_waits[v])
+        if sum(bid) >= SPIKE:
+            alarmed = [k for k in ticks if k in first_alarm]
+            if alarmed:
+                k = alarmed[0]
+                appeared = times['captured'][k] - capture_waits[v] - (k - ticks[0]) * interval
+                latencies['alarm'].append(first_alarm[k] - appeared)
+    return latencies, misses
+
+
+def summarize(latencies):
+    """{stage: {count, p50, p90, p99, max}} in milliseconds."""
+    summary = {}
+    for stage, values in latencies.items():
+        if not values:
+            continue
+        ms = np.array(values) * 1000
+        summary[stage] = {'count': len(ms), 'p50': float(np.percentile(ms, 50)), 'p90': float(np.percentile(ms, 90)),
+                          'p99': float(np.percentile(ms, 99)), 'max': float(ms.max())}
+    return summary
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the screen to alarm latency on synthetic frames.')
+    parser.add_argument('--config', default='config.yaml', help='Config file with the OCR settings')
+    parser.add_argument('--versions', type=int, default=60, help='Number of times the numbers change')
+    parser.add_argument('--hold', type=int, default=5, help='Ticks each version is shown')
+    parser.add_argument('--alarm-every', type=int, default=4, help='Every Nth version fires the alarm, 0 for none')
+    parser.add_argument('--interval', type=float, default=None, help='Seconds between captures, default from config')
+    parser.add_argument('--warmup', type=int, default=2, help='First versions left out')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='Write the results to this file')
+    parser.add_argument('--compare', default=None, help='Results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    config = load_config(args.config)
+    interval = args.interval if args.interval is not None else config['interval']
+    versions = make_versions(args.versions, args.alarm_every, np.random.default_rng(args.seed))
+    latencies, misses = measure(config, versions, args.hold, interval, args.seed, args.warmup)
+    summary = summarize(latencies)
+    measured = args.versions - args.warmup
+    print(f'{measured} versions, {misses} not read right before they changed')
+    print(f'{"stage":<14}{"count":>7}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+    for stage in STAGES:
+        if stage in summary:
+            s = summary[stage]
+            modeled = ' *' if stage in MODELED else ''
+            print(f'{stage:<14}{s["count"]:>7}{s["p50"]:>10.1f}{s["p90"]:>10.1f}{s["p99"]:>10.1f}{s["max"]:>10.1f}'
+                  f'{modeled}')
+    for stage, what in MODELED.items():
+        print(f'* {stage} includes a modeled {what}')
+    if 'gui_update' not in summary:
+        print('  shown has no main window update, PyQt5 is missing')
+
+    if args.compare:
+        with open(args.compare) as f:
+            earlier = json.load(f)
+        print(f'\nChange from {args.compare} ({earlier.get("commit") or "unknown commit"})')
+        for stage in STAGES:
+            if stage in summary and stage in earlier['stages']:
+                before, after = earlier['stages'][stage], summary[stage]
+                print(f'{stage:<14}p50 {after["p50"] - before["p50"]:+8.1f} ms   p99 {after["p99"] - before["p99"]:+8.1f} ms')
+
+    if args.json:
+        results = {
+            'commit': _commit(),
+            'settings': {key: getattr(args, key) for key in ('versions', 'hold', 'alarm_every', 'warmup', 'seed')},
+            'interval': interval,
+            'misses': misses,
+            'stages': summary,
+            'modeled': MODELED,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if misses == measured:
+        sys.exit('No version was read right, check the OCR engine')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""OCR preset benchmark
+
+Reads recorded frames with each OCR preset and reports the latency and the
+accuracy of every preset, so the presets can be picked per machine (see
+`ocr_presets` and `ocr_preset` in config.yaml).
+
+Usage
+    python bench_ocr.py --source ./frames
+    python bench_ocr.py --source ./frames --labels labels.json --presets fast balanced
+    python bench_ocr.py --source ./frames --json bench.json
+
+Accuracy is the share of ladder rows read as the expected value. The expected
+values come from a labels file, {"frame file name": {"bid": [...], "ask": [...]}},
+or else from the `--reference` preset. Frames are read without the row cache
+or consensus, every call does the full work. They are read with the ladder
+layout and the color key of the app when `ladder_layout` and `color_key` are
+enabled, from copies of their files so that a calibration on the recorded
+frames does not overwrite them. Both are calibrated before anything is timed.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from aggregator import column_values
+from capture_utils import DirectorySource
+from color_key import ColorKeyStore
+from config_utils import load_config
+from ladder_layout import LayoutStore
+from ocr_presets import PRESETS, resolve_preset
+from ocr_utils import extract_data
+
+
+def load_labels(path):
+    """Return {frame file name: {col_name: [values]}} of a labels file."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def score_rows(values, expected):
+    """Return (matching rows, expected rows) of one column."""
+    matches = sum(1 for value, want in zip(values, expected) if abs(value - want) < 1e-6)
+    return matches, max(len(values), len(expected))
+
+
+def read_frames(source, rois):
+    """Return [(file name, {col_name: crop})] of every frame in a directory.
+
+    Args
+    :rois: {col_name: (x1, y1, x2, y2)}
+    """
+    frames = DirectorySource(source)
+    crops = []
+    for filename in frames.files:
+        frame = frames.grab()
+        crops.append((os.path.basename(filename),
+                      {col_name: frame[y1:y2, x1:x2] for col_name, (x1, y1, x2, y2) in rois.items()}))
+    return crops
+
+
+def calibration_config(config, work_dir):
+    """Copy of the config whose calibration files are copies in `work_dir`."""
+    config = copy.deepcopy(config)
+    for section, name in (('ladder_layout', 'ladder_layout.json'), ('color_key', 'color_key.json')):
+        options = config.get(section)
+        if not options:
+            continue
+        path = options.get('file', name)
+        local = os.path.join(work_dir, name)
+        if os.path.exists(path):
+            shutil.copyfile(path, local)
+        config[section] = dict(options, file=local)
+    return config
+
+
+def calibrate(crops, layouts=None, keys=None):
+    """Calibrate the layouts and color keys on the first frames, so that no timed read includes it."""
+    for _, columns in crops:
+        for col_name, crop in columns.items():
+            if layouts is not None:
+                layouts.get(col_name, crop)
+            if keys is not None and col_name not in keys.keys:
+                keys.apply(col_name, crop, 1)
+        layouts_done = layouts is None or len(layouts.layouts) == len(columns)
+        if layouts_done and (keys is None or len(keys.keys) == len(columns)):
+            return
+
+
+def run_preset(crops, preset, conf_thresh=80, repeat=1, layouts=None, keys=None):
+    """Read every crop with one preset.
+
+    Args
+    :layouts: LayoutStore of the columns, see `ladder_layout`, if set
+    :keys: ColorKeyStore of the columns, see `color_key`, if set. Copied, so
+           that recalibrations of one preset do not carry over to the next.
+
+    Returns
+    :latencies: Seconds of every call
+    :values: {(file name, col_name): [values]} of the last repeat
+    """
+    latencies = []
+    values = {}
+    keys = copy.deepcopy(keys)
+    for _ in range(repeat):
+        for filename, columns in crops:
+            for col_name, crop in columns.items():
+                layout = layouts.get(col_name, crop) if layouts is not None else None
+                t0 = time.perf_counter()
+                cells = extract_data(crop, conf_thresh, col_name, cache=None, preset=preset, layout=layout, keys=keys)
+                latencies.append(time.perf_counter() - t0)
+                values[filename, col_name] = column_values(cells)[1]
+    return latencies, values
+
+
+def accuracy(values, expected):
+    """Share of rows matching `expected`, {(file name, col_name): [values]}. None without rows."""
+    matches = total = 0
+    for key, want in expected.items():
+        m, n = score_rows(values.get(key, []), want)
+        matches += m
+        total += n
+    return matches / total if total else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the latency and accuracy of the OCR presets.')
+    parser.add_argument('--source', required=True, help='Directory of recorded full-screen frames')
+    parser.add_argument('--presets', nargs='+', default=list(PRESETS), help='Presets to measure')
+    parser.add_argument('--labels', default=None, help='JSON file of the expected values per frame')
+    parser.add_argument('--reference', default='accurate', help='Preset taken as correct without labels')
+    parser.add_argument('--repeat', type=int, default=1, help='Read every frame this many times')
+    parser.add_argument('--json', default=None, help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    work_dir = tempfile.mkdtemp(prefix='bench_ocr_')
+    try:
+        local = calibration_config(config, work_dir)
+        layouts = LayoutStore.from_config(local)
+        keys = ColorKeyStore.from_config(local)
+        crops = read_frames(args.source, {'bid': config['rois']['left'], 'ask': config['rois']['right']})
+        calibrate(crops, layouts, keys)
+        if args.labels:
+            expected = {(filename, col_name): values
+                        for filename, columns in load_labels(args.labels).items()
+                        for col_name, values in columns.items()}
+        else:
+            _, expected = run_preset(crops, resolve_preset(args.reference), config['conf_thresh'], layouts=layouts,
+                                     keys=keys)
+
+        results = []
+        print(f'{len(crops)} frames, {"labels" if args.labels else "reference " + args.reference}', file=sys.stderr)
+        print(f'{"preset":<10} {"mean ms":>8} {"p50 ms":>8} {"p95 ms":>8} {"accuracy":>9}')
+        for name in args.presets:
+            latencies, values = run_preset(crops, resolve_preset(name), config['conf_thresh'], args.repeat, layouts,
+                                           keys)
+            ms = np.array(latencies) * 1000
+            result = {
+                'preset': name,
+                'mean_ms': float(ms.mean()),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+                'accuracy': accuracy(values, expected),
+            }
+            results.append(result)
+            acc = '-' if result['accuracy'] is None else f'{result["accuracy"] * 100:.1f}%'
+            print(f'{name:<10} {result["mean_ms"]:8.1f} {result["p50_ms"]:8.1f} {result["p95_ms"]:8.1f} {acc:>9}')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
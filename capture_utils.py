@@ -0,0 +1,216 @@
+"""Frame sources
+
+A frame source returns one full frame per call to `grab()`, as a (h, w, 4)
+uint8 BGRA NumPy array. ROIs are cropped from that frame by slicing, so every
+column of a tick comes from the same capture and no pixel is converted.
+
+- `ScreenSource` grabs a monitor with mss. On a Linux server it works against
+  a virtual display, e.g. `Xvfb :99` with `DISPLAY=:99`.
+- `DirectorySource` replays image files from a directory in name order.
+- `VideoSource` replays the frames of a video file.
+
+Recorded sources also know when each frame was taken (`times`), which
+`replay.py` uses to run a session with simulated time.
+"""
+import os
+import re
+import time
+import logging
+
+import cv2
+import numpy as np
+from mss import mss
+
+logger = logging.getLogger('root')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.webm')
+
+# Epoch seconds (1697712345.123) or milliseconds (1697712345123) in a file name
+EPOCH_NAME = re.compile(r'(?<!\d)(\d{13}|\d{10}(?:\.\d+)?)(?!\d)')
+# Local time as written by the debug recorder, 20231019-093000.123
+STAMP_NAME = re.compile(r'(?<!\d)(\d{8}-\d{6})(?:\.(\d{1,6}))?')
+
+
+def frame_time(filename):
+    """Time a frame file was taken, from its name or else its modification time."""
+    name = os.path.basename(filename)
+    match = EPOCH_NAME.search(name)
+    if match:
+        value = match.group(1)
+        return int(value) / 1000 if len(value) == 13 else float(value)
+    match = STAMP_NAME.search(name)
+    if match:
+        fraction = float('0.' + match.group(2)) if match.group(2) else 0.0
+        return time.mktime(time.strptime(match.group(1), '%Y%m%d-%H%M%S')) + fraction
+    return os.path.getmtime(filename)
+
+
+def bgra_view(sct_img):
+    """View an mss screenshot as a (h, w, 4) BGRA array without copying."""
+    return np.frombuffer(sct_img.raw, np.uint8).reshape(sct_img.height, sct_img.width, 4)
+
+
+def capture_screenshot(screen_id):
+    # Capture entire screen by screen_id
+    with mss() as sct:
+        monitor = sct.monitors[screen_id] #screen_id start from 1. This means that the screen_id of main display(first display) is 1, screen_id of the second_display is 2 etc.
+        sct_img = sct.grab(monitor)
+        return bgra_view(sct_img)
+
+
+class ScreenSource:
+    def __init__(self, screen_id=1, region=None):
+        """Grab frames from a monitor.
+
+        The mss handle is created on the first `grab()` so that it belongs to
+        the thread which captures.
+
+        Args
+        :screen_id: Monitor index, the first display is 1
+        :region: (x1, y1, x2, y2) relative to the monitor. Only this part is
+                 grabbed and the frame starts at (x1, y1). Grab the whole
+                 monitor if None.
+        """
+        self.screen_id = screen_id
+        self.region = region
+        self.sct = None
+        self.monitor = None
+
+    def grab(self):
+        if self.sct is None:
+            self.sct = mss()
+            self.monitor = self.sct.monitors[self.screen_id]
+            if self.region is not None:
+                x1, y1, x2, y2 = self.region
+                self.monitor = {
+                    'left': self.monitor['left'] + x1,
+                    'top': self.monitor['top'] + y1,
+                    'width': x2 - x1,
+                    'height': y2 - y1,
+                }
+        return bgra_view(self.sct.grab(self.monitor))
+
+    def set_screen(self, screen_id):
+        """Grab another monitor from the next frame on."""
+        self.close()
+        self.screen_id = screen_id
+
+    def close(self):
+        if self.sct is not None:
+            self.sct.close()
+            self.sct = None
+
+
+class DirectorySource:
+    def __init__(self, path, loop=False):
+        """Replay image files from a directory.
+
+        Args
+        :path: Directory with full-screen frames. Files are read in name order.
+        :loop: Start again from the first file after the last one
+
+        `grab()` returns None when the directory is exhausted.
+
+        Attributes
+        :times: Time of each file, see `frame_time`
+        :index: Index of the file the next `grab()` returns
+        """
+        self.loop = loop
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            raise ValueError(f'No image found in {path}')
+        self.times = [frame_time(filename) for filename in self.files]
+        self.index = 0
+
+    def skip(self):
+        """Pass over the next file without reading it."""
+        self.index += 1
+
+    def grab(self):
+        if self.index >= len(self.files):
+            if not self.loop:
+                return None
+            self.index = 0
+        filename = self.files[self.index]
+        self.index += 1
+        image = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+        if image.shape[2] == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+        return image
+
+    def close(self):
+        pass
+
+
+class VideoSource:
+    def __init__(self, path, start=None):
+        """Replay the frames of a video file.
+
+        Args
+        :path: Video of the screen
+        :start: Time of the first frame. Defaults to the modification time of
+                the file minus the video duration, as a recording is usually
+                written until it stops.
+
+        `grab()` returns None at the end of the video.
+
+        Attributes
+        :times: Time of each frame, from the frame rate of the video
+        :index: Index of the frame the next `grab()` returns
+        """
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f'Cannot open video {path}')
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        n_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if fps <= 0 or n_frames <= 0:
+            raise ValueError(f'Unknown frame rate or length of video {path}')
+        if start is None:
+            start = os.path.getmtime(path) - n_frames / fps
+        self.times = (start + np.arange(n_frames) / fps).tolist()
+        self.index = 0
+
+    def skip(self):
+        """Pass over the next frame without decoding it."""
+        self.capture.grab()
+        self.index += 1
+
+    def grab(self):
+        ok, image = self.capture.read()
+        if not ok:
+            return None
+        self.index += 1
+        return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+
+    def close(self):
+        self.capture.release()
+
+
+def bounding_box(rois):
+    """Return the (x1, y1, x2, y2) box that contains all RoIs."""
+    boxes = list(rois.values())
+    return (min(min(b[0], b[2]) for b in boxes), min(min(b[1], b[3]) for b in boxes),
+            max(max(b[0], b[2]) for b in boxes), max(max(b[1], b[3]) for b in boxes))
+
+
+def offset_rois(rois, origin):
+    """Shift RoIs so that they are relative to `origin` (x, y)."""
+    x0, y0 = origin
+    return {name: (x1 - x0, y1 - y0, x2 - x0, y2 - y0) for name, (x1, y1, x2, y2) in rois.items()}
+
+
+def open_source(source, screen_id=1):
+    """Create a frame source from a command-line value: 'screen', a directory or a video file."""
+    if source == 'screen':
+        return ScreenSource(screen_id)
+    if os.path.isdir(source):
+        return DirectorySource(source)
+    if source.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(source):
+        return VideoSource(source)
+    raise ValueError(f'Unknown frame source: {source}')
@@ -0,0 +1,242 @@
+"""Color-keyed binarization
+
+The ladder draws its numbers in a few fixed colors on a fixed background, so
+the black and white image Tesseract reads can come from the colors alone:
+
+- calibration learns the palette of a RoI: the background (its most common
+  color), the colors of the grid lines (pixel rows and columns that are
+  almost all ink) and up to `MAX_TEXT_COLORS` text colors
+- a lookup table maps every color, quantized to `BITS` bits per channel,
+  to the ink coverage of a pixel of that color. Colors between the
+  background and a text color (anti-aliasing) are partly covered, grid line
+  colors are paper.
+- a crop is binarized by one table lookup, an upscale and a fixed threshold,
+  instead of the blur, adaptive threshold and morphology of `binarize`
+
+When more than `max_unknown` of the pixels of a crop have a color outside the
+palette, e.g. the platform theme changed, the crop is binarized the adaptive
+way and after `recalibrate_after` such ticks in a row the palette is learned
+again. Palettes are stored in a JSON file by column name.
+"""
+import os
+import json
+import logging
+
+import cv2
+import numpy as np
+
+from ladder_layout import LINE_SHARE
+from metrics import metrics
+
+logger = logging.getLogger('root')
+
+# Bits kept per channel, the table has 2 ** (3 * BITS) entries
+BITS = 5
+# Largest distance of a color to the palette that still belongs to it
+TOLERANCE = 24
+# Text colors learned per RoI
+MAX_TEXT_COLORS = 3
+
+_SHIFT = 8 - BITS
+# Center color of every table entry, in B, G, R order
+_LEVELS = (np.arange(2 ** BITS) << _SHIFT) + (1 << _SHIFT) // 2
+_COLORS = np.stack(np.meshgrid(_LEVELS, _LEVELS, _LEVELS, indexing='ij'), axis=-1).reshape(-1, 3).astype(np.float32)
+
+
+def _bgr(image):
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image[..., :3]
+
+
+def color_index(image):
+    """Table index of every pixel of a BGRA, BGR or gray crop."""
+    bgr = _bgr(image)
+    b, g, r = (bgr[..., k] >> _SHIFT for k in range(3))
+    return (b.astype(np.uint16) << (2 * BITS)) | (g.astype(np.uint16) << BITS) | r
+
+
+class ColorKey:
+    def __init__(self, background, text, lines=()):
+        """Lookup table of one RoI palette.
+
+        Args
+        :background: (b, g, r) of the background
+        :text: [(b, g, r)] of the digits
+        :lines: [(b, g, r)] of the grid lines
+
+        Attributes
+        :lut: uint8 table, 255 for paper down to 0 for full ink
+        :known: bool table, True for the colors of the palette and the blends
+                of the background with a text color
+        """
+        self.background = [int(v) for v in background]
+        self.text = [[int(v) for v in color] for color in text]
+        self.lines = [[int(v) for v in color] for color in lines]
+        bg = np.float32(self.background)
+        coverage = np.zeros(len(_COLORS), np.float32)
+        known = np.linalg.norm(_COLORS - bg, axis=1) < TOLERANCE
+        for color in self.text:
+            step = np.float32(color) - bg
+            t = np.clip((_COLORS - bg) @ step / float(step @ step), 0, 1)
+            on_segment = np.linalg.norm(_COLORS - (bg + t[:, None] * step), axis=1) < TOLERANCE
+            coverage = np.where(on_segment, np.maximum(coverage, t), coverage)
+            known |= on_segment
+        for color in self.lines:
+            on_line = np.linalg.norm(_COLORS - np.float32(color), axis=1) < TOLERANCE
+            # A line drawn in a text color stays ink, the layout mask whitens it
+            coverage[on_line & (coverage < 0.5)] = 0
+            known |= on_line
+        self.lut = np.round(255 * (1 - coverage)).astype(np.uint8)
+        self.known = known
+
+    @classmethod
+    def calibrate(cls, image, contrast=40, min_share=0.1):
+        """Learn the palette of a RoI crop. Raises ValueError without text.
+
+        Args
+        :contrast: Smallest difference to the background of an ink pixel
+        :min_share: Smallest share of the ink pixels of a text color, counted
+                    with its blends with the background
+        """
+        index = color_index(image)
+        counts = np.bincount(index.ravel(), minlength=len(_COLORS))
+        background = _COLORS[counts.argmax()]
+        ink = np.abs(_COLORS[index] - background).max(axis=2) > contrast
+        line_pixels = np.zeros_like(ink)
+        line_pixels[ink.mean(axis=1) >= LINE_SHARE, :] = True
+        line_pixels[:, ink.mean(axis=0) >= LINE_SHARE] = True
+        line_pixels &= ink
+        lines = []
+        if line_pixels.any():
+            line_counts = np.bincount(index[line_pixels], minlength=len(_COLORS))
+            lines = [_COLORS[line_counts.argmax()]]
+
+        text_index = index[ink & ~line_pixels]
+        if not len(text_index):
+            raise ValueError('no text in the RoI')
+        text_counts = np.bincount(text_index, minlength=len(_COLORS)).astype(np.float64)
+        text = []
+        while len(text) < MAX_TEXT_COLORS and text_counts.any():
+            best = int(text_counts.argmax())
+            color = _COLORS[best]
+            # The blends of this color with the background are not another
+            # one, anti-aliased digits spread over many of them
+            step = color - background
+            t = np.clip((_COLORS - background) @ step / float(step @ step), 0, 1)
+            cluster = np.linalg.norm(_COLORS - (background + t[:, None] * step), axis=1) < TOLERANCE
+            if text_counts[cluster].sum() >= min_share * len(text_index):
+                text.append(color)
+            text_counts[cluster] = 0
+        if not text:
+            raise ValueError('no text color in the RoI')
+        return cls(background, text, lines)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['background'], data['text'], data.get('lines', ()))
+
+    def to_dict(self):
+        return {'background': self.background, 'text': self.text, 'lines': self.lines}
+
+    def apply(self, image, scale, max_unknown=0.02):
+        """Binarize a crop by its colors.
+
+        Returns (gray, binary) upscaled by `scale`, dark text on white, or
+        None when more than `max_unknown` of the pixels are not in the palette.
+        """
+        index = color_index(image)
+        if np.count_nonzero(~self.known[index]) > max_unknown * index.size:
+            return None
+        paper = self.lut[index]
+        gray = cv2.resize(paper, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
+        return gray, binary
+
+
+class ColorKeyStore:
+    def __init__(self, path='color_key.json', max_unknown=0.02, recalibrate_after=10):
+        """Color keys of the RoIs, calibrated on first use and kept in a file.
+
+        Args
+        :path: JSON file of the palettes
+        :max_unknown: Share of pixels outside the palette that makes a crop
+                      fall back to the adaptive binarization
+        :recalibrate_after: Fallbacks in a row after which the palette is
+                            learned again
+        """
+        self.path = path
+        self.max_unknown = max_unknown
+        self.recalibrate_after = recalibrate_after
+        self.keys = {}
+        self.misses = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    for col_name, data in json.load(f).items():
+                        self.keys[col_name] = ColorKey.from_dict(data)
+            except Exception as e:
+                logger.error(f'Ignored color keys {path}, could not be read: {e}')
+
+    @classmethod
+    def from_config(cls, config, instrument=None):
+        """Create from the `color_key` config section, or None if disabled.
+
+        An instrument of the supervisor keeps its palettes in its own file.
+        """
+        options = config.get('color_key') or {}
+        if not options.get('enabled', False):
+            return None
+        path = options.get('file', 'color_key.json')
+        if instrument is not None:
+            root, ext = os.path.splitext(path)
+            path = f'{root}_{instrument}{ext}'
+        return cls(path, options.get('max_unknown', 0.02), options.get('recalibrate_after', 10))
+
+    def _calibrate(self, col_name, image):
+        try:
+            key = ColorKey.calibrate(image)
+        except ValueError as e:
+            logger.debug('Color key of %s not calibrated: %s', col_name, e)
+            return None
+        self.keys[col_name] = key
+        logger.info(f'Calibrated color key of {col_name}: background {key.background}, text {key.text}')
+        self.save()
+        return key
+
+    def apply(self, col_name, image, scale):
+        """Binarize a crop with the key of its column, see `ColorKey.apply`.
+
+        Returns None when the crop has to be binarized the adaptive way.
+        """
+        key = self.keys.get(col_name)
+        if key is None:
+            key = self._calibrate(col_name, image)
+            if key is None:
+                return None
+        result = key.apply(image, scale, self.max_unknown)
+        if result is not None:
+            self.misses[col_name] = 0
+            metrics.incr('color_key_hits')
+            return result
+        metrics.incr('color_key_misses')
+        self.misses[col_name] = self.misses.get(col_name, 0) + 1
+        if self.misses[col_name] >= self.recalibrate_after:
+            logger.warning(f'Colors of {col_name} changed, learning its palette again')
+            self.misses[col_name] = 0
+            self._calibrate(col_name, image)
+        return None
+
+    def reset(self):
+        """Learn every palette again on its next frame, e.g. after new RoIs were selected."""
+        self.keys.clear()
+        self.misses.clear()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({col_name: key.to_dict() for col_name, key in self.keys.items()}, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f'Failed when saving color keys: {e}')
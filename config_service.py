@@ -0,0 +1,180 @@
+"""Live config
+
+`ConfigService` watches config.yaml and applies validated changes to the
+running pipeline without restarting it. The config dict is updated in place,
+so every holder of it (the aggregator, the OCR worker) sees the new values,
+and listeners are told which top-level keys changed so they can rebuild only
+what depends on them. Changes are taken against the config applied last, not
+the live dict, so a value the pipeline changed itself (RoIs moved by
+`roi_locator`) is kept until the file changes that key:
+
+- time_periods: the aggregator keeps its history, new periods are backfilled
+  from the retained samples (`Aggregator.set_periods`)
+- alarm_active, alarm_threshold_*: read on every tick by the rule engine,
+  nothing to rebuild
+- rois, screen_id, interval, conf_thresh, ocr_preset, ocr_profile: picked up
+  by the OCR worker and the daemon on their next tick
+
+Other keys (logfile, publisher, status_server, ...) are stored but only take
+effect after a restart.
+"""
+import os
+import copy
+import logging
+
+import yaml
+
+from config_utils import save_config
+from ocr_presets import resolve_preset, roi_presets
+
+logger = logging.getLogger('root')
+
+# Keys applied to a running pipeline, see module doc
+LIVE_KEYS = {
+    'interval', 'conf_thresh', 'rois', 'screen_id', 'time_periods', 'ocr_preset', 'ocr_profile',
+    'alarm_active', 'alarm_threshold_bid', 'alarm_threshold_ask',
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_config(config):
+    """Return a list of problems, empty if the config can be applied."""
+    if not isinstance(config, dict):
+        return ['config is not a mapping']
+    problems = []
+    periods = config.get('time_periods')
+    if not isinstance(periods, list) or not periods:
+        problems.append('time_periods must be a non-empty list')
+        periods = []
+    elif not all(isinstance(p, int) and not isinstance(p, bool) and p > 0 for p in periods):
+        problems.append('time_periods must be positive integers')
+    n_slots = len(periods) + 1
+    active = config.get('alarm_active')
+    if not isinstance(active, list) or len(active) < n_slots:
+        problems.append(f'alarm_active needs {n_slots} values')
+    for key in ('alarm_threshold_bid', 'alarm_threshold_ask'):
+        values = config.get(key)
+        if not isinstance(values, list) or len(values) < n_slots or not all(_is_number(v) for v in values):
+            problems.append(f'{key} needs {n_slots} numbers')
+    interval = config.get('interval')
+    if not isinstance(interval, int) or isinstance(interval, bool) or interval < 1:
+        problems.append('interval must be a positive integer')
+    conf_thresh = config.get('conf_thresh')
+    if not _is_number(conf_thresh) or not 0 <= conf_thresh <= 100:
+        problems.append('conf_thresh must be between 0 and 100')
+    screen_id = config.get('screen_id')
+    if not isinstance(screen_id, int) or screen_id < 0:
+        problems.append('screen_id must be a monitor index')
+    rois = config.get('rois')
+    if not isinstance(rois, dict):
+        problems.append('rois must have left and right')
+    else:
+        for side in ('left', 'right'):
+            roi = rois.get(side)
+            if not isinstance(roi, (list, tuple)) or len(roi) != 4 or not all(isinstance(v, int) for v in roi):
+                problems.append(f'rois.{side} must be 4 integers')
+    presets = config.get('ocr_preset') or {}
+    if not isinstance(presets, dict):
+        problems.append('ocr_preset must have left and right')
+    else:
+        for side in ('left', 'right'):
+            try:
+                resolve_preset(presets.get(side))
+            except ValueError as e:
+                problems.append(f'ocr_preset.{side}: {e}')
+    if config.get('ocr_profile'):
+        try:
+            roi_presets(config)
+        except Exception as e:
+            problems.append(f'ocr_profile: {e}')
+    return problems
+
+
+def config_changes(old, new):
+    """Return the top-level keys whose value differs, sorted."""
+    return sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ConfigService:
+    def __init__(self, config, path='config.yaml'):
+        """Watch a config file and apply its changes to a live config dict.
+
+        Args
+        :config: The config dict used by the running pipeline, updated in place
+        :path: Config file to watch
+        """
+        self.config = config
+        self.applied = copy.deepcopy(config)
+        self.path = path
+        self.mtime = _mtime(path)
+        self.listeners = []
+
+    def subscribe(self, callback):
+        """Call `callback(changed_keys)` after every applied change."""
+        self.listeners.append(callback)
+
+    def check(self):
+        """Apply the file if it changed since the last check. Cheap enough for every tick.
+
+        Returns the changed keys, or None if nothing was applied.
+        """
+        mtime = _mtime(self.path)
+        if mtime is None or mtime == self.mtime:
+            return None
+        self.mtime = mtime
+        try:
+            with open(self.path) as f:
+                new = yaml.load(f, Loader=yaml.FullLoader)
+        except Exception as e:
+            logger.error(f'Ignored {self.path}, could not be read: {e}')
+            return None
+        return self.apply(new)
+
+    def apply(self, new, save=False):
+        """Validate `new` and apply the difference to the live config.
+
+        Args
+        :new: Complete config
+        :save: Also write it to the config file
+
+        Returns the changed keys, or None if `new` is invalid.
+        """
+        problems = validate_config(new)
+        if problems:
+            logger.error(f'Ignored invalid config: {"; ".join(problems)}')
+            return None
+        if save:
+            save_config(new, self.path)
+            self.mtime = _mtime(self.path)
+        changed = config_changes(self.applied, new)
+        if not changed:
+            return changed
+        restart = [key for key in changed if key not in LIVE_KEYS]
+        if restart:
+            logger.warning(f'Config {", ".join(restart)} changed, takes effect after a restart')
+
+        # Key by key, other threads read and write the dict while this runs
+        new = copy.deepcopy(new)
+        for key in changed:
+            if key in new:
+                self.config[key] = copy.deepcopy(new[key])
+            else:
+                self.config.pop(key, None)
+        self.applied = new
+        logger.info(f'Applied config change: {", ".join(changed)}')
+        for callback in self.listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.error(f'Failed when applying config change: {e}')
+        return changed
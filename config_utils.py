@@ -0,0 +1,112 @@
+"""Config helpers shared by the GUI and the headless daemon."""
+import os
+import copy
+import logging
+
+import yaml
+
+# Default config if not found config.yaml
+default_config = {
+    'alerts': {
+        'sinks': ['sound', 'log'],
+        'rate_limit': 3,
+        'rate_window': 60,
+        'dedup_window': 10,
+        'priorities': {'newest': 2},
+        'sound_file': 'alarm.mp3',
+        'zmq_endpoint': 'tcp://127.0.0.1:5557',
+        'webhook_url': '',
+    },
+    'color_key': {
+        'enabled': True,
+        'file': 'color_key.json',
+        'max_unknown': 0.02,
+        'recalibrate_after': 10,
+    },
+    'conf_thresh' : 80,
+    'consensus': {
+        'window': 3,
+        'recheck': True,
+        'scroll_share': 0.5,
+    },
+    'debug': False,
+    'debug_recorder': {
+        'out_dir': 'debug',
+        'capacity': 30,
+        'every': 0,
+        'low_conf': 50,
+        'on_alarm': True,
+        'alarm_cooldown': 60,
+    },
+    'interval': 1,
+    'ocr_engine': {
+        'name': 'tesseract',
+        'model': 'models/digits_crnn.onnx',
+    },
+    'ocr_profile': '',
+    'ocr_timeout': 2,
+    'ocr_preset': {
+        'left': 'balanced',
+        'right': 'balanced',
+    },
+    'ladder_layout': {
+        'enabled': True,
+        'file': 'ladder_layout.json',
+        'psm': 7,
+    },
+    'logfile': 'app.log',
+    'tick_log': '',
+    'screen_id' : 1,   
+    'stall_timeout': 10,
+    'roi_tracking': {
+        'enabled': True,
+        'check_every': 10,
+        'threshold': 0.6,
+        'downscale': 4,
+        'margin': 20,
+    },
+    'rois': {
+        'left': [0, 0, 0, 0],
+        'right': [0, 0, 0, 0]
+    },
+    'time_periods': [10, 20, 30, 60, 300, 1200, 1800],
+    'alarm_active': [True ,True, True, True, True, True, True, True],
+    'alarm_threshold_bid': [1000, 1, 1, 1, 1, 1, 1, 1],
+    'alarm_threshold_ask': [1000, 1, 1, 1, 1, 1, 1, 1],
+    'chart_span': 7200,
+    'chart_width': 120,
+    'publisher': {
+        'enabled': False,
+        'endpoint': 'tcp://127.0.0.1:5556',
+        'instrument': 'default',
+        'sndhwm': 100,
+    },
+    'status_server': {
+        'enabled': False,
+        'host': '127.0.0.1',
+        'port': 8765,
+    },
+}
+
+
+def load_config(config_file='config.yaml'):
+    config = copy.deepcopy(default_config)
+    try:
+        with open(config_file) as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+    except FileNotFoundError:
+        logging.exception('Not found config file')
+    except Exception as e:
+        logging.exception(f'Unexpected error: {e}')
+    return config
+
+
+def save_config(config, config_file='config.yaml'):
+    # Written next to the file and renamed, so a reader never sees half of it
+    tmp_file = config_file + '.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            yaml.dump(config, f)
+        os.replace(tmp_file, config_file)
+    except:
+        logging.exception(f'Failed when saving config: {config}')
@@ -0,0 +1,122 @@
+"""Multi-frame consensus of OCR rows
+
+A single misread digit, or a token under `conf_thresh`, used to go straight
+into the sums. With consensus, the value of each ladder row is voted over the
+last `window` frames, every reading weighted by its Tesseract confidence, so
+a one-frame misread is outvoted by the frames around it.
+
+Only suspect rows get a second, slower reading (see `ocr_utils.recheck_strip`):
+
+- rows read below `conf_thresh`
+- rows whose text disagrees with the vote of the previous frames
+
+When the slow reading agrees with the fast one, the new value is confirmed at
+once and the older readings of the row are dropped, so a real change is not
+delayed. When most rows disagree at once, the ladder has scrolled: the
+history is dropped instead of re-reading every row.
+
+Rows are identified by their position in the column. This module has no
+OpenCV or Tesseract dependency, the slow reading is passed in.
+"""
+from collections import deque, defaultdict
+
+from metrics import metrics
+
+
+def _observe(cells):
+    # (text, conf, cells) of one reading of a row, empty words are dropped
+    words = [cell for cell in cells if str(cell[4]).strip()]
+    if not words:
+        return '', 0.0, []
+    return ' '.join(cell[4] for cell in words), min(float(cell[5]) for cell in words), words
+
+
+def _winner(history):
+    # (text, conf, cells) of the text with the most confidence over the history
+    weights = defaultdict(float)
+    for text, conf, _ in history:
+        if text:
+            weights[text] += conf
+    if not weights:
+        return '', 0.0, []
+    best = max(weights, key=weights.get)
+    readings = [reading for reading in history if reading[0] == best]
+    return best, max(conf for _, conf, _ in readings), readings[-1][2]
+
+
+class Consensus:
+    def __init__(self, window=3, recheck=True, scroll_share=0.5):
+        """Vote the rows of each column over recent frames.
+
+        Args
+        :window: Number of frames voted over
+        :recheck: Read suspect rows again with the slow reading
+        :scroll_share: When more than this share of the rows disagree, the
+                       ladder is taken as scrolled and the history dropped
+        """
+        self.window = window
+        self.recheck = recheck
+        self.scroll_share = scroll_share
+        self.columns = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """Create from the `consensus` config section, or None if `window` is under 2."""
+        options = config.get('consensus') or {}
+        window = options.get('window', 3)
+        if window < 2:
+            return None
+        return cls(window, options.get('recheck', True), options.get('scroll_share', 0.5))
+
+    def reset(self):
+        """Forget every column, e.g. after the RoIs moved."""
+        self.columns.clear()
+
+    def vote(self, col_name, rows, conf_thresh, recheck=None):
+        """Add the rows of one frame and return the voted rows.
+
+        Args
+        :col_name: Column the rows belong to
+        :rows: Cells of each row, from top to bottom, unfiltered
+        :conf_thresh: Rows read at or below this confidence are suspect
+        :recheck: Function of the row index returning its cells read the slow way
+
+        Returns
+        :rows: Cells of each row. The cells carry the voted confidence, to be
+               filtered with `conf_thresh` by the caller.
+        """
+        readings = [_observe(cells) for cells in rows]
+        history = self.columns.get(col_name)
+        if history is None or len(history) != len(rows):
+            history = [deque(maxlen=self.window) for _ in rows]
+            self.columns[col_name] = history
+
+        previous = [_winner(h)[0] if h else None for h in history]
+        disagree = [k for k, reading in enumerate(readings)
+                    if previous[k] is not None and reading[0] != previous[k]]
+        if len(disagree) > self.scroll_share * len(rows):
+            metrics.incr('consensus_resets')
+            for h in history:
+                h.clear()
+            disagree = []
+        suspect = sorted(set(disagree) | {k for k, reading in enumerate(readings) if reading[1] <= conf_thresh})
+
+        if self.recheck and recheck is not None:
+            for k in suspect:
+                metrics.incr('consensus_rechecks')
+                slow = _observe(recheck(k))
+                if slow[0] and slow[0] == readings[k][0]:
+                    # Both readings agree, take the value at once
+                    history[k].clear()
+                    readings[k] = (slow[0], max(slow[1], readings[k][1]), readings[k][2])
+                elif slow[1] > readings[k][1]:
+                    readings[k] = slow
+
+        voted = []
+        for k, reading in enumerate(readings):
+            history[k].append(reading)
+            text, conf, cells = _winner(history[k])
+            if text != reading[0]:
+                metrics.incr('consensus_overrides')
+            voted.append([cell[:5] + (conf,) for cell in cells])
+        return voted
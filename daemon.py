@@ -0,0 +1,280 @@
+"""L2-easy headless daemon
+
+Runs the capture -> OCR -> aggregation loop without PyQt, pygame or the
+license check, so instruments can be spread across Linux servers. RoIs and
+time periods are read from config.yaml, ticks go to stdout, a file or a
+ZeroMQ socket.
+
+Usage
+    python daemon.py                                   # screen, JSON lines to stdout
+    python daemon.py --output ticks.jsonl              # append JSON lines to a file
+    python daemon.py --output tcp://0.0.0.0:5556 --instrument ES
+    python daemon.py --source ./frames --interval 0    # recorded frames, as fast as possible
+
+With `debug: true`, send SIGUSR1 to write the debug images of the recent
+ticks, see `debug_recorder`.
+
+On a server without a monitor, run it against a virtual display:
+    Xvfb :99 -screen 0 1920x1080x24 &
+    DISPLAY=:99 python daemon.py --screen-id 1
+"""
+import time
+# Taken before any other import so that import time is part of the startup time
+_T0 = time.perf_counter()
+
+import sys
+import json
+import signal
+import logging
+import argparse
+import threading
+
+from aggregator import Aggregator, column_values, tick_record
+from alerts import AlertDispatcher
+from capture_utils import open_source
+from color_key import ColorKeyStore
+from config_service import ConfigService
+from consensus import Consensus
+from config_utils import load_config
+from debug_recorder import DebugRecorder
+from dnn_ocr import DigitRecognizer
+from ladder_layout import LayoutStore
+from log_utils import setup_logging, tick_logger
+from metrics import metrics
+from ocr_presets import roi_presets
+from roi_locator import RoiLocator
+from ocr_utils import extract_rois, set_ocr_timeout
+from perf_utils import PhaseTimer
+from status_server import StatusServer
+
+_T_IMPORTS = time.perf_counter()
+
+logger = logging.getLogger('root')
+
+
+class JsonLinesSink:
+    def __init__(self, stream, instrument):
+        """Write one JSON object per tick to a text stream."""
+        self.stream = stream
+        self.instrument = instrument
+
+    def write(self, tick, sums, rows, instrument=None):
+        record = tick_record(tick, sums, rows, instrument or self.instrument)
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+class PublisherSink:
+    def __init__(self, endpoint, instrument, sndhwm=100):
+        """Publish ticks on a ZeroMQ PUB socket, see `publisher.TickPublisher`."""
+        from publisher import TickPublisher
+        self.publisher = TickPublisher(endpoint, instrument, sndhwm)
+
+    def write(self, tick, sums, rows, instrument=None):
+        self.publisher.publish(tick['timestamp'], sums, rows, tick['ratios'], instrument)
+
+    def close(self):
+        self.publisher.close()
+
+
+def open_sink(output, instrument, sndhwm=100):
+    """Create a sink from a command-line value: '-', a file path or a tcp:// / ipc:// address."""
+    if output == '-':
+        return JsonLinesSink(sys.stdout, instrument)
+    if output.startswith(('tcp://', 'ipc://')):
+        return PublisherSink(output, instrument, sndhwm)
+    return JsonLinesSink(open(output, 'a'), instrument)
+
+
+def run(config, source, sink, interval, max_ticks=None, stop_event=None, startup=None, status=None, recorder=None,
+        service=None, alerts=None, trace=None):
+    """Capture, extract and aggregate until the source is exhausted or stopped.
+
+    Args
+    :config: App config
+    :source: Frame source, see `capture_utils`
+    :sink: Tick sink with a `write(tick, sums, rows, instrument=None)` method
+    :interval: Seconds between ticks. 0 runs as fast as possible.
+    :max_ticks: Stop after this many ticks if set
+    :stop_event: threading.Event that stops the loop when set
+    :startup: PhaseTimer that records the first tick
+    :status: StatusServer that is given the state of every tick
+    :recorder: DebugRecorder of the crops and intermediate images
+    :service: ConfigService checked once per tick, changes of RoIs, periods,
+              alarm settings, interval and screen_id are applied without
+              restarting. They replace --interval and --screen-id.
+    :alerts: AlertDispatcher of the alarms, they are only logged if None
+    :trace: Called with 'captured', 'parsed' and 'aggregated' as each tick
+            passes these stages, see bench_latency.py
+    """
+    stop_event = stop_event or threading.Event()
+    set_ocr_timeout(config.get('ocr_timeout', 2))
+    conf_thresh = config.get('conf_thresh', 80)
+    rois = {'bid': config['rois']['left'], 'ask': config['rois']['right']}
+    aggregator = Aggregator(config)
+    consensus = Consensus.from_config(config)
+    presets = roi_presets(config)
+    locator = RoiLocator.from_config(config, rois)
+    layouts = LayoutStore.from_config(config)
+    keys = ColorKeyStore.from_config(config)
+    engine = DigitRecognizer.from_config(config)
+
+    # A column that could not be read keeps its previous value, like the GUI
+    sums = {'bid': 0, 'ask': 0}
+    rows = {'bid': [], 'ask': []}
+    n_ticks = 0
+    # Flagged in the status like the GUI watchdog, the loop itself never hangs
+    last_read = time.monotonic()
+    stalled = False
+    next_time = time.monotonic()
+    while not stop_event.is_set():
+        changed = service.check() if service is not None else None
+        if changed:
+            conf_thresh = config.get('conf_thresh', 80)
+            presets = roi_presets(config)
+            if 'rois' in changed:
+                rois = {'bid': config['rois']['left'], 'ask': config['rois']['right']}
+                if consensus is not None:
+                    consensus.reset()
+                if locator is not None:
+                    locator.reset(rois)
+                if layouts is not None:
+                    layouts.reset()
+                if keys is not None:
+                    keys.reset()
+            if 'time_periods' in changed:
+                aggregator.set_periods(config['time_periods'])
+            if 'interval' in changed:
+                interval = config['interval']
+            if 'screen_id' in changed and hasattr(source, 'set_screen'):
+                source.set_screen(config['screen_id'])
+
+        frame = source.grab()
+        if frame is None:
+            break
+        if trace is not None:
+            trace('captured')
+        if locator is not None and locator.update(frame):
+            # The ladder window moved, `rois` was updated in place. Written
+            # back like the GUI does.
+            config['rois'] = {'left': list(rois['bid']), 'right': list(rois['ask'])}
+            if consensus is not None:
+                consensus.reset()
+
+        results = extract_rois(frame, rois, conf_thresh, recorder, consensus, presets, layouts, engine, keys)
+        metrics.event('ocr_tick')
+        if results:
+            last_read = time.monotonic()
+        else:
+            logger.warning('Not found anything')
+        if (time.monotonic() - last_read >= config.get('stall_timeout', 10)) != stalled:
+            stalled = not stalled
+            if stalled:
+                metrics.incr('ocr_stalls')
+                logger.error(f'Nothing read for {config.get("stall_timeout", 10)}s, values are stale')
+            else:
+                logger.info('OCR recovered')
+        for col_name, rs in results.items():
+            sums[col_name], rows[col_name] = column_values(rs)
+        if trace is not None:
+            trace('parsed')
+
+        # A replayed source gives the simulated time of the tick
+        tick = aggregator.update(sums['bid'], sums['ask'], getattr(source, 'timestamp', None))
+        if trace is not None:
+            trace('aggregated')
+        if alerts is not None:
+            alerts.submit_tick(tick, aggregator.periods, getattr(sink, 'instrument', None))
+        else:
+            for slot, side, value in tick['alarms']:
+                logger.warning('Alarm on slot %s %s: %s', slot, side, value)
+        if tick['alarms'] and recorder is not None:
+            recorder.alarm()
+        metrics.event('aggregate_tick')
+        sink.write(tick, dict(sums), dict(rows))
+        if tick_logger.isEnabledFor(logging.INFO):
+            tick_logger.info(tick_record(tick, dict(sums), dict(rows), getattr(sink, 'instrument', None)))
+        if status is not None:
+            state = tick_record(tick, dict(sums), dict(rows), getattr(sink, 'instrument', None))
+            state['worker'] = {'running': True, 'stalled': stalled}
+            status.publish(state)
+        if startup is not None:
+            startup.mark('first_ocr_tick')
+
+        n_ticks += 1
+        if max_ticks is not None and n_ticks >= max_ticks:
+            break
+        if interval > 0:
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                stop_event.wait(delay)
+            else:
+                # Running late, do not try to catch up with a burst of ticks
+                next_time = time.monotonic()
+    return n_ticks
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the OCR pipeline without GUI.')
+    parser.add_argument('--config', default='config.yaml', help='Config file')
+    parser.add_argument('--source', default='screen', help="'screen' or a directory of frames")
+    parser.add_argument('--screen-id', type=int, default=None, help='Monitor to capture, overrides config')
+    parser.add_argument('--output', default='-', help="'-' for stdout, a file path, or a tcp:// address")
+    parser.add_argument('--instrument', default=None, help='Instrument name put on every tick')
+    parser.add_argument('--interval', type=float, default=None, help='Seconds between ticks, overrides config')
+    parser.add_argument('--max-ticks', type=int, default=None, help='Stop after this many ticks')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    startup = PhaseTimer(_T0)
+    with startup.phase('config'):
+        config = load_config(args.config)
+        level = logging.DEBUG if config['debug'] else logging.INFO
+        setup_logging(level, stream=sys.stderr, tick_log=config.get('tick_log'))
+    startup.record('imports', _T_IMPORTS - _T0)
+
+    publisher_config = config.get('publisher') or {}
+    instrument = args.instrument or publisher_config.get('instrument', 'default')
+    screen_id = args.screen_id if args.screen_id is not None else config['screen_id']
+    interval = args.interval if args.interval is not None else config['interval']
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    with startup.phase('open_source_and_sink'):
+        source = open_source(args.source, screen_id)
+        sink = open_sink(args.output, instrument, publisher_config.get('sndhwm', 100))
+        recorder = DebugRecorder.from_config(config)
+        # No sound without a GUI, the log sink replaces it
+        alerts = AlertDispatcher.from_config(config, exclude=('sound',))
+        status = StatusServer.from_config(config)
+        if status is not None:
+            status.recorder = recorder
+            status.start()
+    if recorder is not None and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda *_: recorder.dump())
+    logger.info(f'Daemon started: source={args.source} output={args.output} instrument={instrument}')
+    try:
+        service = ConfigService(config, args.config)
+        n_ticks = run(config, source, sink, interval, args.max_ticks, stop_event, startup, status, recorder, service, alerts)
+    finally:
+        source.close()
+        sink.close()
+        alerts.close()
+        if recorder is not None:
+            recorder.close()
+        if status is not None:
+            status.stop()
+    logger.info(f'Daemon stopped after {n_ticks} ticks')
+
+
+if __name__ == '__main__':
+    main()
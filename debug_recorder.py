@@ -0,0 +1,179 @@
+"""Sampled debug image recorder
+
+The OCR path hands its crops and intermediate images to the recorder instead
+of writing them to disk. The recorder keeps the images of the last ticks in a
+bounded in-memory ring and a background thread writes:
+
+- sampled ticks: every Nth tick, ticks with a low confidence cell, and the
+  recent ticks when an alarm fires
+- a bundle of the whole ring on request (`dump()`, POST /debug/dump on the
+  status server, or SIGUSR1 for the daemon)
+
+Each write goes to its own time-stamped directory under `out_dir`:
+
+    debug/20240105-093012.123_low_conf/000042_roi_bid.png
+                                       000042_thresh_bid.png
+                                       ...
+                                       ticks.json
+
+The OCR thread only keeps references, nothing is encoded or written on it.
+"""
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from collections import deque
+
+import cv2
+
+from metrics import metrics
+
+logger = logging.getLogger('root')
+
+# Pending writes. When the disk is slower than that, writes are dropped.
+WRITE_QUEUE_SIZE = 8
+
+
+class DebugRecorder:
+    def __init__(self, out_dir='debug', capacity=30, every=0, low_conf=None, on_alarm=True, alarm_cooldown=60):
+        """Keep debug images of recent ticks and write samples of them in the background.
+
+        Args
+        :out_dir: Directory of the written bundles
+        :capacity: Number of ticks kept in memory
+        :every: Write every Nth tick, 0 to disable
+        :low_conf: Write ticks with a cell below this confidence or an empty
+                   column, None to disable
+        :on_alarm: Write the ring when an alarm fires
+        :alarm_cooldown: Seconds between two alarm bundles
+
+        The images of a tick are added by one thread (the OCR worker) and
+        closed with `end_tick()`.
+        """
+        self.out_dir = out_dir
+        self.every = every
+        self.low_conf = low_conf
+        self.on_alarm = on_alarm
+        self.alarm_cooldown = alarm_cooldown
+        self.last_alarm_dump = 0
+        self.n_ticks = 0
+        self.current = {}
+        self.min_conf = None
+        self.ring = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._writer, name='debug-recorder', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a recorder from the `debug_recorder` config section, or None if `debug` is off."""
+        if not config.get('debug', False):
+            return None
+        options = config.get('debug_recorder') or {}
+        return cls(
+            options.get('out_dir', 'debug'),
+            options.get('capacity', 30),
+            options.get('every', 0),
+            options.get('low_conf'),
+            options.get('on_alarm', True),
+            options.get('alarm_cooldown', 60),
+        )
+
+    def add(self, name, image, copy=False):
+        """Add an image to the current tick.
+
+        Args
+        :name: File name without extension, e.g. 'thresh_bid'
+        :image: uint8 array. It must not be modified afterwards.
+        :copy: Copy the image first. Needed for views into a frame whose
+               memory is reused, e.g. a crop of a frame ring slot.
+        """
+        self.current[name] = image.copy() if copy else image
+
+    def note_results(self, cells):
+        """Track the lowest confidence of the tick, an empty column counts as 0.
+
+        Args
+        :cells: `ocr_records.CELL_DTYPE` array of one column
+        """
+        conf = float(cells['conf'].min()) if len(cells) else 0
+        if self.min_conf is None or conf < self.min_conf:
+            self.min_conf = conf
+
+    def end_tick(self, info=None):
+        """Move the current images into the ring and queue a write if sampled.
+
+        Args
+        :info: JSON-serializable data stored with the tick, e.g. the results
+        """
+        self.n_ticks += 1
+        entry = {
+            'tick': self.n_ticks,
+            'timestamp': time.time(),
+            'min_conf': self.min_conf,
+            'info': info,
+            'images': self.current,
+        }
+        self.current = {}
+        self.min_conf = None
+        with self.lock:
+            self.ring.append(entry)
+
+        if self.every and self.n_ticks % self.every == 0:
+            self._queue('sample', [entry])
+        elif self.low_conf is not None and entry['min_conf'] is not None and entry['min_conf'] < self.low_conf:
+            self._queue('low_conf', [entry])
+
+    def alarm(self, now=None):
+        """Write the recent ticks because an alarm fired, at most once per cooldown."""
+        now = time.time() if now is None else now
+        if not self.on_alarm or now - self.last_alarm_dump < self.alarm_cooldown:
+            return
+        self.last_alarm_dump = now
+        self.dump('alarm')
+
+    def dump(self, reason='request'):
+        """Queue a bundle of every tick in the ring. Returns the number of ticks."""
+        with self.lock:
+            entries = list(self.ring)
+        if entries:
+            self._queue(reason, entries)
+        return len(entries)
+
+    def _queue(self, reason, entries):
+        try:
+            self.queue.put_nowait((time.time(), reason, entries))
+        except queue.Full:
+            metrics.incr('debug_dropped')
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.error(f'Failed to write debug images: {e}')
+
+    def _write(self, timestamp, reason, entries):
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp)) + f'.{int(timestamp * 1000) % 1000:03d}'
+        path = os.path.join(self.out_dir, f'{stamp}_{reason}')
+        os.makedirs(path, exist_ok=True)
+        meta = []
+        for entry in entries:
+            for name, image in entry['images'].items():
+                cv2.imwrite(os.path.join(path, f"{entry['tick']:06d}_{name}.png"), image)
+            meta.append({key: value for key, value in entry.items() if key != 'images'})
+        with open(os.path.join(path, 'ticks.json'), 'w') as f:
+            json.dump(meta, f, indent=1, default=str)
+        metrics.incr('debug_bundles')
+        logger.debug(f'Wrote {len(entries)} debug ticks to {path}')
+
+    def close(self):
+        """Stop the writer after the queued writes."""
+        self.queue.put(None)
+        self.thread.join(5)
@@ -0,0 +1,88 @@
+"""Neural digit recognizer
+
+A small CRNN digit model trained with CTC (see train_digits.py), run on the
+CPU through `cv2.dnn`. Every cell of every RoI of a tick goes through one
+forward pass, see `ocr_utils.extract_rois`.
+
+The model is an ONNX file with
+- input: (N, 1, INPUT_HEIGHT, INPUT_WIDTH) float32, gray scaled to [0, 1],
+  dark digits on a light background, left aligned and padded with white
+- output: (N, T, len(ALPHABET) + 1) log probabilities per time step, class 0
+  is the CTC blank
+"""
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('root')
+
+ALPHABET = '0123456789,.'
+INPUT_HEIGHT = 32
+INPUT_WIDTH = 128
+
+
+def prepare_cell(gray):
+    """Resize a gray cell to the model input, dark digits on white, as float32 in [0, 1]."""
+    if gray.mean() < 128:
+        gray = 255 - gray
+    h, w = gray.shape
+    width = max(1, min(INPUT_WIDTH, int(round(w * INPUT_HEIGHT / max(1, h)))))
+    cell = np.full((INPUT_HEIGHT, INPUT_WIDTH), 255, np.uint8)
+    cell[:, :width] = cv2.resize(gray, (width, INPUT_HEIGHT), interpolation=cv2.INTER_AREA)
+    return cell.astype(np.float32) / 255
+
+
+def ctc_decode(probs):
+    """Greedy CTC decoding of one (T, classes) array of probabilities.
+
+    Returns (text, conf) where conf is the lowest probability of a kept
+    step, in percent like Tesseract.
+    """
+    best = probs.argmax(axis=1)
+    text = []
+    confs = []
+    previous = 0
+    for step, label in enumerate(best):
+        if label != 0 and label != previous:
+            text.append(ALPHABET[label - 1])
+            confs.append(probs[step, label])
+        previous = label
+    return ''.join(text), float(min(confs) * 100) if confs else 0.0
+
+
+class DigitRecognizer:
+    def __init__(self, model_path):
+        """Load a CRNN digit model for CPU inference.
+
+        Args
+        :model_path: ONNX file written by train_digits.py
+        """
+        self.net = cv2.dnn.readNet(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        logger.info(f'Loaded digit model {model_path}')
+
+    @classmethod
+    def from_config(cls, config):
+        """Create from the `ocr_engine` config section, or None for Tesseract."""
+        options = config.get('ocr_engine') or {}
+        if options.get('name', 'tesseract') != 'dnn':
+            return None
+        return cls(options.get('model', 'models/digits_crnn.onnx'))
+
+    def recognize(self, cells):
+        """Read gray cells in one forward pass.
+
+        Args
+        :cells: List of gray uint8 arrays, one number each
+
+        Returns
+        :results: [(text, conf)] in the order of `cells`
+        """
+        if not cells:
+            return []
+        batch = np.stack([prepare_cell(cell) for cell in cells])[:, None]
+        self.net.setInput(batch)
+        out = np.exp(self.net.forward())
+        return [ctc_decode(probs) for probs in out]
@@ -0,0 +1,136 @@
+"""Shared-memory frame ring
+
+The capture process writes raw BGRA pixels of a screen region into
+preallocated slots, OCR worker processes read them as NumPy views without
+pickling or copying.
+
+Slot ownership is tracked with sequence numbers. Frame `n` lives in slot
+`n % n_slots`, whose sequence number is odd while the capture side writes it
+and `2 * n + 2` once it is complete. A reader takes the newest frame, works
+on the view, and calls `still_valid(n)` to make sure the slot was not
+reused meanwhile. With a few slots and a capture interval of a second, a
+frame is only reused after several seconds.
+"""
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+HEADER_DTYPE = np.dtype([
+    ('write_seq', '<u8'),   # Number of frames written so far
+    ('heartbeat', '<f8'),   # Last time the capture side was alive
+    ('n_slots', '<u4'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+])
+
+SLOT_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('timestamp', '<f8'),
+])
+
+CHANNELS = 4  # BGRA as delivered by mss
+# Pixel data starts on a cache line
+ALIGN = 64
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class FrameRing:
+    def __init__(self, name, shape=None, n_slots=4, create=False):
+        """Ring of BGRA frames in shared memory.
+
+        Args
+        :name: Shared memory name
+        :shape: (height, width) of the frames, required when creating
+        :n_slots: Number of frames kept, only used when creating
+        :create: Create the segment (the supervisor) or attach to it
+        """
+        self.name = name
+        meta_offset = _align(HEADER_DTYPE.itemsize)
+        if create:
+            height, width = shape
+            data_offset = _align(meta_offset + SLOT_DTYPE.itemsize * n_slots)
+            size = data_offset + n_slots * height * width * CHANNELS
+            try:
+                # Left over by a supervisor that was killed
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = create
+
+        self.header = np.ndarray((1,), HEADER_DTYPE, buffer=self.shm.buf)
+        if create:
+            self.header[0] = (0, 0.0, n_slots, height, width)
+        self.n_slots = int(self.header['n_slots'][0])
+        self.shape = (int(self.header['height'][0]), int(self.header['width'][0]), CHANNELS)
+        data_offset = _align(meta_offset + SLOT_DTYPE.itemsize * self.n_slots)
+        self.meta = np.ndarray((self.n_slots,), SLOT_DTYPE, buffer=self.shm.buf, offset=meta_offset)
+        self.frames = np.ndarray((self.n_slots,) + self.shape, np.uint8, buffer=self.shm.buf, offset=data_offset)
+        if create:
+            self.meta['seq'] = 0
+
+    def write(self, bgra, timestamp=None):
+        """Copy one frame into the next slot. Only one process may write.
+
+        Args
+        :bgra: Raw BGRA bytes (e.g. mss `ScreenShot.raw`) or a (h, w, 4) uint8 array
+        :timestamp: Capture time, defaults to now
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        n = int(self.header['write_seq'][0])
+        index = n % self.n_slots
+        self.meta['seq'][index] = 2 * n + 1
+        if isinstance(bgra, np.ndarray):
+            self.frames[index] = bgra
+        else:
+            self.frames[index] = np.frombuffer(bgra, np.uint8).reshape(self.shape)
+        self.meta['timestamp'][index] = timestamp
+        self.meta['seq'][index] = 2 * n + 2
+        self.header['write_seq'] = n + 1
+        self.header['heartbeat'] = timestamp
+
+    def beat(self):
+        self.header['heartbeat'] = time.time()
+
+    @property
+    def write_seq(self):
+        return int(self.header['write_seq'][0])
+
+    @property
+    def heartbeat(self):
+        return float(self.header['heartbeat'][0])
+
+    def latest(self, after=-1):
+        """Return (n, timestamp, frame) of the newest frame newer than frame `after`.
+
+        `frame` is a read-only view into shared memory, valid as long as
+        `still_valid(n)` is true. Returns None if there is no newer frame.
+        """
+        write_seq = self.write_seq
+        n = write_seq - 1
+        if n < 0 or n <= after:
+            return None
+        index = n % self.n_slots
+        if int(self.meta['seq'][index]) != 2 * n + 2:
+            return None
+        frame = self.frames[index]
+        frame.flags.writeable = False
+        return n, float(self.meta['timestamp'][index]), frame
+
+    def still_valid(self, n):
+        """True if frame `n` was not overwritten since it was taken."""
+        return int(self.meta['seq'][n % self.n_slots]) == 2 * n + 2
+
+    def close(self):
+        del self.header, self.meta, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,245 @@
+"""Ladder layout calibration
+
+The ladder has a fixed row pitch and fixed column positions, so its layout is
+learned once per RoI instead of on every tick:
+
+- rows: the cells between the horizontal grid lines. Without grid lines,
+  the row pitch is measured from the text rows of one frame and the rows
+  are laid out over the whole RoI with it. Rows that are empty during
+  calibration still get a cell either way.
+- cell box: the horizontal extent of the text, widened to the vertical grid
+  lines around it
+- grid mask: pixel rows and columns that are almost all ink
+
+Later ticks whiten the grid mask instead of searching for lines, cut every
+cell by index and read it in single-line (psm 7) or single-word (psm 8)
+mode, see `ocr_utils.extract_data`.
+
+Layouts are stored in a JSON file by column name with the RoI size they were
+learned for. A RoI of another size is calibrated again on its next frame.
+
+Usage
+    python ladder_layout.py --source ./frames   # calibrate from the first frame
+    python ladder_layout.py                     # calibrate from the screen
+"""
+import os
+import json
+import logging
+import argparse
+
+import numpy as np
+
+from ocr_utils import row_strips, to_gray
+
+logger = logging.getLogger('root')
+
+# Scale of the gray image rows are measured on, `row_strips` is tuned for it
+CALIBRATION_SCALE = 4
+
+# Share of ink that makes a pixel row or column a grid line
+LINE_SHARE = 0.8
+
+
+def _ink(gray, contrast=40):
+    return np.abs(gray.astype(np.int16) - int(np.median(gray))) > contrast
+
+
+class LadderLayout:
+    def __init__(self, size, rows, x_range, h_lines=(), v_lines=()):
+        """Rows, cell box and grid lines of one RoI, in RoI pixels.
+
+        Args
+        :size: (width, height) of the RoI
+        :rows: [(y1, y2)] from top to bottom
+        :x_range: (x1, x2) of the cells
+        :h_lines: y of the horizontal grid lines
+        :v_lines: x of the vertical grid lines
+        """
+        self.size = tuple(size)
+        self.rows = [tuple(row) for row in rows]
+        self.x_range = tuple(x_range)
+        self.h_lines = list(h_lines)
+        self.v_lines = list(v_lines)
+        self.psm = 7
+        self._masks = {}
+
+    @classmethod
+    def calibrate(cls, image):
+        """Learn the layout of a RoI crop. Raises ValueError without text."""
+        gray = to_gray(image, 1)
+        h, w = gray.shape
+        ink = _ink(gray)
+        h_lines = np.flatnonzero(ink.mean(axis=1) >= LINE_SHARE)
+        v_lines = np.flatnonzero(ink.mean(axis=0) >= LINE_SHARE)
+        text = ink.copy()
+        text[h_lines, :] = False
+        text[:, v_lines] = False
+        xs = np.flatnonzero(text.any(axis=0))
+        # Vertical lines would join every row into one
+        scaled = to_gray(image, CALIBRATION_SCALE)
+        background = int(np.median(scaled))
+        for x in v_lines:
+            scaled[:, max(0, x * CALIBRATION_SCALE - 1):(x + 1) * CALIBRATION_SCALE + 1] = background
+        strips = row_strips(scaled)
+        if not len(xs) or not strips:
+            raise ValueError('no text in the RoI')
+
+        left = v_lines[v_lines < xs[0]]
+        right = v_lines[v_lines > xs[-1]]
+        x_range = (int(left[-1]) + 1 if len(left) else 0, int(right[0]) if len(right) else w)
+
+        # Runs of adjacent line pixels are one grid line
+        lines = [run for run in np.split(h_lines, np.flatnonzero(np.diff(h_lines) > 1) + 1) if len(run)]
+        # Center of the text of each strip, the strips reach into the gaps
+        scaled_ink = _ink(scaled).any(axis=1)
+        centers = []
+        for y1, y2 in strips:
+            ys = np.flatnonzero(scaled_ink[y1:y2])
+            centers.append((2 * y1 + ys[0] + ys[-1] + 1) / 2 / CALIBRATION_SCALE)
+        if len(lines) >= 2:
+            pitch = float(np.median(np.diff([run[0] for run in lines])))
+            bounds = [0] + [edge for run in lines for edge in (int(run[0]), int(run[-1]) + 1)] + [h]
+            rows = [(y1, y2) for y1, y2 in zip(bounds[::2], bounds[1::2]) if y2 - y1 >= 0.6 * pitch]
+        elif len(centers) < 2:
+            rows = [(y1 // CALIBRATION_SCALE, -(-y2 // CALIBRATION_SCALE)) for y1, y2 in strips]
+        else:
+            # Empty rows make some gaps a multiple of the pitch
+            gaps = np.diff(centers)
+            pitch = float(np.median(gaps / np.maximum(1, np.round(gaps / gaps.min()))))
+            center = centers[0] - pitch * np.floor(centers[0] / pitch)
+            rows = []
+            while center < h:
+                y1, y2 = max(0, int(round(center - pitch / 2))), min(h, int(round(center + pitch / 2)))
+                # Rows cut by the RoI edge are kept when most of them is inside
+                if y2 - y1 >= 0.6 * pitch:
+                    rows.append((y1, y2))
+                center += pitch
+        return cls((w, h), rows, x_range, h_lines.tolist(), v_lines.tolist())
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['size'], data['rows'], data['x_range'], data.get('h_lines', ()), data.get('v_lines', ()))
+
+    def to_dict(self):
+        return {'size': list(self.size), 'rows': [list(row) for row in self.rows], 'x_range': list(self.x_range),
+                'h_lines': self.h_lines, 'v_lines': self.v_lines}
+
+    def strips(self, scale):
+        """[(y1, y2)] of the rows in an image upscaled by `scale`."""
+        return [(y1 * scale, y2 * scale) for y1, y2 in self.rows]
+
+    def cell_x(self, scale):
+        """(x1, x2) of the cells in an image upscaled by `scale`."""
+        return self.x_range[0] * scale, self.x_range[1] * scale
+
+    def line_mask(self, scale, shape):
+        """uint8 mask, 255 on the grid lines of an image upscaled by `scale`.
+
+        Lines are widened by one pixel on each side for the upscaling filter.
+        """
+        key = (scale, shape)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.zeros(shape, np.uint8)
+            for y in self.h_lines:
+                mask[max(0, y * scale - 1):(y + 1) * scale + 1, :] = 255
+            for x in self.v_lines:
+                mask[:, max(0, x * scale - 1):(x + 1) * scale + 1] = 255
+            self._masks[key] = mask
+        return mask
+
+
+class LayoutStore:
+    def __init__(self, path='ladder_layout.json', psm=7):
+        """Layouts of the RoIs, calibrated on first use and kept in a file.
+
+        Args
+        :path: JSON file of the layouts
+        :psm: Tesseract mode of a cell, 7 for a line or 8 for a word
+        """
+        self.path = path
+        self.psm = psm
+        self.layouts = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    for col_name, data in json.load(f).items():
+                        self.layouts[col_name] = LadderLayout.from_dict(data)
+                        self.layouts[col_name].psm = psm
+            except Exception as e:
+                logger.error(f'Ignored ladder layout {path}, could not be read: {e}')
+
+    @classmethod
+    def from_config(cls, config, instrument=None):
+        """Create from the `ladder_layout` config section, or None if disabled.
+
+        An instrument of the supervisor keeps its layouts in its own file.
+        """
+        options = config.get('ladder_layout') or {}
+        if not options.get('enabled', False):
+            return None
+        path = options.get('file', 'ladder_layout.json')
+        if instrument is not None:
+            root, ext = os.path.splitext(path)
+            path = f'{root}_{instrument}{ext}'
+        return cls(path, options.get('psm', 7))
+
+    def get(self, col_name, image):
+        """Return the layout of a RoI crop, calibrated if missing or of another size.
+
+        Returns None when the crop cannot be calibrated, e.g. no text on screen yet.
+        """
+        size = (image.shape[1], image.shape[0])
+        layout = self.layouts.get(col_name)
+        if layout is not None and layout.size == size:
+            return layout
+        try:
+            layout = LadderLayout.calibrate(image)
+        except ValueError as e:
+            logger.debug('Ladder layout of %s not calibrated: %s', col_name, e)
+            return None
+        layout.psm = self.psm
+        self.layouts[col_name] = layout
+        logger.info(f'Calibrated ladder layout of {col_name}: {len(layout.rows)} rows, cells {layout.x_range}')
+        self.save()
+        return layout
+
+    def reset(self):
+        """Calibrate every RoI again on its next frame, e.g. after new RoIs were selected."""
+        self.layouts.clear()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({col_name: layout.to_dict() for col_name, layout in self.layouts.items()}, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f'Failed when saving ladder layout: {e}')
+
+
+def main(argv=None):
+    from capture_utils import open_source
+    from config_utils import load_config
+
+    parser = argparse.ArgumentParser(description='Calibrate the ladder layout of the RoIs.')
+    parser.add_argument('--config', default='config.yaml', help='Config file')
+    parser.add_argument('--source', default='screen', help="'screen' or a directory of frames, the first one is used")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(args.config)
+    options = config.get('ladder_layout') or {}
+    store = LayoutStore(options.get('file', 'ladder_layout.json'), options.get('psm', 7))
+    store.reset()
+    source = open_source(args.source, config['screen_id'])
+    frame = source.grab()
+    source.close()
+    for col_name, side in (('bid', 'left'), ('ask', 'right')):
+        x1, y1, x2, y2 = config['rois'][side]
+        if store.get(col_name, frame[y1:y2, x1:x2]) is None:
+            logger.error(f'No text found in the {side} RoI')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Logging set up shared by the GUI, the daemon and the supervisor
+
+Log records are put on a queue by the calling thread and written by a
+listener thread, so file I/O and log rotation never run on the OCR worker or
+the GUI thread. Messages are formatted on the listener thread too. On hot
+paths, pass %-style arguments (`logger.debug('%s rows', n)`) instead of
+building the message with an f-string, and do not modify the arguments
+after the call.
+
+Ticks can also be written as JSON lines to their own file through
+`tick_logger`, e.g. `tick_logger.info(tick_record(...))`. It is disabled
+unless `tick_log` is given.
+"""
+import json
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(funcName)s(%(lineno)d) %(message)s'
+
+# One JSON object per tick, see `setup_logging`
+tick_logger = logging.getLogger('ticks')
+tick_logger.propagate = False
+tick_logger.disabled = True
+
+_listener = None
+_handlers = []
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The queue stays in this process, so the record does not have to be
+        # made picklable. Leave msg and args to the listener.
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, default=str)
+
+
+def _not_ticks(record):
+    return record.name != tick_logger.name
+
+
+def setup_logging(level=logging.INFO, logfile=None, stream=None, tick_log=None, fmt=LOG_FORMAT):
+    """Route the root logger through a queue to a listener thread.
+
+    Args
+    :level: Root log level
+    :logfile: Rotating log file, 5 MB x 2 backups
+    :stream: Also log to this stream, e.g. sys.stderr
+    :tick_log: JSON lines file of `tick_logger`, disabled if empty
+
+    Calling it again replaces the previous set up. The listener is stopped,
+    and its queue flushed, at exit.
+    """
+    global _listener
+    stop_logging()
+
+    handlers = []
+    formatter = logging.Formatter(fmt)
+    if logfile:
+        handlers.append(RotatingFileHandler(logfile, mode='a', maxBytes=5*1024*1024,
+                                            backupCount=2, encoding=None, delay=True))
+    if stream is not None:
+        handlers.append(logging.StreamHandler(stream))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.setLevel(level)
+        handler.addFilter(_not_ticks)
+    if tick_log:
+        handler = RotatingFileHandler(tick_log, mode='a', maxBytes=50*1024*1024,
+                                      backupCount=2, encoding='utf-8', delay=True)
+        handler.setFormatter(JsonLinesFormatter())
+        handler.addFilter(logging.Filter(tick_logger.name))
+        handlers.append(handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    _handlers.append((root, queue_handler))
+    tick_logger.disabled = not tick_log
+    if tick_log:
+        tick_logger.setLevel(logging.INFO)
+        tick_logger.addHandler(queue_handler)
+        _handlers.append((tick_logger, queue_handler))
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write the queued records and detach the queue handlers."""
+    global _listener
+    for logger, handler in _handlers:
+        logger.removeHandler(handler)
+    _handlers.clear()
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -2,77 +2,39 @@
 
 The application uses Tesseract to extract bid and ask values in real time.
 """
-import sys
 import time
+# Taken before any other import so that import time is part of the startup time
+_T0 = time.perf_counter()
+
+import sys
+import copy
+import math
 import threading
-import yaml
 import logging
-from logging.handlers import RotatingFileHandler
 from collections import deque
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QSpinBox, QLabel, QMessageBox
 from PyQt5.QtCore import QRunnable, Qt, QThreadPool
 from PyQt5.QtGui import QIntValidator, QIcon, QDoubleValidator
-import tkinter as tk
-from PIL import ImageGrab
-from cryptlex.lexactivator import LexActivator, LexStatusCodes, PermissionFlags
-from mss import mss
-from PIL import Image
-from ctypes import windll, byref, Structure, WinError, POINTER, WINFUNCTYPE, c_int, c_ulong, c_double
-from ctypes.wintypes import BOOL, HMONITOR, HDC, RECT, LPARAM, DWORD, BYTE, WCHAR, HANDLE
-import pygame
-
-from ocr_utils import extract_data
-
-# Default config if not found config.yaml
-default_config = {
-    'conf_thresh' : 80,
-    'debug': False,
-    'interval': 1,
-    'logfile': 'app.log',
-    'screen_id' : 1,   
-    'rois': {
-        'left': [0, 0, 0, 0],
-        'right': [0, 0, 0, 0]
-    },
-    'time_periods': [10, 20, 30, 60, 300, 1200, 1800],
-    'alarm_active': [True ,True, True, True, True, True, True, True],
-    'alarm_threshold_bid': [1000, 1, 1, 1, 1, 1, 1, 1],
-    'alarm_threshold_ask': [1000, 1, 1, 1, 1, 1, 1, 1],
-}
-
-_MONITORENUMPROC_HMONITOR = WINFUNCTYPE(BOOL, HMONITOR, HDC, POINTER(RECT), LPARAM)
-_MONITORENUMPROC_RECT = WINFUNCTYPE(c_int, c_ulong, c_ulong, POINTER(RECT), c_double)
-
-def load_config(config_file='config.yaml'):
-    config = default_config
-    try:
-        with open('config.yaml') as f:
-            config = yaml.load(f, Loader=yaml.FullLoader)
-    except FileNotFoundError:
-        logging.exception('Not found config file')
-    except Exception as e:
-        logging.exception(f'Unexpected error: {e}')
-    return config
 
+# Heavy modules are imported where they are needed:
+# - OpenCV/pytesseract (ocr_utils) and mss by the OCR worker, preloaded in the background
+# - pygame by the alert dispatcher on the first alarm, also preloaded in the background
+# - cryptlex by the license check, ctypes windll by monitor lookups, zmq by the publisher
+from aggregator import Aggregator, column_values, tick_record
+from config_service import ConfigService
+from config_utils import load_config, save_config
+from log_utils import setup_logging as setup_log_queue, tick_logger
+from metrics import metrics
+from perf_utils import PhaseTimer
+from sparkline import Sparkline, per_pixel
 
-def save_config(config, config_file='config.yaml'):
-    try:
-        with open(config_file, 'w') as f:
-            yaml.dump(config, f)
-    except:
-        logging.exception(f'Failed when saving config: {config}')
-
-
-def capture_screenshot(screen_id):
-    # Capture entire screen by screen_id
-    with mss() as sct:
-        monitor = sct.monitors[screen_id] #screen_id start from 1. This means that the screen_id of main display(first display) is 1, screen_id of the second_display is 2 etc.
-        sct_img = sct.grab(monitor)
-        # Convert to PIL/Pillow Image
-        return Image.frombytes('RGB', sct_img.size, sct_img.bgra, 'raw', 'BGRX')
+_T_IMPORTS = time.perf_counter()
 
 def _enumerate_monitors():		#Get array of HMONITOR
+    from ctypes import windll, WinError, POINTER, WINFUNCTYPE
+    from ctypes.wintypes import BOOL, HMONITOR, HDC, RECT, LPARAM
+    _MONITORENUMPROC_HMONITOR = WINFUNCTYPE(BOOL, HMONITOR, HDC, POINTER(RECT), LPARAM)
     MONITORS = []
     def callback(hmonitor, hdc, lprect, lparam):
         MONITORS.append(HMONITOR(hmonitor))
@@ -83,6 +45,9 @@ def _enumerate_monitors():		#Get array of HMONITOR
     return MONITORS
 
 def _get_rect_from_monitors():		#Get array of Rect
+    from ctypes import windll, POINTER, WINFUNCTYPE, c_int, c_ulong, c_double
+    from ctypes.wintypes import RECT
+    _MONITORENUMPROC_RECT = WINFUNCTYPE(c_int, c_ulong, c_ulong, POINTER(RECT), c_double)
     Rects = []
     def _callback(hmonitor, hdc, lprect, lparam):
         Rects.append(QtCore.QRect(QtCore.QPoint(lprect.contents.left, lprect.contents.top), QtCore.QPoint(lprect.contents.right, lprect.contents.bottom)))
@@ -92,6 +57,7 @@ def _get_rect_from_monitors():		#Get array of Rect
     return Rects
 
 def set_screen_id():
+    from ctypes import windll
     ###############################################################
     #Get active window id
     # https://msdn.microsoft.com/en-us/library/ms633505
@@ -115,8 +81,10 @@ def set_screen_id():
         	break
         screen_id += 1
 
-    config['screen_id'] = screen_id
-    save_config(config)
+    # Only rewrite config.yaml when the screen actually changed
+    if config.get('screen_id') != screen_id:
+        config['screen_id'] = screen_id
+        save_config(config)
     #print("screen_id: ", screen_id)
 
 def get_screen_position():
@@ -124,21 +92,20 @@ def get_screen_position():
 	print (array_rect)
 
 
-# Load global config
-config = load_config()
+# Global config, loaded by `init()`. Changed in place by `config_service`.
+config = None
+config_service = None
 
-# Setup logging
-level = logging.DEBUG if config['debug'] else logging.INFO
-fmt = logging.Formatter('%(asctime)s %(levelname)s %(funcName)s(%(lineno)d) %(message)s')
+logger = logging.getLogger('root')
 
-handler = RotatingFileHandler(config['logfile'], mode='a', maxBytes=5*1024*1024, 
-                                         backupCount=2, encoding=None, delay=0)
-handler.setFormatter(fmt)
-handler.setLevel(level)
+# Startup phases and time to the first OCR tick
+startup = PhaseTimer(_T0)
 
-logger = logging.getLogger('root')
-logger.setLevel(level)
-logger.addHandler(handler)
+
+def setup_logging():
+    # Records are written by a listener thread, see `log_utils`
+    level = logging.DEBUG if config['debug'] else logging.INFO
+    setup_log_queue(level, config['logfile'], tick_log=config.get('tick_log'))
 
 
 # Define global vars
@@ -152,22 +119,110 @@ terminate_event.clear()
 
 # Control access to shared `sums` variable
 show_lock = threading.Lock()
-sums = {
-    'bid': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
-    'ask': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
-}
+sums = None
+
+# Latest per-row values of each column, from top to bottom
+rows = {'bid': [], 'ask': []}
+
+# perf_counter time of the last OCR tick, watched by `MainWindow.check_worker`
+last_ocr_tick = 0.0
+
+# Streams ticks to downstream consumers, see `get_publisher`
+global_publisher = None
+# Set after the first attempt to create the publisher, it is not retried
+publisher_tried = False
+
+# Serves live state and metrics over HTTP, see `start_status_server`
+global_status_server = None
+
+# Keeps debug images of recent ticks, see `get_debug_recorder`
+global_recorder = None
 
 # The application mode: ['view']
 mode = None
 
 global_is_started = False
 
-pygame.mixer.init()
-# If you want more channels, change 8 to a desired number. 8 is the default number of channel
-pygame.mixer.set_num_channels(8)
-# This is the sound channel
-global_voice = pygame.mixer.Channel(5)
-global_sound = pygame.mixer.Sound('alarm.mp3')
+# Routes alarms to sound, log and other sinks, see `get_alerts`
+global_alerts = None
+alerts_lock = threading.Lock()
+
+
+def new_sums():
+    return {
+        'bid': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
+        'ask': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
+    }
+
+
+def init():
+    """Load the global config and set up logging and shared state."""
+    global config, config_service, sums
+    with startup.phase('config'):
+        config = load_config()
+        config_service = ConfigService(config)
+        setup_logging()
+    startup.record('imports', _T_IMPORTS - _T0)
+    sums = new_sums()
+
+
+def get_alerts():
+    """Return the alert dispatcher, created on first use."""
+    global global_alerts
+    with alerts_lock:
+        if global_alerts is None:
+            from alerts import AlertDispatcher
+            global_alerts = AlertDispatcher.from_config(config)
+    return global_alerts
+
+
+def start_status_server():
+    """Start the local status server if enabled in config."""
+    global global_status_server
+    try:
+        from status_server import StatusServer
+        global_status_server = StatusServer.from_config(config)
+        if global_status_server is not None:
+            global_status_server.recorder = get_debug_recorder()
+            global_status_server.start()
+    except Exception as e:
+        logger.error(f'Failed when starting status server: {e}')
+
+
+def preload():
+    """Import the OCR stack and open the audio device off the GUI thread.
+
+    Runs while the user looks at the main window, so neither the first tick
+    nor the first alarm pays for it.
+    """
+    with startup.phase('preload_ocr'):
+        import ocr_utils
+        import capture_utils
+    with startup.phase('preload_sound'):
+        get_alerts().preload()
+
+
+def get_debug_recorder():
+    """Return the debug image recorder, created on first use. None unless debug is on."""
+    global global_recorder
+    if global_recorder is None:
+        from debug_recorder import DebugRecorder
+        global_recorder = DebugRecorder.from_config(config)
+    return global_recorder
+
+
+def get_publisher():
+    """Return the tick publisher, created on first use. None if disabled or it failed to start."""
+    global global_publisher, publisher_tried
+    if not publisher_tried:
+        publisher_tried = True
+        try:
+            from publisher import TickPublisher
+            global_publisher = TickPublisher.from_config(config)
+        except Exception as e:
+            logger.error(f'Failed when starting tick publisher: {e}')
+    return global_publisher
+
 
 class OCRWorker(QRunnable):
     def __init__(self, pts1, pts2, interval=1):
@@ -180,8 +235,12 @@ class OCRWorker(QRunnable):
         
         Attributes
         :debug: Enable debug mode if true
+        :recorder: DebugRecorder of the crops and intermediate images, None unless debug
         :conf_thresh: Tesseract confidence thresh
         :inputs: A dict stores the above RoIs
+        :abandoned: Set by the watchdog when a new worker replaced this one.
+                    A stuck call cannot be interrupted, the worker stops
+                    when it returns and its results are dropped.
         """
         super().__init__()
         self.interval = interval
@@ -189,11 +248,48 @@ class OCRWorker(QRunnable):
         self.first_x1, self.first_y1, self.first_x2, self.first_y2 = pts1
         self.second_x1, self.second_y1, self.second_x2, self.second_y2 = pts2
         self.debug = config.get('debug', False)
+        self.recorder = get_debug_recorder()
+        from consensus import Consensus
+        from ocr_presets import roi_presets
+        self.consensus = Consensus.from_config(config)
+        self.presets = roi_presets(config)
+        from ladder_layout import LayoutStore
+        self.layouts = LayoutStore.from_config(config)
+        from color_key import ColorKeyStore
+        self.keys = ColorKeyStore.from_config(config)
+        from dnn_ocr import DigitRecognizer
+        self.engine = DigitRecognizer.from_config(config)
         self.conf_thresh = config.get('conf_thresh', 80)
         self.inputs = {
             'bid': (self.first_x1, self.first_y1, self.first_x2, self.first_y2),
             'ask': (self.second_x1, self.second_y1, self.second_x2, self.second_y2)
         }
+        from roi_locator import RoiLocator
+        self.locator = RoiLocator.from_config(config, self.inputs)
+        from capture_utils import ScreenSource
+        self.source = ScreenSource(config['screen_id'])
+        self.new_source = None
+        self.rois_changed = False
+        self.abandoned = False
+        self.started_at = time.perf_counter()
+        self.first_tick = True
+
+    def apply_config(self, changed):
+        """Take config changes from the GUI thread, used from the next tick on."""
+        if 'rois' in changed:
+            self.inputs = {'bid': tuple(config['rois']['left']), 'ask': tuple(config['rois']['right'])}
+            self.rois_changed = True
+        if 'ocr_preset' in changed or 'ocr_profile' in changed:
+            from ocr_presets import roi_presets
+            self.presets = roi_presets(config)
+        if 'interval' in changed:
+            self.interval = config['interval']
+        if 'conf_thresh' in changed:
+            self.conf_thresh = config['conf_thresh']
+        if 'screen_id' in changed:
+            from capture_utils import ScreenSource
+            # Swapped on the worker thread, the mss handle belongs to it
+            self.new_source = ScreenSource(config['screen_id'])
     
     # def _process_results(self, results):
     #     """Post process the given results.
@@ -219,47 +315,64 @@ class OCRWorker(QRunnable):
     def run(self):
         # print("def run(self)")
         """Extract bid and ask values from the input RoIs"""
-        global show_lock, sums
-        global global_is_started
+        from ocr_utils import extract_rois, set_ocr_timeout
+        global show_lock, sums, rows
+        global global_is_started, last_ocr_tick
+        set_ocr_timeout(config.get('ocr_timeout', 2))
         while True:
             # Check terminate signal
-            if terminate_event.wait(0.01):
+            if terminate_event.wait(0.01) or self.abandoned:
+                self.source.close()
                 break
             
             # Check ready signal
             if not ready_event.wait(self.interval):
                 continue
                         
+            if self.new_source is not None:
+                self.source.close()
+                self.source, self.new_source = self.new_source, None
+            if self.rois_changed:
+                # The rows moved, their history no longer applies
+                self.rois_changed = False
+                if self.consensus is not None:
+                    self.consensus.reset()
+                if self.locator is not None:
+                    self.locator.reset(self.inputs)
+                if self.layouts is not None:
+                    self.layouts.reset()
+                if self.keys is not None:
+                    self.keys.reset()
+
             # Start to capture screen and extract data
-            results = {}
-            for col_name, roi in self.inputs.items():
-                x1, y1, x2, y2 = roi
-                try:
-                    # Crop RoI
-                    captured_img = capture_screenshot(config['screen_id'])
-                    img = captured_img.crop(box=(x1, y1, x2, y2))
-
-                    #img = ImageGrab.grab((x1, y1, x2, y2))
-                    #img = ImageGrab.grab(bbox=None, include_layered_windows=False, all_screens=True)
-
-                    if self.debug:
-                        filename = f'roi_{col_name}.png'
-                        img.save(filename)
-                        logger.debug('Dump image as {}'.format(filename))
-                    
-                    # Extract data actually
-                    col_result = extract_data(img, self.conf_thresh, col_name, self.debug)
-                except Exception as e:
-                    logger.error(f'Error while extracting data: {e}')
-                    continue
-                
-                # Sorted by y-axis
-                col_result = sorted(col_result, key=lambda x: x[1])
-                #print(col_result)
-                results[col_name] = col_result
-                #print(results[col_name])
+            # One capture per tick, both RoIs are cropped from it
+            try:
+                frame = self.source.grab()
+            except Exception as e:
+                logger.error('Error while capturing screen: %s', e)
+                continue
+            if self.locator is not None and self.locator.update(frame):
+                # The ladder window moved, `self.inputs` was updated in place
+                config['rois'] = {'left': list(self.inputs['bid']), 'right': list(self.inputs['ask'])}
+                if self.consensus is not None:
+                    self.consensus.reset()
+            results = extract_rois(frame, self.inputs, self.conf_thresh, self.recorder, self.consensus, self.presets,
+                                   self.layouts, self.engine, self.keys)
+            if self.abandoned:
+                self.source.close()
+                return
+            if results:
+                # A tick whose columns all timed out or failed does not count
+                last_ocr_tick = time.perf_counter()
+            metrics.event('ocr_tick')
+            if self.first_tick:
+                self.first_tick = False
+                elapsed = time.perf_counter() - self.started_at
+                logger.info(f'First OCR tick {elapsed * 1000:.1f} ms after start')
+                startup.mark('first_ocr_tick')
 
             if not global_is_started:
+                self.source.close()
                 return
 
             # print("result:   ", results)
@@ -268,16 +381,10 @@ class OCRWorker(QRunnable):
                 with show_lock:
                     # Take sum of each column
                     for col_name, rs in results.items():
-                        if self.debug:
-                            logger.info('{} with result: {}'.format(col_name, rs))
-                        sum_ = 0
-                        for cell in rs:
-                            try:
-                                sum_ += float(cell[4].replace(",", ""))
-                                #sum_ += float(cell[4])
-                            except:
-                                pass
+                        logger.debug('%s with result: %s', col_name, rs)
+                        sum_, values = column_values(rs)
                         sums[col_name].appendleft(sum_)
+                        rows[col_name] = values
                 #print("::: ", sums, ":::")
             else:
                 logger.warning('Not found anything')
@@ -391,10 +498,10 @@ class ROISelector(QtWidgets.QMainWindow):
                 x, y = pos.x(), pos.y()
                 self.rois[1][2:] = x, y
 
-                # Save config
-                config['rois']['left'] = self.rois[0]
-                config['rois']['right'] = self.rois[1]
-                save_config(config)
+                # Save config, applied now so that a settings save does not bring the old RoIs back
+                new_config = copy.deepcopy(config)
+                new_config['rois'] = {'left': list(self.rois[0]), 'right': list(self.rois[1])}
+                config_service.apply(new_config, save=True)
 
                 self.close()
                 self.switch_window.emit()
@@ -415,16 +522,10 @@ class MainWindow(QtWidgets.QWidget):
         self.setupUi(self)
         #self.setFixedSize(300, 320) 
         
-        # Step counter
-        self.step_cnt = 0
-        self.steps = [int(x) for x in config['time_periods']]
-        self.history = {}
-        for period in config['time_periods']:
-            max_len = int(period)
-            self.history[period] = {
-                'bid': deque([0] * max_len, maxlen=max_len),
-                'ask': deque([0] * max_len, maxlen=max_len),
-            }
+        # Rolling windows and alarm rules
+        self.aggregator = Aggregator(config)
+        self.worker = None
+        self.stalled = False
 
         self.select_button.clicked.connect(self.select_button_handler)
         self.view_button.clicked.connect(self.view_button_handler)
@@ -455,6 +556,12 @@ class MainWindow(QtWidgets.QWidget):
         g_layout.addWidget(row_widget_1_setting)
         g_layout.addWidget(row_widget_2)
 
+        # Shown by the watchdog while no OCR tick comes, the values are stale
+        self.stall_label = QtWidgets.QLabel()
+        self.stall_label.setStyleSheet('color: red')
+        self.stall_label.hide()
+        g_layout.addWidget(self.stall_label)
+
         # Setup row 1
         layout_1 = QtWidgets.QGridLayout()
         row_widget_1.setLayout(layout_1)
@@ -504,24 +611,29 @@ class MainWindow(QtWidgets.QWidget):
         ask_widget_layout = QtWidgets.QVBoxLayout()
         ask_widget.setLayout(ask_widget_layout)
         row_widget_2_layout.addWidget(ask_widget)
+
+        chart_width = config.get('chart_width', 120)
+        if chart_width > 0:
+            chart_widget = QtWidgets.QWidget()
+            chart_widget_layout = QtWidgets.QVBoxLayout()
+            chart_widget.setLayout(chart_widget_layout)
+            row_widget_2_layout.addWidget(chart_widget)
         
         self.values = []  # Store these widgets to update later
+        self.texts = []  # Shown text of each value widget, to skip unchanged updates
+        self.labels = []
+        self.charts = []
         
         # Initialize number of widgets as the same as number of periods + 1
         periods = [0] + config['time_periods']
         for i, period in enumerate(periods):
             # Label column
             if i == 0:
-                label_widget_layout.addWidget(QtWidgets.QLabel('Newest'))
+                label = QtWidgets.QLabel('Newest')
             else:
-                if period < 60:
-                    text = '{:<8}'.format('%s sec.' % period)
-                else:
-                    if period % 60 == 0:
-                        text = '{:<8}'.format('%d min.' % (period // 60))
-                    else:
-                        text = '{:<8}'.format('%.2f min.' % (period / 60))
-                label_widget_layout.addWidget(QtWidgets.QLabel(text))
+                label = QtWidgets.QLabel(self._period_label(period))
+            self.labels.append(label)
+            label_widget_layout.addWidget(label)
 
             # Bid column
             bid_widget_layout.addWidget(QtWidgets.QLabel('Bid'))
@@ -538,12 +650,20 @@ class MainWindow(QtWidgets.QWidget):
                 text = '{} {}'.format(left_text, right_text)
             widget = QtWidgets.QLabel(text)
             self.values.append(widget)
+            self.texts.append(text)
             value_widget_layout.addWidget(widget)
             
             # Ask column
             label = QtWidgets.QLabel('Ask')
             label.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter)
             ask_widget_layout.addWidget(label)
+
+            # Chart column. Newest shows (bid - ask) / (bid + ask), periods
+            # show bid ratio - ask ratio.
+            if chart_width > 0:
+                chart = Sparkline(chart_width, per_pixel=self._chart_per_pixel(period))
+                self.charts.append(chart)
+                chart_widget_layout.addWidget(chart)
             
         self.setLayout(g_layout)
         self.retranslateUi(Form)
@@ -557,68 +677,115 @@ class MainWindow(QtWidgets.QWidget):
     
     def update_sums(self):
         global sums
-        global global_voice, global_sound
         with show_lock:
-            # Update history
-            for i, period in enumerate(self.history, 1):
-                self.history[period]['bid'].append(sums['bid'][i])
-                self.history[period]['ask'].append(sums['ask'][i])
-            
-            self.step_cnt += 1
             bid_data = sums['bid']
             ask_data = sums['ask']
+            tick = self.aggregator.update(bid_data[0], ask_data[0])
+            step_cnt = tick['step']
             
             # Set first column text
-            if self.step_cnt % config['interval'] == 0:
+            if step_cnt % config['interval'] == 0:
                 if bid_data[0] > 0 and ask_data[0] > 0:
                     bid_text = '{label:<{n}}'.format(label='%.2f' % bid_data[0], n=self.text_len)
                     ask_text = '{label:>{n}}'.format(label='%.2f' % ask_data[0], n=self.text_len)
                     text = '{} {}'.format(bid_text, ask_text)
-                    self.values[0].setText(text)
-
-                if (config['alarm_active'][0] == True):
-                    if(bid_data[0] >= config['alarm_threshold_bid'][0]):
-                        if not global_voice.get_busy():
-                            global_voice.play(global_sound)
-                    if(ask_data[0] >= config['alarm_threshold_ask'][0]):
-                        if not global_voice.get_busy():
-                            global_voice.play(global_sound)
+                    self._set_value(0, text)
+                    if self.charts:
+                        self.charts[0].add((bid_data[0] - ask_data[0]) / (bid_data[0] + ask_data[0]))
             
-            for i, period in enumerate(config['time_periods'], 1):	# i start from 1
-                if self.step_cnt % period == 0:
-                    acc_bid = sum(self.history[period]['bid'])
-                    acc_ask = sum(self.history[period]['ask'])
-                    if acc_bid == 0 or acc_ask == 0:
-                        bid_text = ' ' * self.text_len
-                        ask_text = ' ' * self.text_len
-                        text = '{} {}'.format(bid_text, ask_text)
-                        self.values[i].setText(text)
-                        continue
-
-                    if acc_bid > acc_ask:
-                        bid_text = '{label:>{n}}'.format(label='%.2f' % (acc_bid / acc_ask), n=self.text_len)
-                        ask_text = '{label:<{n}}'.format(label='1', n=self.text_len)
-                    elif acc_ask > acc_bid:
-                        ask_text = '{label:<{n}}'.format(label='%.2f' % (acc_ask / acc_bid), n=self.text_len)
-                        bid_text = '{label:>{n}}'.format(label='1', n=self.text_len)
-                    else:
-                        bid_text = '{label:>{n}}'.format(label='1', n=self.text_len)
-                        ask_text = '{label:<{n}}'.format(label='1', n=self.text_len)
-                    text = '{} : {}'.format(bid_text, ask_text)
-                    self.values[i].setText(text)
-
-                    if (config['alarm_active'][i] == True):
-                        if float(bid_text) >= config['alarm_threshold_bid'][i]:
-                            if not global_voice.get_busy():
-                                global_voice.play(global_sound)
-                        if float(ask_text) >= config['alarm_threshold_ask'][i]:
-                            if not global_voice.get_busy():
-                                global_voice.play(global_sound)
-        # Reset
-        #if self.step_cnt == self.steps[-1]:
-        #print(self.step_cnt == 86400)       # 60sec * 60min * 24hour = 86400sec
-        if self.step_cnt == 86400:
-            self.step_cnt = 0
+            for i, period in enumerate(self.aggregator.periods, 1):	# i start from 1
+                if period not in tick['refreshed']:
+                    continue
+                bid_ratio, ask_ratio = tick['ratios'][period]
+                if i < len(self.charts):
+                    self.charts[i].add(bid_ratio - ask_ratio)
+                if math.isnan(bid_ratio):
+                    bid_text = ' ' * self.text_len
+                    ask_text = ' ' * self.text_len
+                    text = '{} {}'.format(bid_text, ask_text)
+                    self._set_value(i, text)
+                    continue
+
+                bid_text = '{label:>{n}}'.format(label=self._format_ratio(bid_ratio), n=self.text_len)
+                ask_text = '{label:<{n}}'.format(label=self._format_ratio(ask_ratio), n=self.text_len)
+                text = '{} : {}'.format(bid_text, ask_text)
+                self._set_value(i, text)
+
+            if tick['alarms']:
+                get_alerts().submit_tick(tick, self.aggregator.periods)
+                if global_recorder is not None:
+                    global_recorder.alarm()
+
+            metrics.event('aggregate_tick')
+            publisher = get_publisher()
+            if publisher is not None:
+                publisher.publish(tick['timestamp'],
+                                  {'bid': bid_data[0], 'ask': ask_data[0]},
+                                  rows,
+                                  tick['ratios'])
+            if tick_logger.isEnabledFor(logging.INFO):
+                tick_logger.info(tick_record(tick, {'bid': bid_data[0], 'ask': ask_data[0]}, dict(rows)))
+            if global_status_server is not None:
+                state = tick_record(tick, {'bid': bid_data[0], 'ask': ask_data[0]}, dict(rows))
+                state['worker'] = {'running': global_is_started, 'stalled': self.stalled}
+                global_status_server.publish(state)
+
+    @staticmethod
+    def _format_ratio(ratio):
+        # The smaller side of a ratio is shown as a plain 1
+        return '1' if ratio == 1 else '%.2f' % ratio
+
+    def _set_value(self, i, text):
+        # setText relayouts and repaints the label even if the text is the same
+        if self.texts[i] != text:
+            self.texts[i] = text
+            self.values[i].setText(text)
+
+    @staticmethod
+    def _period_label(period):
+        if period < 60:
+            return '{:<8}'.format('%s sec.' % period)
+        if period % 60 == 0:
+            return '{:<8}'.format('%d min.' % (period // 60))
+        return '{:<8}'.format('%.2f min.' % (period / 60))
+
+    @staticmethod
+    def _chart_per_pixel(period):
+        # Values per chart column so that every chart shows `chart_span`
+        # seconds. Newest (period 0) gets a value every `interval` ticks.
+        seconds = period or config['interval']
+        return per_pixel(config.get('chart_span', 7200), config.get('chart_width', 120), seconds)
+
+    def apply_config(self, changed):
+        """Apply a live config change, see `config_service`. Runs on the GUI thread."""
+        if self.worker is not None:
+            self.worker.apply_config(changed)
+        if 'interval' in changed and self.charts:
+            self.charts[0].set_per_pixel(self._chart_per_pixel(0))
+        if 'time_periods' not in changed:
+            # Alarm settings are read by the aggregator on every tick
+            return
+        with show_lock:
+            old_periods = self.aggregator.periods
+            periods = self.aggregator.set_periods(config['time_periods'])
+        for i, period in enumerate(periods, 1):
+            if i >= len(self.labels):
+                logger.warning('More time periods than rows, restart to show all of them')
+                break
+            self.labels[i].setText(self._period_label(period))
+            if i < len(self.charts) and (i > len(old_periods) or old_periods[i - 1] != period):
+                self.charts[i].clear()
+                self.charts[i].set_per_pixel(self._chart_per_pixel(period))
+            if not global_is_started:
+                continue
+            bid_ratio, ask_ratio = self.aggregator.ratios[period]
+            if math.isnan(bid_ratio):
+                text = '{} {}'.format(' ' * self.text_len, ' ' * self.text_len)
+            else:
+                bid_text = '{label:>{n}}'.format(label=self._format_ratio(bid_ratio), n=self.text_len)
+                ask_text = '{label:<{n}}'.format(label=self._format_ratio(ask_ratio), n=self.text_len)
+                text = '{} : {}'.format(bid_text, ask_text)
+            self._set_value(i, text)
 
     def select_button_handler(self):
         global mode
@@ -631,23 +798,55 @@ class MainWindow(QtWidgets.QWidget):
         mode = 'view'
         self.switch_window.emit()
 
+    def check_worker(self):
+        """Watchdog of the OCR worker, runs on the GUI timer.
+
+        Flags the values as stale when no OCR tick came for `stall_timeout`
+        seconds, and replaces a worker that has been stuck that long.
+        """
+        if self.worker is None:
+            return
+        stall_timeout = config.get('stall_timeout', 10)
+        now = time.perf_counter()
+        age = now - last_ocr_tick
+        if age < stall_timeout:
+            if self.stalled:
+                self.stalled = False
+                self.stall_label.hide()
+                logger.info('OCR worker recovered')
+            return
+        if not self.stalled:
+            self.stalled = True
+            metrics.incr('ocr_stalls')
+        self.stall_label.setText(f'OCR stalled, values are {age:.0f}s old')
+        self.stall_label.show()
+        if now - self.worker.started_at < stall_timeout:
+            # The replacement has not had its chance yet
+            return
+        logger.error(f'No OCR tick for {age:.1f}s, restarting the OCR worker')
+        metrics.incr('worker_restarts')
+        self.worker.abandoned = True
+        self.worker = OCRWorker(config['rois']['left'], config['rois']['right'], config['interval'])
+        self.pool.start(self.worker)
+
     def start_button_handler(self):
-        global global_is_started
+        global global_is_started, last_ocr_tick
         if not global_is_started:        
             ready_event.set()
             terminate_event.clear()
-            
-            config = load_config()
+            last_ocr_tick = time.perf_counter()
             
             # Update sums on GUI
             self.timer = QtCore.QTimer(self)
             self.timer.timeout.connect(self.update_sums)
+            self.timer.timeout.connect(self.check_worker)
             #self.timer.start(config['interval'] * 1000)
             self.timer.start(1000)
 
             # Extract data
             self.pool = QThreadPool.globalInstance()
             runnable = OCRWorker(config['rois']['left'], config['rois']['right'], config['interval'])
+            self.worker = runnable
             self.pool.start(runnable)
             global_is_started = True
             
@@ -665,7 +864,9 @@ class MainWindow(QtWidgets.QWidget):
             left_text = ' ' * (self.text_len + 4)
             right_text = ' ' * (self.text_len + 4)
             text = '{} {}'.format(left_text, right_text)
-            widget.setText(text)
+            self._set_value(i, text)
+        for chart in self.charts:
+            chart.clear()
         
         ready_event.clear()
         terminate_event.set()
@@ -675,24 +876,14 @@ class MainWindow(QtWidgets.QWidget):
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.timer.stop()
-        self.step_cnt = 0
-        # print("------------------")
-        # print("self.history : ", self.history)
-        # print("------------------")
-        self.history = {}
-        for period in config['time_periods']:
-            max_len = int(period)
-            self.history[period] = {
-                'bid': deque([0] * max_len, maxlen=max_len),
-                'ask': deque([0] * max_len, maxlen=max_len),
-            }
+        self.worker = None
+        self.stalled = False
+        self.stall_label.hide()
+        self.aggregator.reset()
         # print("------------------")
         # print("sums : ", sums)
         # print("------------------")
-        sums = {
-            'bid': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
-            'ask': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
-        }
+        sums = new_sums()
         # print("------------------")
         # print("sums after: ", sums)
         # print("------------------")
@@ -763,6 +954,7 @@ class ActivateWindow(QtWidgets.QWidget):
         self.activate_status.setText('')
     
     def activate_button_handler(self):
+        from cryptlex.lexactivator import LexActivator, LexStatusCodes
         license_key = self.activate_input_box.text()
         try:
             LexActivator.SetLicenseKey(license_key)
@@ -800,8 +992,6 @@ class SettingWindow(QtWidgets.QWidget):
         Form.setObjectName('Settings')
         #Form.setFixedSize(300,420)
         Form.resize(300,420)
-                
-        config = load_config()
 
         g_layout = QtWidgets.QVBoxLayout()
 
@@ -1305,7 +1495,6 @@ class SettingWindow(QtWidgets.QWidget):
         self.retranslateUi(self)
 
     def save_button_handler(self):
-        global sums
         msgBox = QMessageBox()
         msgBox.setWindowIcon(QtGui.QIcon('L2-easy.ico'))
         msgBox.setIcon(QtWidgets.QMessageBox.Warning)
@@ -1349,6 +1538,7 @@ class SettingWindow(QtWidgets.QWidget):
         self.time_F = int(self.edit_F.text())
         self.time_G = int(self.edit_G.text())
 
+        new_config = copy.deepcopy(config)
         self.Alarm_Newest_Bid = int(self.edit_Alarm_Newest_Bid.text())
         self.Alarm_Newest_Ask = int(self.edit_Alarm_Newest_Ask.text())
         self.Alarm_A_Bid = int(self.edit_Alarm_A_Bid.text())
@@ -1367,48 +1557,52 @@ class SettingWindow(QtWidgets.QWidget):
         self.Alarm_G_Ask = int(self.edit_Alarm_G_Ask.text())
 
         if self.radio_Newest_Active_Yes.isChecked():
-        	config['alarm_active'][0] = True
+        	new_config['alarm_active'][0] = True
         else:
-        	config['alarm_active'][0] = False
+        	new_config['alarm_active'][0] = False
         if self.radio_A_Active_Yes.isChecked():
-        	config['alarm_active'][1] = True
+        	new_config['alarm_active'][1] = True
         else:
-        	config['alarm_active'][1] = False
+        	new_config['alarm_active'][1] = False
         if self.radio_B_Active_Yes.isChecked():
-        	config['alarm_active'][2] = True
+        	new_config['alarm_active'][2] = True
         else:
-        	config['alarm_active'][2] = False
+        	new_config['alarm_active'][2] = False
         if self.radio_C_Active_Yes.isChecked():
-        	config['alarm_active'][3] = True
+        	new_config['alarm_active'][3] = True
         else:
-        	config['alarm_active'][3] = False
+        	new_config['alarm_active'][3] = False
         if self.radio_D_Active_Yes.isChecked():
-        	config['alarm_active'][4] = True
+        	new_config['alarm_active'][4] = True
         else:
-        	config['alarm_active'][4] = False
+        	new_config['alarm_active'][4] = False
         if self.radio_E_Active_Yes.isChecked():
-        	config['alarm_active'][5] = True
+        	new_config['alarm_active'][5] = True
         else:
-        	config['alarm_active'][5] = False
+        	new_config['alarm_active'][5] = False
         if self.radio_F_Active_Yes.isChecked():
-        	config['alarm_active'][6] = True
+        	new_config['alarm_active'][6] = True
         else:
-        	config['alarm_active'][6] = False
+        	new_config['alarm_active'][6] = False
         if self.radio_G_Active_Yes.isChecked():
-        	config['alarm_active'][7] = True
+        	new_config['alarm_active'][7] = True
         else:
-        	config['alarm_active'][7] = False
-
-        config['interval'] = int(self.interval_val_spin.value())
-        config['time_periods'] = [self.time_A, self.time_B, self.time_C, self.time_D, self.time_E, self.time_F, self.time_G]
-        config['alarm_threshold_bid'] = [self.Alarm_Newest_Bid, self.Alarm_A_Bid, self.Alarm_B_Bid, self.Alarm_C_Bid, self.Alarm_D_Bid, self.Alarm_E_Bid, self.Alarm_F_Bid, self.Alarm_G_Bid]
-        config['alarm_threshold_ask'] = [self.Alarm_Newest_Ask, self.Alarm_A_Ask, self.Alarm_B_Ask, self.Alarm_C_Ask, self.Alarm_D_Ask, self.Alarm_E_Ask, self.Alarm_F_Ask, self.Alarm_G_Ask]
+        	new_config['alarm_active'][7] = False
+
+        # The live RoIs follow the tracked ladder window, they are not settings.
+        # Keep the ones applied last, else every save would reset the pipeline
+        # and write the tracked RoIs to config.yaml
+        new_config['rois'] = copy.deepcopy(config_service.applied['rois'])
+        new_config['interval'] = int(self.interval_val_spin.value())
+        new_config['time_periods'] = [self.time_A, self.time_B, self.time_C, self.time_D, self.time_E, self.time_F, self.time_G]
+        new_config['alarm_threshold_bid'] = [self.Alarm_Newest_Bid, self.Alarm_A_Bid, self.Alarm_B_Bid, self.Alarm_C_Bid, self.Alarm_D_Bid, self.Alarm_E_Bid, self.Alarm_F_Bid, self.Alarm_G_Bid]
+        new_config['alarm_threshold_ask'] = [self.Alarm_Newest_Ask, self.Alarm_A_Ask, self.Alarm_B_Ask, self.Alarm_C_Ask, self.Alarm_D_Ask, self.Alarm_E_Ask, self.Alarm_F_Ask, self.Alarm_G_Ask]
         
-        save_config(config)
-        sums = {
-            'bid': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
-            'ask': deque([0] * (len(config['time_periods']) + 1), maxlen=(len(config['time_periods']) + 1)),
-        }
+        # Applied to the running pipeline, the history and the worker are kept
+        if config_service.apply(new_config, save=True) is None:
+            msgBox.setText("Invalid settings, see the log file.")
+            msgBox.exec()
+            return
         self.save_event.emit()
 
     def cancel_button_handler(self):
@@ -1427,6 +1621,11 @@ class Controller:
         self.activate_window = None
         self.setting_window = None
         self.is_startup = True
+        # Pick up edits of config.yaml while running
+        config_service.subscribe(self.apply_config)
+        self.config_timer = QtCore.QTimer()
+        self.config_timer.timeout.connect(config_service.check)
+        self.config_timer.start(1000)
 
     def show_roi_selector(self):
         self.roi_selector = ROISelector()
@@ -1461,7 +1660,12 @@ class Controller:
             self.window.hide()
 
     def save_setting(self):
-        self.show_main()
+        # The config is already applied, keep the running window
+        self.cancel_setting()
+
+    def apply_config(self, changed):
+        if self.window is not None:
+            self.window.apply_config(changed)
 
     def cancel_setting(self):
         if self.setting_window is not None:
@@ -1469,6 +1673,7 @@ class Controller:
         self.window.show()
 
     def show_activate(self):
+        from cryptlex.lexactivator import LexActivator, LexStatusCodes, PermissionFlags
         # Initialize license verification
         LexActivator.SetProductFile('product_v5b67c9c8-4094-4f55-b3d3-fd1227899e1a.dat')
         LexActivator.SetProductId(
@@ -1537,9 +1742,15 @@ class Controller:
 
 
 def main():
-    app = QtWidgets.QApplication(sys.argv)
+    init()
+    with startup.phase('qt_app'):
+        app = QtWidgets.QApplication(sys.argv)
+    threading.Thread(target=preload, name='preload', daemon=True).start()
+    start_status_server()
     controller = Controller()
-    controller.show_activate()
+    with startup.phase('license_and_window'):
+        controller.show_activate()
+    startup.mark('window_shown')
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
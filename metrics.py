@@ -0,0 +1,95 @@
+"""Runtime metrics
+
+A small thread-safe registry of counters, latency samples and event rates.
+The OCR worker and the aggregation side write to the shared `metrics`
+instance, the status server reads snapshots of it.
+"""
+import time
+import threading
+from collections import deque, defaultdict
+
+# Seconds over which event rates are measured
+RATE_WINDOW = 60
+
+
+def _percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Metrics:
+    def __init__(self, max_samples=1000):
+        """Collect counters, latencies and event rates.
+
+        Args
+        :max_samples: Number of recent samples kept for each latency
+        """
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+        self.counters = defaultdict(int)
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.events = defaultdict(deque)
+        self.last_event = {}
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        """Add a latency sample in seconds."""
+        with self.lock:
+            self.samples[name].append(seconds)
+
+    def event(self, name, now=None):
+        """Record one occurrence of an event, used for rates and health."""
+        now = time.time() if now is None else now
+        with self.lock:
+            events = self.events[name]
+            events.append(now)
+            while events and events[0] < now - RATE_WINDOW:
+                events.popleft()
+            self.last_event[name] = now
+            self.counters[name] += 1
+
+    def hit_rate(self, name):
+        """Hit rate of a cache counted as `<name>_hits` and `<name>_misses`, None if unused."""
+        with self.lock:
+            hits = self.counters.get(f'{name}_hits', 0)
+            misses = self.counters.get(f'{name}_misses', 0)
+        total = hits + misses
+        return hits / total if total else None
+
+    def snapshot(self):
+        """Return a JSON-serializable view of all metrics."""
+        now = time.time()
+        with self.lock:
+            counters = dict(self.counters)
+            samples = {name: sorted(values) for name, values in self.samples.items() if values}
+            rates = {}
+            for name, events in self.events.items():
+                n_recent = sum(1 for t in events if t >= now - RATE_WINDOW)
+                rates[name] = n_recent / RATE_WINDOW
+            ages = {name: now - t for name, t in self.last_event.items()}
+
+        latency_ms = {}
+        for name, values in samples.items():
+            latency_ms[name] = {
+                'count': len(values),
+                'p50': _percentile(values, 0.5) * 1000,
+                'p90': _percentile(values, 0.9) * 1000,
+                'p99': _percentile(values, 0.99) * 1000,
+                'max': values[-1] * 1000,
+            }
+        cache_names = {key.rsplit('_', 1)[0] for key in counters if key.endswith(('_hits', '_misses'))}
+        return {
+            'timestamp': now,
+            'counters': counters,
+            'rates_per_sec': rates,
+            'seconds_since_last': ages,
+            'latency_ms': latency_ms,
+            'hit_rate': {name: self.hit_rate(name) for name in cache_names},
+        }
+
+
+# Shared by the whole process
+metrics = Metrics()
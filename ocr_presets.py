@@ -0,0 +1,97 @@
+"""OCR presets
+
+A preset bundles the preprocessing chain and the Tesseract settings used to
+read one column (see `ocr_utils.binarize` and `ocr_utils.read_cells`):
+
+- scale: upscale factor of the crop
+- blur: Gaussian kernel size, 0 for none
+- block, c: block size and constant of the adaptive threshold
+- line_share: length of the horizontal line kernel as a share of the width,
+  0 keeps the grid lines
+- erode, dilate: kernel sizes of the erode -> dilate -> erode cleanup, 0 for none
+- psm, oem: Tesseract page segmentation and engine modes, oem None for the default
+- whitelist: characters Tesseract may output, empty for any
+- conf_thresh: overrides the global `conf_thresh` if set
+
+'balanced' is the recipe the app has always used. A preset is chosen per RoI
+in config.yaml, by name or as a mapping of the parameters that differ from
+'balanced':
+
+    ocr_preset:
+      left: fast
+      right: {psm: 4, blur: 3}
+
+A profile written by tune_ocr.py selects a tuned preset per RoI and takes
+precedence over `ocr_preset`:
+
+    ocr_profile: ocr_profile.yaml
+
+This module has no OpenCV dependency so that configs can be checked without it.
+"""
+import yaml
+
+PRESETS = {
+    'fast': {
+        'scale': 2, 'blur': 0, 'block': 15, 'c': 2, 'line_share': 0.4,
+        'erode': 0, 'dilate': 0, 'psm': 6, 'oem': 1, 'whitelist': '', 'conf_thresh': None,
+    },
+    'balanced': {
+        'scale': 4, 'blur': 5, 'block': 31, 'c': 2, 'line_share': 0.4,
+        'erode': 3, 'dilate': 5, 'psm': 6, 'oem': None, 'whitelist': '', 'conf_thresh': None,
+    },
+    'accurate': {
+        'scale': 6, 'blur': 5, 'block': 45, 'c': 2, 'line_share': 0.4,
+        'erode': 3, 'dilate': 5, 'psm': 6, 'oem': 1, 'whitelist': '0123456789,.', 'conf_thresh': None,
+    },
+}
+
+DEFAULT_PRESET = 'balanced'
+
+
+def resolve_preset(value):
+    """Return the full parameter dict of a preset name or mapping.
+
+    Raises ValueError for an unknown name or parameter.
+    """
+    if value is None:
+        value = DEFAULT_PRESET
+    if isinstance(value, str):
+        if value not in PRESETS:
+            raise ValueError(f'Unknown OCR preset: {value}')
+        return dict(PRESETS[value], name=value)
+    if not isinstance(value, dict):
+        raise ValueError(f'OCR preset must be a name or a mapping: {value}')
+    unknown = set(value) - set(PRESETS[DEFAULT_PRESET]) - {'name'}
+    if unknown:
+        raise ValueError(f'Unknown OCR preset parameters: {", ".join(sorted(unknown))}')
+    preset = dict(PRESETS[DEFAULT_PRESET], name='custom')
+    preset.update(value)
+    return preset
+
+
+def tesseract_options(preset):
+    """Tesseract command-line options of a preset other than --psm."""
+    options = []
+    if preset.get('oem') is not None:
+        options.append(f'--oem {preset["oem"]}')
+    if preset.get('whitelist'):
+        options.append(f'-c tessedit_char_whitelist={preset["whitelist"]}')
+    return ' '.join(options)
+
+
+def load_profile(path):
+    """Return {side: preset} of the settings selected in a tuner profile."""
+    with open(path) as f:
+        profile = yaml.load(f, Loader=yaml.FullLoader) or {}
+    return {side: dict(entry['selected'], name='tuned') for side, entry in profile.items()}
+
+
+def roi_presets(config):
+    """Return {col_name: preset} of the bid and ask RoIs.
+
+    Tuned settings of the `ocr_profile` file come first, then `ocr_preset`.
+    """
+    options = dict(config.get('ocr_preset') or {})
+    if config.get('ocr_profile'):
+        options.update(load_profile(config['ocr_profile']))
+    return {'bid': resolve_preset(options.get('left')), 'ask': resolve_preset(options.get('right'))}
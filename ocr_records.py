@@ -0,0 +1,59 @@
+"""OCR result records
+
+The OCR engines return the cells of a column as a NumPy structured array of
+`CELL_DTYPE`, sorted from top to bottom. Every field is filled once at the
+engine boundary (`make_cells`), so later stages read numbers directly:
+
+- x1, y1, x2, y2: box in the engine's image of the column (upscaled for
+  Tesseract, crop pixels for the DNN engine)
+- value: the parsed number, NaN if the text is not a number
+- conf: confidence 0-100
+- roi: index of the RoI in the `rois` given to `extract_rois`
+- row: ladder row of the cell, or its rank from the top when the engine
+  has no rows
+- text: the recognized text, for logs and debug images
+"""
+import math
+
+import numpy as np
+
+CELL_DTYPE = np.dtype([
+    ('x1', np.int32), ('y1', np.int32), ('x2', np.int32), ('y2', np.int32),
+    ('value', np.float64), ('conf', np.float32),
+    ('roi', np.int8), ('row', np.int16),
+    ('text', 'U16'),
+])
+
+
+def parse_value(text):
+    """Number of an OCR text such as '1,234', NaN if it is not one."""
+    try:
+        return float(text.replace(',', ''))
+    except ValueError:
+        return math.nan
+
+
+def empty_cells():
+    return np.empty(0, CELL_DTYPE)
+
+
+def make_cells(cells, roi=0, rows=None):
+    """Build the records of a column.
+
+    Args
+    :cells: [(x1, y1, x2, y2, text, conf)] as read by the engine, conf may be
+            a string
+    :roi: RoI index
+    :rows: Row of each cell, None to number them from the top
+
+    Returns
+    :records: CELL_DTYPE array sorted by y1
+    """
+    if rows is None:
+        rows = [-1] * len(cells)
+    records = np.array([(x1, y1, x2, y2, parse_value(text), float(conf), roi, row, text)
+                        for (x1, y1, x2, y2, text, conf), row in zip(cells, rows)], CELL_DTYPE)
+    records = records[np.argsort(records['y1'], kind='stable')]
+    if len(records) and records['row'][0] < 0:
+        records['row'] = np.arange(len(records))
+    return records
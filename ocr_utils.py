@@ -1,71 +1,216 @@
 import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
 import cv2
 import numpy as np
-from PIL import Image
 
 tessdata_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'tessdata'))
 os.environ['TESSDATA_PREFIX'] = tessdata_dir
 
 import pytesseract
 
+from metrics import metrics
+from ocr_presets import DEFAULT_PRESET, PRESETS, tesseract_options
+from ocr_records import empty_cells, make_cells
+
+logger = logging.getLogger('root')
+
+# Seconds a Tesseract call may take before its process is killed, 0 for no
+# limit. See `set_ocr_timeout`.
+ocr_timeout = 0
+
+
+class OcrTimeout(RuntimeError):
+    """A Tesseract call was killed at its deadline."""
+
+
+def set_ocr_timeout(seconds):
+    """Set the deadline of every Tesseract call of this process, 0 for none."""
+    global ocr_timeout
+    ocr_timeout = seconds or 0
+
+
+def to_gray(image, scale=4):
+    """Convert a crop to one upscaled gray channel for Tesseract.
 
-def load_image(image, temp_dir='./tmp', min_width=500, dpi=300):
-    """Resize image with specific dpi
-    """
-    if isinstance(image, str):
-        image = Image.open(image)
-    elif isinstance(image, np.ndarray):
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(image)
-
-    w, h = image.size
-    scale = 1 if w > min_width else min_width / w
-    scale = 4
-    w = int(w * scale)
-    h = int(h * scale)
-    image = image.resize((w, h), Image.ANTIALIAS)
-    if not os.path.exists(temp_dir):
-        os.mkdir(temp_dir)
-    filename = os.path.join(temp_dir, 'digit_ocr.png')
-    dpi = dpi if isinstance(dpi, (tuple, list)) else (dpi, dpi)
-    image.save(filename, dpi=dpi)
-    dpi_image = Image.open(filename)
-    return dpi_image
-
-
-def extract_data(image, conf_thresh=80, col_name=None, debug=False):
-    """Extract data from the given image.
-    
     Args
-    :image: numpy array
-    :conf_thresh: Confidence thresh
-    :col_name: Bid or Ask column?
-    :debug: Enable debug mode if true
-    
+    :image: BGRA, BGR or gray uint8 array. May be a strided view into a frame,
+            OpenCV reads it in place.
+    :scale: Upscale factor, the digits are too small for Tesseract otherwise
+
     Returns
-    :results: A list of detected data.
+    :gray: A new (h * scale, w * scale) uint8 array
     """
-    image = load_image(image)
-    rgb = np.array(image)
-    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 2)
-    h_kernel = np.ones((1, int(rgb.shape[1] * 0.4)))
-    detected_lines = cv2.morphologyEx(cv2.bitwise_not(thresh), cv2.MORPH_OPEN, h_kernel, iterations=1)
-    and_thresh = thresh + detected_lines
-    and_thresh = cv2.erode(and_thresh, np.ones((3, 3)), iterations=1)
-    and_thresh = cv2.dilate(and_thresh, np.ones((5, 5)), iterations=1)
-    and_thresh = cv2.erode(and_thresh, np.ones((3, 3)), iterations=1)
-    if debug:
+    if image.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        gray = cv2.cvtColor(image, code)
+    else:
+        gray = np.array(image)
+    if scale == 1:
+        return gray
+    # Gray first so that only one channel is resized. Lanczos like PIL's
+    # resize before, see tests/test_preprocess.py for how close they are.
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_LANCZOS4)
+
+
+class RowCache:
+    def __init__(self, maxsize=1024, name='ocr_row'):
+        """Bounded LRU of recognized ladder rows keyed by the hash of the row image.
+
+        Hits and misses are counted in `metrics` as `<name>_hits` and
+        `<name>_misses`, see `Metrics.hit_rate`.
+
+        Args
+        :maxsize: Number of rows kept
+        :name: Metrics name
+        """
+        self.maxsize = maxsize
+        self.name = name
+        self.lock = threading.Lock()
+        self.rows = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            cells = self.rows.get(key)
+            if cells is not None:
+                self.rows.move_to_end(key)
+        metrics.incr(f'{self.name}_hits' if cells is not None else f'{self.name}_misses')
+        return cells
+
+    def put(self, key, cells):
+        with self.lock:
+            self.rows[key] = cells
+            self.rows.move_to_end(key)
+            while len(self.rows) > self.maxsize:
+                self.rows.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.rows.clear()
+
+
+# Shared by all columns, rows are looked up by content
+row_cache = RowCache()
+
+# Slow readings of suspect rows, see `recheck_strip`
+recheck_cache = RowCache(256, name='ocr_recheck')
+
+# When more than this share of the rows changed, the column is read with one
+# Tesseract call instead of one call per row
+FULL_COLUMN_SHARE = 0.5
+
+
+def binarize(image, col_name=None, recorder=None, preset=None, layout=None, keys=None):
+    """Return the upscaled gray and the black and white image of a column.
+
+    The black and white image is what Tesseract reads.
+
+    Args
+    :preset: Preprocessing parameters, see `ocr_presets`. Defaults to 'balanced'.
+    :layout: LadderLayout of the column. Its grid mask is whitened instead of
+             searching for lines.
+    :keys: ColorKeyStore, see `color_key`. A crop in the learned colors is
+           binarized by a lookup table, the preset only gives the scale.
+    """
+    preset = preset or PRESETS[DEFAULT_PRESET]
+    keyed = keys.apply(col_name, image, preset['scale']) if keys is not None else None
+    if keyed is not None:
+        gray, binary = keyed
+        if layout is not None:
+            binary = cv2.max(binary, layout.line_mask(preset['scale'], binary.shape))
+        if recorder is not None:
+            recorder.add(f'key_{col_name or ""}', binary)
+        return gray, binary
+    gray = to_gray(image, preset['scale'])
+    blur = cv2.GaussianBlur(gray, (preset['blur'], preset['blur']), 0) if preset['blur'] else gray
+    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                   preset['block'], preset['c'])
+    if layout is not None:
+        detected_lines = layout.line_mask(preset['scale'], thresh.shape)
+        and_thresh = cv2.max(thresh, detected_lines)
+    elif preset['line_share']:
+        h_kernel = np.ones((1, max(1, int(gray.shape[1] * preset['line_share']))))
+        detected_lines = cv2.morphologyEx(cv2.bitwise_not(thresh), cv2.MORPH_OPEN, h_kernel, iterations=1)
+        and_thresh = thresh + detected_lines
+    else:
+        detected_lines = np.zeros_like(thresh)
+        and_thresh = thresh
+    if preset['erode']:
+        and_thresh = cv2.erode(and_thresh, np.ones((preset['erode'], preset['erode'])), iterations=1)
+    if preset['dilate']:
+        and_thresh = cv2.dilate(and_thresh, np.ones((preset['dilate'], preset['dilate'])), iterations=1)
+    if preset['erode']:
+        and_thresh = cv2.erode(and_thresh, np.ones((preset['erode'], preset['erode'])), iterations=1)
+    if recorder is not None:
         if col_name is None:
             col_name = ''
-        cv2.imwrite(f'thresh{col_name}.png', thresh)
-        cv2.imwrite(f'and{col_name}.png', and_thresh)
-        cv2.imwrite(f'det{col_name}.png', detected_lines)
+        recorder.add(f'thresh_{col_name}', thresh)
+        recorder.add(f'and_{col_name}', and_thresh)
+        recorder.add(f'det_{col_name}', detected_lines)
+    return gray, and_thresh
+
+
+def row_strips(gray, min_gap=4, contrast=40):
+    """Split a column into one horizontal strip per text row.
+
+    A line holds text when some of its pixels differ from the background
+    (the median gray) by more than `contrast`. Lines that are almost all
+    different are grid lines and count as gaps. Rows are separated by at
+    least `min_gap` gap lines, each strip reaches to the middle of the gaps
+    around it so that the text keeps a blank margin.
+
+    Args
+    :gray: Upscaled gray column, see `to_gray`
+
+    Returns
+    :strips: [(y1, y2)] from top to bottom
+    """
+    ink = np.abs(gray.astype(np.int16) - int(np.median(gray))) > contrast
+    share = ink.mean(axis=1)
+    text = (share > 0) & (share < 0.8)
+    # Starts and ends of the runs of text lines
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], text, [False])).astype(np.int8)))
+    runs = []
+    for start, end in edges.reshape(-1, 2):
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+    strips = []
+    for k, (start, end) in enumerate(runs):
+        y1 = 0 if k == 0 else (runs[k - 1][1] + start) // 2
+        y2 = gray.shape[0] if k == len(runs) - 1 else (end + runs[k + 1][0]) // 2
+        strips.append((int(y1), int(y2)))
+    return strips
+
+
+def read_cells(binary, psm=6, extra=''):
+    """Run Tesseract on a binarized image.
+
+    Args
+    :extra: More Tesseract options, e.g. '-c tessedit_char_whitelist=0123456789'
+
+    Returns
+    :cells: [(x1, y1, x2, y2, text, conf)] of every recognized word, whatever
+            its confidence
 
-    data = pytesseract.image_to_data(and_thresh, lang='digits_comma', config='--psm 6', output_type=pytesseract.Output.DICT)
+    Raises OcrTimeout when Tesseract runs past `ocr_timeout`. Its process is
+    killed and the exception ends the column, so one stuck call costs a tick
+    at most `ocr_timeout` per column.
+    """
+    try:
+        data = pytesseract.image_to_data(binary, lang='digits_comma', config=f'--psm {psm} {extra}'.strip(),
+                                         output_type=pytesseract.Output.DICT, timeout=ocr_timeout)
+    except RuntimeError as e:
+        if 'timeout' not in str(e):
+            raise
+        metrics.incr('ocr_timeouts')
+        raise OcrTimeout(f'Tesseract gave no result within {ocr_timeout}s') from e
     num_texts = len(data['level'])
-    results = []
+    cells = []
     for i in range(num_texts):
         x1, y1 = int(data['left'][i]), int(data['top'][i])
         w, h = int(data['width'][i]), int(data['height'][i])
@@ -73,8 +218,247 @@ def extract_data(image, conf_thresh=80, col_name=None, debug=False):
         y2 = y1 + h
         text = data['text'][i]
         conf = data['conf'][i]
-        if float(conf) > conf_thresh:
-            results.append((x1, y1, x2, y2, text, conf))
+        cells.append((x1, y1, x2, y2, text, conf))
+    return cells
+
+
+def recheck_strip(gray, cache=recheck_cache):
+    """Read one row strip the slow way, for rows the consensus doubts.
+
+    The upscaled gray strip is upscaled twice more, binarized with Otsu and
+    read as a single line restricted to digits and separators.
+
+    Args
+    :gray: Strip of the upscaled gray column, see `to_gray`
+
+    Returns
+    :cells: [(x1, y1, x2, y2, text, conf)] in strip coordinates
+    """
+    key = (gray.shape, hashlib.blake2b(np.ascontiguousarray(gray), digest_size=16).digest())
+    cells = cache.get(key) if cache is not None else None
+    if cells is not None:
+        return cells
+    t0 = time.perf_counter()
+    big = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    big = cv2.GaussianBlur(big, (3, 3), 0)
+    _, binary = cv2.threshold(big, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    if np.count_nonzero(binary) < binary.size // 2:
+        # Light digits on a dark row, Tesseract wants dark on light
+        binary = cv2.bitwise_not(binary)
+    binary = cv2.copyMakeBorder(binary, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=255)
+    cells = [((x1 - 10) // 2, (y1 - 10) // 2, (x2 - 10) // 2, (y2 - 10) // 2, text, conf)
+             for x1, y1, x2, y2, text, conf in read_cells(binary, 7, '-c tessedit_char_whitelist=0123456789,.')]
+    metrics.observe('ocr_recheck_latency', time.perf_counter() - t0)
+    if cache is not None:
+        cache.put(key, cells)
+    return cells
+
+
+def _read_rows(gray, binary, cache, preset, layout=None):
+    # Cells of each row strip, from the cache or from Tesseract. With a
+    # layout, the strips are its cells and x is relative to its cell box.
+    if layout is None:
+        strips = row_strips(gray)
+        x1, x2 = 0, binary.shape[1]
+        psm = 7
+    else:
+        strips = layout.strips(preset['scale'])
+        x1, x2 = layout.cell_x(preset['scale'])
+        psm = layout.psm
+    options = tesseract_options(preset)
+    keys = []
+    rows = []
+    for y1, y2 in strips:
+        strip = binary[y1:y2, x1:x2]
+        if x1 or x2 != binary.shape[1]:
+            strip = np.ascontiguousarray(strip)
+        key = (preset['psm'], psm, options, strip.shape, hashlib.blake2b(strip, digest_size=16).digest())
+        keys.append(key)
+        rows.append(cache.get(key) if cache is not None else None)
+    missed = [k for k, cells in enumerate(rows) if cells is None]
+    if not missed:
+        return strips, x1, rows
+
+    if len(missed) > FULL_COLUMN_SHARE * len(strips):
+        # Most rows changed, e.g. on the first tick. Read the column once and
+        # give each word to the strip that contains its center.
+        for k in missed:
+            rows[k] = []
+        for left, top_, right, bottom_, text, conf in read_cells(binary[:, x1:x2], preset['psm'], options):
+            center = (top_ + bottom_) // 2
+            for k in missed:
+                top, bottom = strips[k]
+                if top <= center < bottom:
+                    rows[k].append((left, top_ - top, right, bottom_ - top, text, conf))
+                    break
+    else:
+        for k in missed:
+            top, bottom = strips[k]
+            rows[k] = read_cells(binary[top:bottom, x1:x2], psm, options)
+    if cache is not None:
+        for k in missed:
+            cache.put(keys[k], rows[k])
+    return strips, x1, rows
+
+
+def extract_data(image, conf_thresh=80, col_name=None, recorder=None, cache=None, consensus=None, preset=None,
+                 layout=None, roi=0, keys=None):
+    """Extract data from the given image.
+    
+    Args
+    :image: BGRA, BGR or gray uint8 array, see `to_gray`
+    :conf_thresh: Confidence thresh
+    :col_name: Bid or Ask column?
+    :recorder: DebugRecorder given the intermediate images, if set
+    :cache: RowCache of recognized rows. Only rows whose pixels changed are
+            read again. Read the whole column every time if None.
+    :consensus: Consensus that votes each row over recent frames, if set
+    :preset: Preprocessing and Tesseract parameters, see `ocr_presets`.
+             Defaults to 'balanced'. Its conf_thresh, if set, overrides `conf_thresh`.
+    :layout: LadderLayout of the column, see `ladder_layout`. Its cells are
+             read one by one instead of finding the rows and grid lines.
+    :roi: RoI index put on the records
+    :keys: ColorKeyStore that binarizes by color, see `color_key`, if set
+    
+    Returns
+    :results: `ocr_records.CELL_DTYPE` array of the words above
+              `conf_thresh`, sorted from top to bottom
+    """
+    preset = preset or PRESETS[DEFAULT_PRESET]
+    if preset.get('conf_thresh') is not None:
+        conf_thresh = preset['conf_thresh']
+    gray, binary = binarize(image, col_name, recorder, preset, layout, keys)
+    if cache is None and consensus is None and layout is None:
+        cells = [cell for cell in read_cells(binary, preset['psm'], tesseract_options(preset))
+                 if float(cell[5]) > conf_thresh]
+        return make_cells(cells, roi)
+    else:
+        strips, left, rows = _read_rows(gray, binary, cache, preset, layout)
+        if consensus is not None:
+            right = left + binary.shape[1] if layout is None else layout.cell_x(preset['scale'])[1]
+            rows = consensus.vote(col_name, rows, conf_thresh,
+                                  lambda k: recheck_strip(gray[strips[k][0]:strips[k][1], left:right]))
+        cells = []
+        row_ids = []
+        for k, ((top, _), row) in enumerate(zip(strips, rows)):
+            for x1, y1, x2, y2, text, conf in row:
+                if float(conf) > conf_thresh:
+                    cells.append((x1 + left, y1 + top, x2 + left, y2 + top, text, conf))
+                    row_ids.append(k)
+        return make_cells(cells, roi, row_ids)
+
+
+def cell_boxes(image, layout=None):
+    """Return the (x1, y1, x2, y2) box of every row of a column crop, in crop pixels.
+
+    Args
+    :layout: LadderLayout of the column. Without it the rows are found with
+             `row_strips` and span the whole width.
+    """
+    if layout is not None:
+        x1, x2 = layout.x_range
+        return [(x1, y1, x2, y2) for y1, y2 in layout.rows]
+    # Same rows as a calibration finds, ladder_layout imports this module
+    from ladder_layout import CALIBRATION_SCALE as scale
+    return [(0, y1 // scale, image.shape[1], -(-y2 // scale)) for y1, y2 in row_strips(to_gray(image, scale))]
+
+
+def _extract_rois_dnn(crops, engine, conf_thresh, consensus, layouts):
+    # Every cell of every column in one forward pass
+    boxes = {}
+    cells = []
+    for col_name, img in crops.items():
+        layout = layouts.get(col_name, img) if layouts is not None else None
+        gray = to_gray(img, 1)
+        boxes[col_name] = cell_boxes(img, layout)
+        cells.extend(gray[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes[col_name])
+    t0 = time.perf_counter()
+    texts = iter(engine.recognize(cells))
+    metrics.observe('dnn_batch_latency', time.perf_counter() - t0)
+
+    results = {}
+    for roi, (col_name, col_boxes) in enumerate(boxes.items()):
+        rows = []
+        for box in col_boxes:
+            text, conf = next(texts)
+            rows.append([(0, 0, box[2] - box[0], box[3] - box[1], text, conf)] if text else [])
+        if consensus is not None:
+            rows = consensus.vote(col_name, rows, conf_thresh)
+        cells = []
+        row_ids = []
+        for k, (box, row) in enumerate(zip(col_boxes, rows)):
+            for x1, y1, x2, y2, text, conf in row:
+                if conf > conf_thresh:
+                    cells.append((x1 + box[0], y1 + box[1], x2 + box[0], y2 + box[1], text, conf))
+                    row_ids.append(k)
+        results[col_name] = make_cells(cells, roi, row_ids)
+    return results
+
+
+def extract_rois(image, rois, conf_thresh=80, recorder=None, consensus=None, presets=None, layouts=None,
+                 engine=None, keys=None):
+    """Crop each region of interest from one frame and extract its data.
+
+    Args
+    :image: BGRA array of the full frame, see `capture_utils`
+    :rois: {col_name: (x1, y1, x2, y2)}
+    :conf_thresh: Confidence thresh
+    :recorder: DebugRecorder given the crops and intermediate images of this
+               tick, if set
+    :consensus: Consensus that votes each row over recent frames, if set
+    :presets: {col_name: preset}, see `ocr_presets.roi_presets`. A missing
+              column uses 'balanced'.
+    :layouts: LayoutStore of the ladder layouts, calibrated on first use, if set
+    :engine: DigitRecognizer that reads the cells of all columns in one batch
+             instead of Tesseract, see `dnn_ocr`. Cell boxes are then in crop
+             pixels and `presets` are not used.
+    :keys: ColorKeyStore of the RoI palettes, calibrated on first use, if set.
+           Not used by `engine`.
+
+    Returns
+    :results: {col_name: `ocr_records.CELL_DTYPE` array sorted by y-axis}.
+              A column that fails is logged and left out.
+    """
+    if engine is not None:
+        crops = {col_name: image[y1:y2, x1:x2] for col_name, (x1, y1, x2, y2) in rois.items()}
+        if recorder is not None:
+            for col_name, img in crops.items():
+                recorder.add(f'roi_{col_name}', img, copy=True)
+        try:
+            results = _extract_rois_dnn(crops, engine, conf_thresh, consensus, layouts)
+        except Exception as e:
+            logger.error('Error while extracting data: %s', e)
+            results = {}
+        if recorder is not None:
+            for col_name in rois:
+                recorder.note_results(results.get(col_name, empty_cells()))
+            recorder.end_tick({col_name: rs['text'].tolist() for col_name, rs in results.items()})
+        return results
+
+    results = {}
+    for roi_id, (col_name, roi) in enumerate(rois.items()):
+        try:
+            x1, y1, x2, y2 = roi
+            # A view into the frame, no copy
+            img = image[y1:y2, x1:x2]
+            if recorder is not None:
+                # The frame may be reused by the next capture
+                recorder.add(f'roi_{col_name}', img, copy=True)
+            t0 = time.perf_counter()
+            layout = layouts.get(col_name, img) if layouts is not None else None
+            col_result = extract_data(img, conf_thresh, col_name, recorder, row_cache, consensus,
+                                      preset=(presets or {}).get(col_name), layout=layout, roi=roi_id, keys=keys)
+            metrics.observe('ocr_latency', time.perf_counter() - t0)
+        except Exception as e:
+            logger.error('Error while extracting data: %s', e)
+            col_result = None
+        if recorder is not None:
+            recorder.note_results(col_result if col_result is not None else empty_cells())
+        if col_result is None:
+            continue
+        results[col_name] = col_result
+    if recorder is not None:
+        recorder.end_tick({col_name: rs['text'].tolist() for col_name, rs in results.items()})
     return results
 
 
@@ -82,8 +466,8 @@ def draw_results(image, results):
     """
     """
     image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-    for text_box in results:
-        x1, y1, x2, y2, text,  conf = text_box
+    for cell in results:
+        x1, y1, x2, y2, text = int(cell['x1']), int(cell['y1']), int(cell['x2']), int(cell['y2']), str(cell['text'])
         cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
         cv2.putText(image, text, (x1, y2), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
     return image
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""Startup timing
+
+Records how long each startup phase takes and when milestones such as the
+first OCR tick are reached, relative to process start.
+"""
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger('root')
+
+
+class PhaseTimer:
+    def __init__(self, start=None):
+        """Time startup phases.
+
+        Args
+        :start: time.perf_counter() value taken at process start. Defaults to now.
+
+        Attributes
+        :phases: [(name, seconds)] in the order they finished
+        :marks: {name: seconds since start} of each milestone
+        """
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []
+        self.marks = {}
+
+    def record(self, name, elapsed):
+        self.phases.append((name, elapsed))
+        logger.info(f'Startup phase {name}: {elapsed * 1000:.1f} ms')
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as one phase."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def mark(self, name):
+        """Record a milestone the first time it is reached."""
+        if name in self.marks:
+            return
+        elapsed = time.perf_counter() - self.start
+        self.marks[name] = elapsed
+        logger.info(f'Startup milestone {name}: {elapsed * 1000:.1f} ms after start')
@@ -0,0 +1,144 @@
+"""ZeroMQ tick publisher
+
+Streams every aggregated tick over a PUB socket so that downstream strategy
+processes can consume bid/ask sums and window ratios live.
+
+Each message is a two-frame multipart message:
+
+    frame 0: topic, the instrument name (utf-8). Subscribers filter on it.
+    frame 1: payload, a little-endian binary record (see `encode_tick`).
+"""
+import struct
+import logging
+
+import zmq
+
+logger = logging.getLogger('root')
+
+WIRE_VERSION = 1
+
+_HEADER = struct.Struct('<BdHH')      # version, timestamp, n_rois, n_periods
+_ROI_HEADER = struct.Struct('<dH')    # sum, n_rows
+_RATIO = struct.Struct('<Idd')        # period, bid ratio, ask ratio
+
+
+def encode_tick(timestamp, roi_sums, roi_rows, ratios):
+    """Encode a tick as a compact binary record.
+
+    Args
+    :timestamp: Unix time of the tick
+    :roi_sums: {roi_name: sum}
+    :roi_rows: {roi_name: [row values]} sorted from top to bottom
+    :ratios: {period: (bid_ratio, ask_ratio)}. Use NaN when a window is empty.
+
+    Returns
+    :payload: bytes
+    """
+    parts = [_HEADER.pack(WIRE_VERSION, timestamp, len(roi_sums), len(ratios))]
+    for name, sum_ in roi_sums.items():
+        name_bytes = name.encode('utf-8')
+        rows = roi_rows.get(name, ())
+        parts.append(struct.pack('<B', len(name_bytes)))
+        parts.append(name_bytes)
+        parts.append(_ROI_HEADER.pack(sum_, len(rows)))
+        parts.append(struct.pack(f'<{len(rows)}d', *rows))
+    for period, (bid_ratio, ask_ratio) in ratios.items():
+        parts.append(_RATIO.pack(int(period), bid_ratio, ask_ratio))
+    return b''.join(parts)
+
+
+def decode_tick(payload):
+    """Decode a payload created by `encode_tick`.
+
+    Returns
+    :tick: A dict with keys timestamp, sums, rows and ratios.
+    """
+    version, timestamp, n_rois, n_periods = _HEADER.unpack_from(payload, 0)
+    if version != WIRE_VERSION:
+        raise ValueError(f'Unsupported wire version: {version}')
+    offset = _HEADER.size
+    sums, rows, ratios = {}, {}, {}
+    for _ in range(n_rois):
+        name_len = payload[offset]
+        offset += 1
+        name = payload[offset:offset + name_len].decode('utf-8')
+        offset += name_len
+        sum_, n_rows = _ROI_HEADER.unpack_from(payload, offset)
+        offset += _ROI_HEADER.size
+        rows[name] = list(struct.unpack_from(f'<{n_rows}d', payload, offset))
+        offset += 8 * n_rows
+        sums[name] = sum_
+    for _ in range(n_periods):
+        period, bid_ratio, ask_ratio = _RATIO.unpack_from(payload, offset)
+        offset += _RATIO.size
+        ratios[period] = (bid_ratio, ask_ratio)
+    return {'timestamp': timestamp, 'sums': sums, 'rows': rows, 'ratios': ratios}
+
+
+class TickPublisher:
+    def __init__(self, endpoint='tcp://127.0.0.1:5556', instrument='default', sndhwm=100):
+        """Publish ticks on a ZeroMQ PUB socket.
+
+        Sending never blocks: once `sndhwm` messages are queued for a slow
+        subscriber, ZeroMQ drops newer ticks for that subscriber only. A PUB
+        socket drops them silently, they cannot be counted here.
+
+        Args
+        :endpoint: Address to bind, e.g. tcp://127.0.0.1:5556
+        :instrument: Topic used for topic-per-instrument filtering
+        :sndhwm: Send high-water mark (messages per subscriber)
+        """
+        self.endpoint = endpoint
+        self.topic = instrument.encode('utf-8')
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, sndhwm)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(endpoint)
+        logger.info(f'Tick publisher bound to {endpoint} with topic {instrument}')
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a publisher from the `publisher` config section, or None if disabled."""
+        options = config.get('publisher') or {}
+        if not options.get('enabled', False):
+            return None
+        return cls(options.get('endpoint', 'tcp://127.0.0.1:5556'),
+                   options.get('instrument', 'default'),
+                   options.get('sndhwm', 100))
+
+    def publish(self, timestamp, roi_sums, roi_rows, ratios, instrument=None):
+        """Publish one tick. See `encode_tick` for the arguments.
+
+        `instrument` overrides the topic, for a process that aggregates
+        several instruments.
+        """
+        payload = encode_tick(timestamp, roi_sums, roi_rows, ratios)
+        topic = self.topic if instrument is None else instrument.encode('utf-8')
+        self.socket.send_multipart([topic, payload], flags=zmq.NOBLOCK)
+
+    def close(self):
+        self.socket.close()
+
+
+def subscribe(endpoint, instruments=('',), rcvhwm=100):
+    """Create a SUB socket connected to a tick publisher.
+
+    Args
+    :endpoint: Publisher address, e.g. tcp://127.0.0.1:5556
+    :instruments: Topics to subscribe to. An empty string subscribes to all.
+    :rcvhwm: Receive high-water mark
+
+    Usage
+        socket = subscribe('tcp://127.0.0.1:5556', ['ES'])
+        topic, payload = socket.recv_multipart()
+        tick = decode_tick(payload)
+    """
+    socket = zmq.Context.instance().socket(zmq.SUB)
+    socket.setsockopt(zmq.RCVHWM, rcvhwm)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    for instrument in instruments:
+        socket.setsockopt(zmq.SUBSCRIBE, instrument.encode('utf-8'))
+    return socket
+
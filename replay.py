@@ -0,0 +1,157 @@
+"""Replay of recorded sessions
+
+Runs a recorded session through the same capture -> OCR -> aggregation ->
+alarm path as the daemon, with simulated time and as fast as the CPU allows,
+to see what other thresholds or OCR settings would have done.
+
+Usage
+    python replay.py --source ./frames
+    python replay.py --source session.mp4 --start 1697704200 --config tuned.yaml
+    python replay.py --source ./frames --ticks ticks.jsonl --alarms alarms.jsonl
+
+The session is a directory of frames, timed by their file names (epoch
+seconds or milliseconds, or the debug recorder's 20231019-093000.123) or else
+their modification times, or a video file, timed by its frame rate.
+
+Ticks fall every `interval` seconds of the recording, each on the latest
+frame taken at or before it, as the live app would have captured it. A frame
+shown for several ticks is read again like on screen, the row cache makes
+that cheap. Gaps longer than `--max-gap` (e.g. a recording paused overnight)
+are skipped instead of repeating the last frame.
+
+The tick stream is written as the daemon writes it. The alarm log gets the
+alerts that pass the rate limits and de-duplication of the `alerts` config,
+measured on the simulated time.
+
+The replay works on a copy of the config. The ladder layout and color key are
+calibrated again from the recording into a temporary directory, the files of
+the live app are not read or overwritten.
+"""
+import os
+import copy
+import time
+import shutil
+import bisect
+import logging
+import argparse
+import tempfile
+
+from alerts import AlertDispatcher, FileSink
+from capture_utils import DirectorySource, VideoSource
+from config_utils import load_config
+from daemon import JsonLinesSink, run
+
+logger = logging.getLogger('root')
+
+
+class ReplaySource:
+    def __init__(self, source, interval, max_gap=60):
+        """Frames of a recorded source at the ticks of a simulated clock.
+
+        Args
+        :source: DirectorySource or VideoSource, with frame `times` in order
+        :interval: Seconds between ticks
+        :max_gap: Seconds without a frame after which the clock jumps to the
+                  next frame
+
+        Attributes
+        :timestamp: Simulated time of the last tick, read by `daemon.run`
+        """
+        if any(later < earlier for earlier, later in zip(source.times, source.times[1:])):
+            raise ValueError('Frame times are not in file order')
+        self.source = source
+        self.interval = interval
+        self.max_gap = max_gap
+        self.timestamp = None
+        self.current = -1
+        self.frame = None
+
+    def grab(self):
+        times = self.source.times
+        if not times:
+            return None
+        if self.timestamp is None:
+            self.timestamp = times[0]
+        else:
+            self.timestamp += self.interval
+        if self.timestamp >= times[-1] + self.interval:
+            return None
+        # Latest frame at or before the tick
+        k = bisect.bisect_right(times, self.timestamp) - 1
+        if self.timestamp - times[k] > self.max_gap and k + 1 < len(times):
+            k += 1
+            self.timestamp = times[k]
+        if k != self.current:
+            # Frames between two ticks are never shown, they are not decoded
+            while self.source.index < k:
+                self.source.skip()
+            self.frame = self.source.grab()
+            self.current = k
+        return self.frame
+
+    def close(self):
+        self.source.close()
+
+
+def open_recording(path, start=None):
+    """Create a DirectorySource or a VideoSource of a recorded session."""
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    return VideoSource(path, start)
+
+
+def replay(config, source, ticks_path, alarms_path, instrument=None, max_gap=60):
+    """Replay a recorded source and write its ticks and alarms.
+
+    Returns (ticks, simulated seconds).
+    """
+    for path in (ticks_path, alarms_path):
+        if os.path.exists(path):
+            os.remove(path)
+    # RoI tracking moves the RoIs of the config it runs on
+    config = copy.deepcopy(config)
+    work_dir = tempfile.mkdtemp(prefix='replay_')
+    for section, name in (('ladder_layout', 'ladder_layout.json'), ('color_key', 'color_key.json')):
+        if config.get(section) is not None:
+            config[section] = dict(config[section], file=os.path.join(work_dir, name))
+    replayed = ReplaySource(source, config['interval'], max_gap)
+    sink = JsonLinesSink(open(ticks_path, 'w'), instrument)
+    alerts = AlertDispatcher.from_config(config, sinks=[FileSink(alarms_path)], replay=True)
+    try:
+        n_ticks = run(config, replayed, sink, 0, alerts=alerts)
+    finally:
+        sink.close()
+        alerts.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if replayed.timestamp is None:
+        return n_ticks, 0.0
+    return n_ticks, replayed.timestamp - source.times[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded session with simulated time.')
+    parser.add_argument('--config', default='config.yaml', help='Config file, e.g. with other thresholds')
+    parser.add_argument('--source', required=True, help='Directory of frames or a video file')
+    parser.add_argument('--start', type=float, default=None, help='Epoch time of the first frame of a video')
+    parser.add_argument('--ticks', default='replay_ticks.jsonl', help='JSON lines file of the ticks')
+    parser.add_argument('--alarms', default='replay_alarms.jsonl', help='JSON lines file of the alarms')
+    parser.add_argument('--instrument', default=None, help='Instrument name put on every tick')
+    parser.add_argument('--max-gap', type=float, default=60, help='Seconds without frames that are skipped')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(args.config)
+    source = open_recording(args.source, args.start)
+    t0 = time.perf_counter()
+    try:
+        n_ticks, simulated = replay(config, source, args.ticks, args.alarms, args.instrument, args.max_gap)
+    finally:
+        source.close()
+    elapsed = time.perf_counter() - t0
+    speed = f', {simulated / elapsed:.1f}x real time' if elapsed > 0 and simulated > 0 else ''
+    logger.info(f'Replayed {n_ticks} ticks over {simulated:.0f} s of recording in {elapsed:.1f} s{speed}')
+    logger.info(f'Ticks in {args.ticks}, alarms in {args.alarms}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""RoI tracking
+
+RoIs are absolute pixel coordinates. When the trading platform window moves,
+`RoiLocator` finds the ladder again and shifts the RoIs with it:
+
+- on the first frame, the area around the RoIs (their bounding box plus a
+  margin, so that headers and grid lines are part of it) is kept as a
+  template
+- every `check_every` ticks, the template is compared with the frame at the
+  current position, a single correlation on the downscaled template area
+- when that score drops under `threshold`, the template is searched in the
+  whole downscaled frame, the match is refined at full resolution and every
+  RoI is moved by the same offset
+
+Only moves are tracked. A resize that changes the layout of the ladder
+needs the RoIs to be selected again.
+"""
+import logging
+
+import cv2
+
+from capture_utils import bounding_box
+from metrics import metrics
+
+logger = logging.getLogger('root')
+
+
+def _gray(image):
+    if image.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        return cv2.cvtColor(image, code)
+    return image
+
+
+def _small(gray, downscale):
+    return cv2.resize(gray, None, fx=1 / downscale, fy=1 / downscale, interpolation=cv2.INTER_AREA)
+
+
+class RoiLocator:
+    def __init__(self, rois, check_every=10, threshold=0.6, downscale=4, margin=20):
+        """Keep RoIs on the ladder when its window moves.
+
+        Args
+        :rois: {col_name: (x1, y1, x2, y2)}, updated in place when the ladder moved
+        :check_every: Ticks between two checks of the current position
+        :threshold: Lowest normalized correlation that counts as found
+        :downscale: Factor the frame is shrunk by for the checks and the search
+        :margin: Pixels around the RoIs that are part of the template
+        """
+        self.rois = rois
+        self.check_every = check_every
+        self.threshold = threshold
+        self.downscale = downscale
+        self.margin = margin
+        self.template = None
+        self.small_template = None
+        self.origin = None
+        self.n_ticks = 0
+
+    @classmethod
+    def from_config(cls, config, rois):
+        """Create from the `roi_tracking` config section, or None if disabled."""
+        options = config.get('roi_tracking') or {}
+        if not options.get('enabled', False):
+            return None
+        return cls(rois,
+                   options.get('check_every', 10),
+                   options.get('threshold', 0.6),
+                   options.get('downscale', 4),
+                   options.get('margin', 20))
+
+    def reset(self, rois=None):
+        """Take the template again on the next frame, e.g. after the RoIs were selected again."""
+        if rois is not None:
+            self.rois = rois
+        self.template = None
+
+    def _calibrate(self, gray):
+        x1, y1, x2, y2 = bounding_box(self.rois)
+        x1, y1 = max(0, x1 - self.margin), max(0, y1 - self.margin)
+        x2, y2 = min(gray.shape[1], x2 + self.margin), min(gray.shape[0], y2 + self.margin)
+        if x2 - x1 < 2 * self.downscale or y2 - y1 < 2 * self.downscale:
+            return
+        self.origin = (x1, y1)
+        self.template = gray[y1:y2, x1:x2].copy()
+        self.small_template = _small(self.template, self.downscale)
+
+    def _score_here(self, frame):
+        # Only the template area is converted and shrunk, as the template was
+        x, y = self.origin
+        h, w = self.template.shape
+        patch = _small(_gray(frame[y:y + h, x:x + w]), self.downscale)
+        if patch.shape != self.small_template.shape:
+            return -1.0
+        return float(cv2.matchTemplate(patch, self.small_template, cv2.TM_CCOEFF_NORMED)[0, 0])
+
+    def _search(self, gray, small):
+        # Best position in the downscaled frame, then within one downscaled
+        # pixel around it at full resolution
+        result = cv2.matchTemplate(small, self.small_template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (sx, sy) = cv2.minMaxLoc(result)
+        if score < self.threshold:
+            return None
+        h, w = self.template.shape
+        pad = self.downscale
+        x0 = max(0, sx * self.downscale - pad)
+        y0 = max(0, sy * self.downscale - pad)
+        area = gray[y0:y0 + h + 2 * pad, x0:x0 + w + 2 * pad]
+        if area.shape[0] < h or area.shape[1] < w:
+            return None
+        _, score, _, (fx, fy) = cv2.minMaxLoc(cv2.matchTemplate(area, self.template, cv2.TM_CCOEFF_NORMED))
+        return x0 + fx, y0 + fy, score
+
+    def update(self, frame):
+        """Check the ladder position on one frame.
+
+        Args
+        :frame: BGRA, BGR or gray full frame
+
+        Returns True if the RoIs were moved.
+        """
+        self.n_ticks += 1
+        if self.template is None:
+            self._calibrate(_gray(frame))
+            return False
+        if self.n_ticks % self.check_every:
+            return False
+
+        if self._score_here(frame) >= self.threshold:
+            return False
+
+        metrics.incr('roi_searches')
+        gray = _gray(frame)
+        found = self._search(gray, _small(gray, self.downscale))
+        if found is None:
+            metrics.incr('roi_lost')
+            logger.warning('Ladder not found on screen, RoIs kept')
+            return False
+        nx, ny, score = found
+        dx, dy = nx - self.origin[0], ny - self.origin[1]
+        if not dx and not dy:
+            return False
+        for col_name, (x1, y1, x2, y2) in list(self.rois.items()):
+            self.rois[col_name] = (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+        self.origin = (nx, ny)
+        metrics.incr('roi_moves')
+        logger.info(f'Ladder moved by ({dx}, {dy}), score {score:.2f}, RoIs updated')
+        return True
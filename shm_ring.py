@@ -0,0 +1,150 @@
+"""Shared-memory result ring
+
+One OCR worker process writes the results of each tick into a ring of fixed
+size records in shared memory, the aggregator reads them without any
+pickling or pipe. There is a single writer per ring.
+
+Every slot is guarded by a sequence number (a seqlock): the writer makes it
+odd before writing and even after, a reader retries when the number is odd
+or changed while it copied the slot.
+"""
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Rows kept per column. A ladder has about ten rows.
+MAX_ROWS = 32
+
+HEADER_DTYPE = np.dtype([
+    ('write_seq', '<u8'),   # Number of records written so far
+    ('heartbeat', '<f8'),   # Last time the worker was alive, even without result
+    ('pid', '<i8'),
+    ('n_slots', '<u8'),
+])
+
+RECORD_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('timestamp', '<f8'),
+    ('bid_sum', '<f8'),
+    ('ask_sum', '<f8'),
+    ('n_bid', '<u2'),
+    ('n_ask', '<u2'),
+    ('bid_rows', '<f8', (MAX_ROWS,)),
+    ('ask_rows', '<f8', (MAX_ROWS,)),
+])
+
+
+class ResultRing:
+    def __init__(self, name, n_slots=64, create=False):
+        """Ring of tick results in shared memory.
+
+        Args
+        :name: Shared memory name, e.g. 'l2easy_ES'
+        :n_slots: Number of records kept. Read from the segment when attaching.
+        :create: Create the segment (the supervisor) or attach to it (a worker)
+        """
+        self.name = name
+        size = HEADER_DTYPE.itemsize + RECORD_DTYPE.itemsize * n_slots
+        if create:
+            try:
+                # Left over by a supervisor that was killed
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.owner = create
+        self.header = np.ndarray((1,), HEADER_DTYPE, buffer=self.shm.buf)
+        if create:
+            self.header[0] = (0, 0.0, 0, n_slots)
+        self.n_slots = int(self.header['n_slots'][0])
+        self.slots = np.ndarray((self.n_slots,), RECORD_DTYPE, buffer=self.shm.buf, offset=HEADER_DTYPE.itemsize)
+        if create:
+            self.slots['seq'] = 0
+
+    def write(self, timestamp, bid_sum, ask_sum, bid_rows, ask_rows):
+        """Append the result of one tick. Only one process may write."""
+        n = int(self.header['write_seq'][0])
+        slot = self.slots[n % self.n_slots:n % self.n_slots + 1]
+        seq = 2 * n + 1
+        slot['seq'] = seq
+        bid_rows = bid_rows[:MAX_ROWS]
+        ask_rows = ask_rows[:MAX_ROWS]
+        slot['timestamp'] = timestamp
+        slot['bid_sum'] = bid_sum
+        slot['ask_sum'] = ask_sum
+        slot['n_bid'] = len(bid_rows)
+        slot['n_ask'] = len(ask_rows)
+        slot['bid_rows'][0, :len(bid_rows)] = bid_rows
+        slot['ask_rows'][0, :len(ask_rows)] = ask_rows
+        slot['seq'] = seq + 1
+        self.header['write_seq'] = n + 1
+        self.header['heartbeat'] = timestamp
+
+    def beat(self, pid=None):
+        """Mark the worker alive."""
+        self.header['heartbeat'] = time.time()
+        if pid is not None:
+            self.header['pid'] = pid
+
+    @property
+    def write_seq(self):
+        return int(self.header['write_seq'][0])
+
+    @property
+    def heartbeat(self):
+        return float(self.header['heartbeat'][0])
+
+    def _read_slot(self, n, retries=3):
+        slot = self.slots[n % self.n_slots]
+        for _ in range(retries):
+            before = int(slot['seq'])
+            if before != 2 * n + 2:
+                # Being written, or already overwritten by a newer record
+                if before > 2 * n + 2:
+                    return None
+                continue
+            record = slot.copy()
+            if int(slot['seq']) == before:
+                return record
+        return None
+
+    def read_since(self, last_seq):
+        """Return records written after `last_seq` and the new last seq.
+
+        When the reader is more than `n_slots` records behind, the oldest ones
+        are skipped.
+        """
+        write_seq = self.write_seq
+        first = max(last_seq, write_seq - self.n_slots)
+        records = []
+        for n in range(first, write_seq):
+            record = self._read_slot(n)
+            if record is not None:
+                records.append(record)
+        return records, write_seq
+
+    def latest(self):
+        """Return the newest record or None."""
+        write_seq = self.write_seq
+        if write_seq == 0:
+            return None
+        return self._read_slot(write_seq - 1)
+
+    def close(self):
+        del self.header, self.slots
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def record_rows(record):
+    """Return ({'bid': sum, 'ask': sum}, {'bid': [rows], 'ask': [rows]}) of a record."""
+    sums = {'bid': float(record['bid_sum']), 'ask': float(record['ask_sum'])}
+    rows = {
+        'bid': record['bid_rows'][:record['n_bid']].tolist(),
+        'ask': record['ask_rows'][:record['n_ask']].tolist(),
+    }
+    return sums, rows
@@ -0,0 +1,128 @@
+"""Sparkline widget for the main window
+
+Draws one column per `per_pixel` values into an offscreen pixmap, as the
+range (min to max) of the values of that column, so a chart of a few hundred
+pixels shows hours of one second ticks. Completing a column scrolls the
+pixmap one pixel to the left and draws only the new column, a value that
+joins an open column only redraws that column, and a paint event is a single
+blit. The cost per update does not depend on how much history is visible.
+"""
+import math
+from collections import deque
+
+from PyQt5 import QtWidgets, QtGui
+
+BACKGROUND = QtGui.QColor(255, 255, 255)
+AXIS = QtGui.QColor(200, 200, 200)
+BID = QtGui.QColor(0, 150, 0)
+ASK = QtGui.QColor(200, 0, 0)
+
+
+def per_pixel(span, width, seconds_per_value):
+    """Values per column for a chart `width` pixels wide to show `span` seconds, at least 1."""
+    if span <= 0 or width <= 0 or seconds_per_value <= 0:
+        return 1
+    return max(1, math.ceil(span / (width * seconds_per_value)))
+
+
+class Sparkline(QtWidgets.QWidget):
+    def __init__(self, width=120, height=18, scale=None, per_pixel=1, parent=None):
+        """Scrolling chart of values around zero, positive for bid and negative for ask.
+
+        Args
+        :width: Number of columns shown, one pixel each
+        :height: Height in pixels
+        :scale: Value drawn at the top edge. Grows with the values if None.
+        :per_pixel: Values per column, see `per_pixel`
+
+        Attributes
+        :columns: (low, high, last) of each column, None where all values were NaN
+        """
+        super().__init__(parent)
+        self.columns = deque(maxlen=width)
+        self.per_pixel = per_pixel
+        self.n_open = 0  # Values in the rightmost column, it is complete at `per_pixel`
+        self.auto_scale = scale is None
+        self.scale = scale or 1.0
+        self.pixmap = QtGui.QPixmap(width, height)
+        self.setFixedSize(width, height)
+        self._redraw()
+
+    def _y(self, value):
+        half = (self.pixmap.height() - 1) / 2
+        value = max(-self.scale, min(self.scale, value))
+        return int(round(half - value / self.scale * half))
+
+    def _draw_column(self, painter, x, prev, column):
+        height = self.pixmap.height()
+        painter.fillRect(x, 0, 1, height, BACKGROUND)
+        mid = self._y(0)
+        painter.setPen(AXIS)
+        painter.drawPoint(x, mid)
+        if column is None:
+            return
+        low, high, _ = column
+        # Joined to the last value of the previous column, or to the axis
+        base = prev[2] if prev is not None else 0.0
+        low, high = min(low, base), max(high, base)
+        if high > 0:
+            painter.setPen(BID)
+            painter.drawLine(x, self._y(max(low, 0)), x, self._y(high))
+        if low < 0:
+            painter.setPen(ASK)
+            painter.drawLine(x, self._y(low), x, self._y(min(high, 0)))
+
+    def _redraw(self):
+        # Full repaint, only needed when the scale changes or on clear
+        self.pixmap.fill(BACKGROUND)
+        painter = QtGui.QPainter(self.pixmap)
+        x0 = self.pixmap.width() - len(self.columns)
+        prev = None
+        for k, column in enumerate(self.columns):
+            self._draw_column(painter, x0 + k, prev, column)
+            prev = column
+        painter.end()
+
+    def add(self, value):
+        """Append a value, NaN leaves a gap."""
+        new_column = self.n_open == 0 or self.n_open >= self.per_pixel
+        column = None if new_column else self.columns[-1]
+        if not math.isnan(value):
+            column = (value, value, value) if column is None else (min(column[0], value), max(column[1], value), value)
+        if new_column:
+            self.columns.append(column)
+            self.n_open = 1
+        else:
+            self.columns[-1] = column
+            self.n_open += 1
+        prev = self.columns[-2] if len(self.columns) > 1 else None
+
+        if self.auto_scale and not math.isnan(value) and abs(value) > self.scale:
+            self.scale = abs(value) * 1.25
+            self._redraw()
+        else:
+            if new_column:
+                self.pixmap.scroll(-1, 0, self.pixmap.rect())
+            painter = QtGui.QPainter(self.pixmap)
+            self._draw_column(painter, self.pixmap.width() - 1, prev, column)
+            painter.end()
+        self.update()
+
+    def set_per_pixel(self, per_pixel):
+        """Change the values per column, the chart is cleared if it differs."""
+        if per_pixel != self.per_pixel:
+            self.per_pixel = per_pixel
+            self.clear()
+
+    def clear(self):
+        self.columns.clear()
+        self.n_open = 0
+        if self.auto_scale:
+            self.scale = 1.0
+        self._redraw()
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.drawPixmap(event.rect(), self.pixmap, event.rect())
+        painter.end()
@@ -0,0 +1,248 @@
+"""Local status server
+
+Serves the live state and metrics over HTTP on its own threads, so that
+dashboards never touch the Qt event loop.
+
+    GET /state    JSON snapshot of the latest tick (sums, rows, ratios, alarms)
+    GET /metrics  JSON tick rate, OCR latency percentiles and cache hit rates
+    GET /ws       WebSocket. Sends the full state once, then only the changes:
+                  {"type": "delta", "changed": {"ratios.10": [2.1, 1.0]}, "removed": []}
+    POST /debug/dump  Write the debug images of the recent ticks, when debug is on
+
+The aggregation side calls `publish(state)` after every tick. Publishing only
+swaps the snapshot and queues the delta for each client, it never waits on a
+socket.
+"""
+import json
+import queue
+import base64
+import select
+import struct
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import metrics
+
+logger = logging.getLogger('root')
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_OP_TEXT, _OP_CLOSE, _OP_PING, _OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+# Deltas queued per WebSocket client. A client that falls this far behind is
+# sent a full snapshot instead of the backlog.
+CLIENT_QUEUE_SIZE = 64
+
+
+def flatten(state, prefix=''):
+    """Flatten nested dicts into {'a.b': value} so that deltas stay small."""
+    flat = {}
+    for key, value in state.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, name + '.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def diff(old, new):
+    """Return (changed, removed) between two flattened states."""
+    changed = {key: value for key, value in new.items() if old.get(key, object()) != value}
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+def _encode_frame(payload, opcode=_OP_TEXT):
+    header = bytes([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        header += bytes([n])
+    elif n < 1 << 16:
+        header += bytes([126]) + struct.pack('!H', n)
+    else:
+        header += bytes([127]) + struct.pack('!Q', n)
+    return header + payload
+
+
+def _read_frame(rfile):
+    """Read one client frame. Client frames are always masked."""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return _OP_CLOSE, b''
+    opcode = head[0] & 0x0F
+    n = head[1] & 0x7F
+    if n == 126:
+        n = struct.unpack('!H', rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', rfile.read(8))[0]
+    mask = rfile.read(4) if head[1] & 0x80 else b'\0\0\0\0'
+    data = rfile.read(n)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+def _readable(rfile, sock):
+    """True when a client frame can be read without waiting for the socket.
+
+    `rfile` buffers what the socket delivered, frames sent together can wait
+    there while `select` on the socket sees nothing new.
+    """
+    sock.setblocking(False)
+    try:
+        # Only returns what is buffered or already arrived
+        buffered = rfile.peek(1)
+    except OSError:
+        buffered = b''
+    finally:
+        sock.setblocking(True)
+    return bool(buffered) or bool(select.select([sock], [], [], 0)[0])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'L2-easy'
+    # WebSocket clients require an HTTP/1.1 upgrade response
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug('Status server: ' + format % args)
+
+    def _send_json(self, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        status = self.server.status
+        path = self.path.split('?', 1)[0]
+        if path == '/state':
+            self._send_json(status.state)
+        elif path == '/metrics':
+            self._send_json(metrics.snapshot())
+        elif path == '/ws' and self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._serve_websocket(status)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        status = self.server.status
+        path = self.path.split('?', 1)[0]
+        if path == '/debug/dump' and status.recorder is not None:
+            self._send_json({'ticks': status.recorder.dump()})
+        else:
+            self.send_error(404)
+
+    def _serve_websocket(self, status):
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+
+        client = status.add_client()
+        try:
+            self.wfile.write(_encode_frame(json.dumps({'type': 'snapshot', 'state': status.state}).encode()))
+            while not status.stopped.is_set():
+                while _readable(self.rfile, self.connection):
+                    opcode, data = _read_frame(self.rfile)
+                    if opcode == _OP_CLOSE:
+                        self.wfile.write(_encode_frame(b'', _OP_CLOSE))
+                        return
+                    if opcode == _OP_PING:
+                        self.wfile.write(_encode_frame(data, _OP_PONG))
+                try:
+                    message = client.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self.wfile.write(_encode_frame(message))
+        except (OSError, ValueError):
+            pass
+        finally:
+            status.remove_client(client)
+
+
+class StatusServer:
+    def __init__(self, host='127.0.0.1', port=8765):
+        """HTTP/WebSocket server for the live state.
+
+        Args
+        :host: Interface to bind. Keep 127.0.0.1 unless dashboards run elsewhere.
+        :port: TCP port
+
+        Attributes
+        :state: Latest JSON-serializable state
+        :recorder: DebugRecorder dumped by POST /debug/dump, if set
+        """
+        self.state = {}
+        self.recorder = None
+        self.flat_state = {}
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.status = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='status-server', daemon=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a server from the `status_server` config section, or None if disabled."""
+        options = config.get('status_server') or {}
+        if not options.get('enabled', False):
+            return None
+        return cls(options.get('host', '127.0.0.1'), options.get('port', 8765))
+
+    def start(self):
+        self.thread.start()
+        host, port = self.httpd.server_address[:2]
+        logger.info(f'Status server listening on http://{host}:{port}')
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def add_client(self):
+        client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        with self.clients_lock:
+            self.clients.add(client)
+        return client
+
+    def remove_client(self, client):
+        with self.clients_lock:
+            self.clients.discard(client)
+
+    def publish(self, state):
+        """Replace the state and push the delta to WebSocket clients."""
+        flat = flatten(state)
+        changed, removed = diff(self.flat_state, flat)
+        self.state = state
+        self.flat_state = flat
+        if not changed and not removed:
+            return
+        message = json.dumps({'type': 'delta', 'changed': changed, 'removed': removed}).encode()
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # Too far behind, replace the backlog by a full snapshot
+                _drain(client)
+                client.put_nowait(json.dumps({'type': 'snapshot', 'state': state}).encode())
+
+
+def _drain(q):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
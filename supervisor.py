@@ -0,0 +1,409 @@
+"""L2-easy supervisor
+
+Runs one OCR worker process per instrument instead of one GUI instance per
+ladder. A capture process grabs only the screen region around the RoIs of
+each instrument and writes the raw pixels into a shared-memory frame ring
+(see `frame_ring`). Each worker OCRs views of its frames and writes its
+results into a shared-memory result ring (see `shm_ring`). A single aggregator
+in the supervisor reads all rings and sends ticks to stdout, a file, a
+ZeroMQ socket and the status server. Workers that crash or stop beating are
+restarted with a backoff.
+
+Instruments are listed in config.yaml:
+
+    instruments:
+    - name: ES
+      screen_id: 1
+      rois:
+        left: [85, 326, 131, 413]
+        right: [200, 323, 261, 410]
+    - name: NQ
+      ...
+
+Without `instruments`, the top-level `rois` and `screen_id` are used.
+
+Usage
+    python supervisor.py --output -
+    python supervisor.py --output tcp://0.0.0.0:5556 --pin-cpus
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+
+from aggregator import Aggregator, tick_record
+from alerts import AlertDispatcher
+from capture_utils import bounding_box
+from config_utils import load_config
+from frame_ring import FrameRing
+from log_utils import setup_logging, tick_logger
+from metrics import metrics
+from shm_ring import ResultRing, record_rows
+
+logger = logging.getLogger('root')
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(processName)s %(funcName)s(%(lineno)d) %(message)s'
+
+# Restart backoff of a worker, doubled after every crash up to the maximum
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+# A worker that ran this long is considered healthy again
+STABLE_AFTER = 60
+# Seconds a worker waits before looking for a new frame again
+FRAME_POLL = 0.005
+
+
+def _setup_process(config, cpu=None):
+    # One thread per process, the supervisor scales with processes. Set before
+    # Tesseract is spawned, it inherits the environment.
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+    level = logging.DEBUG if config.get('debug', False) else logging.INFO
+    setup_logging(level, stream=sys.stderr, fmt=LOG_FORMAT)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def capture_main(regions, config, stop_flag):
+    """Entry point of the capture process.
+
+    Grabs the region of every instrument once per interval and writes the raw
+    BGRA pixels into the instrument's frame ring.
+
+    Args
+    :regions: {name: (screen_id, (x1, y1, x2, y2), frame ring name)}
+    :config: App config
+    :stop_flag: Shared value set to 1 by the supervisor on shutdown
+    """
+    _setup_process(config)
+    from capture_utils import ScreenSource
+
+    rings = {name: FrameRing(ring) for name, (_, _, ring) in regions.items()}
+    sources = {name: ScreenSource(screen_id, region) for name, (screen_id, region, _) in regions.items()}
+    interval = config['interval']
+    next_time = time.monotonic()
+    try:
+        while not stop_flag.value:
+            for name, source in sources.items():
+                timestamp = time.time()
+                rings[name].write(source.grab(), timestamp)
+
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()
+    finally:
+        for source in sources.values():
+            source.close()
+        for ring in rings.values():
+            ring.close()
+
+
+def worker_main(name, instrument, config, frame_ring_name, result_ring_name, stop_flag, cpu=None):
+    """Entry point of an OCR worker process.
+
+    Reads the newest frame of its instrument from shared memory, extracts
+    both columns and writes the sums into its result ring.
+
+    Args
+    :name: Instrument name
+    :instrument: Instrument config with `rois` and `screen_id`
+    :config: App config
+    :frame_ring_name: Shared memory name of the frame ring
+    :result_ring_name: Shared memory name of the result ring
+    :stop_flag: Shared value set to 1 by the supervisor on shutdown
+    :cpu: Core to pin the process to, if supported
+    """
+    _setup_process(config, cpu)
+    import cv2
+    cv2.setNumThreads(1)
+    from aggregator import column_values
+    from capture_utils import bounding_box, offset_rois
+    from color_key import ColorKeyStore
+    from consensus import Consensus
+    from dnn_ocr import DigitRecognizer
+    from ladder_layout import LayoutStore
+    from ocr_presets import roi_presets
+    from ocr_utils import extract_rois, set_ocr_timeout
+
+    set_ocr_timeout(config.get('ocr_timeout', 2))
+    frames = FrameRing(frame_ring_name)
+    ring = ResultRing(result_ring_name)
+    ring.beat(os.getpid())
+    rois = {'bid': instrument['rois']['left'], 'ask': instrument['rois']['right']}
+    rois = offset_rois(rois, bounding_box(rois)[:2])
+    conf_thresh = instrument.get('conf_thresh', config.get('conf_thresh', 80))
+    consensus = Consensus.from_config(config)
+    presets = roi_presets(instrument if 'ocr_preset' in instrument else config)
+    layouts = LayoutStore.from_config(config, name)
+    keys = ColorKeyStore.from_config(config, name)
+    engine = DigitRecognizer.from_config(config)
+    logger.info(f'Worker {name} started')
+
+    sums = {'bid': 0, 'ask': 0}
+    rows = {'bid': [], 'ask': []}
+    last = -1
+    item = frame = None
+    try:
+        while not stop_flag.value:
+            ring.beat()
+            item = frames.latest(last)
+            if item is None:
+                time.sleep(FRAME_POLL)
+                continue
+            last, timestamp, frame = item
+            results = extract_rois(frame, rois, conf_thresh, None, consensus, presets, layouts, engine, keys)
+            if not frames.still_valid(last):
+                logger.warning('Frame %d was overwritten during OCR, dropped', last)
+                continue
+            for col_name, rs in results.items():
+                sums[col_name], rows[col_name] = column_values(rs)
+            ring.write(timestamp, sums['bid'], sums['ask'], rows['bid'], rows['ask'])
+    finally:
+        # Views into the segment must be gone before it is closed
+        item = frame = None
+        frames.close()
+        ring.close()
+
+
+class ProcessHandle:
+    def __init__(self, name, target, args, heartbeat):
+        """A child process owned by the supervisor, restarted when it dies.
+
+        Args
+        :name: Process name
+        :target: Entry point
+        :args: Entry point arguments
+        :heartbeat: Ring whose `heartbeat` property the process keeps fresh
+        """
+        self.name = name
+        self.target = target
+        self.args = args
+        self.heartbeat = heartbeat
+        self.process = None
+        self.started_at = 0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = 0
+        self.restarts = 0
+
+
+def shm_name(kind, instrument_name):
+    return f'l2easy_{os.getpid()}_{kind}_{instrument_name}'
+
+
+def load_instruments(config):
+    """Return [(name, instrument config)] from config, see module doc."""
+    instruments = config.get('instruments')
+    if not instruments:
+        name = (config.get('publisher') or {}).get('instrument', 'default')
+        instruments = [{'name': name, 'screen_id': config['screen_id'], 'rois': config['rois']}]
+    return [(instrument['name'], instrument) for instrument in instruments]
+
+
+class Supervisor:
+    def __init__(self, config, stall_timeout=30, pin_cpus=False):
+        """Start, watch and restart the capture process and one worker process per instrument.
+
+        Args
+        :config: App config
+        :stall_timeout: Restart a process that did not beat for this many seconds
+        :pin_cpus: Pin each worker to its own core
+        """
+        self.config = config
+        self.stall_timeout = stall_timeout
+        self.ctx = multiprocessing.get_context('spawn')
+        # A plain shared byte rather than an Event: Event.set() blocks forever
+        # once a waiting process was killed, which is how stalls are handled.
+        self.stop_flag = self.ctx.RawValue('b', 0)
+        n_cpus = os.cpu_count() or 1
+
+        self.frame_rings = {}
+        self.result_rings = {}
+        self.processes = []
+        regions = {}
+        for i, (name, instrument) in enumerate(load_instruments(config)):
+            rois = {'bid': instrument['rois']['left'], 'ask': instrument['rois']['right']}
+            x1, y1, x2, y2 = region = bounding_box(rois)
+            frames = FrameRing(shm_name('frames', name), (y2 - y1, x2 - x1), create=True)
+            results = ResultRing(shm_name('results', name), create=True)
+            self.frame_rings[name] = frames
+            self.result_rings[name] = results
+            regions[name] = (instrument.get('screen_id', config['screen_id']), region, frames.name)
+            cpu = i % n_cpus if pin_cpus else None
+            self.processes.append(ProcessHandle(
+                f'worker-{name}', worker_main,
+                (name, instrument, config, frames.name, results.name, self.stop_flag, cpu),
+                results,
+            ))
+        if self.frame_rings:
+            self.processes.append(ProcessHandle(
+                'capture', capture_main, (regions, config, self.stop_flag),
+                next(iter(self.frame_rings.values())),
+            ))
+
+    @property
+    def instruments(self):
+        return list(self.result_rings)
+
+    def _start(self, handle):
+        handle.heartbeat.header['heartbeat'] = time.time()
+        handle.process = self.ctx.Process(target=handle.target, name=handle.name, args=handle.args, daemon=True)
+        handle.process.start()
+        handle.started_at = time.time()
+        logger.info(f'Started {handle.name} (pid {handle.process.pid})')
+
+    def start(self):
+        for handle in self.processes:
+            self._start(handle)
+
+    def check(self):
+        """Restart processes that exited or stopped beating. Call periodically."""
+        now = time.time()
+        for handle in self.processes:
+            process = handle.process
+            if process is None:
+                if now >= handle.restart_at:
+                    handle.restarts += 1
+                    self._start(handle)
+                continue
+
+            if process.is_alive():
+                if now - handle.heartbeat.heartbeat < self.stall_timeout:
+                    if now - handle.started_at > STABLE_AFTER:
+                        handle.restart_delay = RESTART_DELAY
+                    continue
+                logger.error(f'{handle.name} stalled for {now - handle.heartbeat.heartbeat:.1f}s, restarting')
+                process.kill()
+            else:
+                logger.error(f'{handle.name} exited with code {process.exitcode}, restarting')
+            process.join(1)
+            handle.process = None
+            handle.restart_at = now + handle.restart_delay
+            handle.restart_delay = min(handle.restart_delay * 2, MAX_RESTART_DELAY)
+
+    def is_running(self, name):
+        """Whether the worker process of an instrument is up, False while it waits to restart."""
+        return any(handle.name == f'worker-{name}' and handle.process is not None for handle in self.processes)
+
+    def latest(self):
+        """Return {name: record} with the newest record of every worker that produced one."""
+        results = {}
+        for name, ring in self.result_rings.items():
+            record = ring.latest()
+            if record is not None:
+                results[name] = record
+        return results
+
+    def stop(self):
+        self.stop_flag.value = 1
+        for handle in self.processes:
+            if handle.process is not None:
+                handle.process.join(5)
+                if handle.process.is_alive():
+                    handle.process.kill()
+        for ring in list(self.frame_rings.values()) + list(self.result_rings.values()):
+            ring.close()
+
+
+def run(supervisor, sink, interval, stop_event, status=None, alerts=None):
+    """Aggregate the newest result of every instrument once per interval.
+
+    An instrument without a new result since the last interval (its worker
+    is slow, stalled, dead or waiting to restart) is not aggregated, so old
+    sums are not published or alarmed on again. After `stall_timeout`
+    seconds without one it is flagged 'stalled' in the status state.
+
+    Alarms go to `alerts`, an AlertDispatcher, or are only logged if None.
+    """
+    aggregators = {name: Aggregator(supervisor.config) for name in supervisor.instruments}
+    # Timestamp of the last record aggregated and when it was, per instrument
+    used = {name: None for name in supervisor.instruments}
+    used_at = {name: time.monotonic() for name in supervisor.instruments}
+    state = {}
+    next_time = time.monotonic()
+    while not stop_event.is_set():
+        supervisor.check()
+        records = supervisor.latest()
+        stall_timeout = supervisor.config.get('stall_timeout', 10)
+
+        for name, aggregator in aggregators.items():
+            record = records.get(name)
+            if record is None or float(record['timestamp']) == used[name]:
+                if name in state:
+                    stalled = time.monotonic() - used_at[name] >= stall_timeout
+                    if stalled and not state[name]['worker']['stalled']:
+                        metrics.incr('ocr_stalls')
+                        logger.error(f'No new result of {name} for {stall_timeout}s, values are stale')
+                    state[name]['worker'] = {'running': supervisor.is_running(name), 'stalled': stalled}
+                continue
+            used[name] = float(record['timestamp'])
+            used_at[name] = time.monotonic()
+            sums, rows = record_rows(record)
+            tick = aggregator.update(sums['bid'], sums['ask'])
+            if alerts is not None:
+                alerts.submit_tick(tick, aggregator.periods, name)
+            else:
+                for slot, side, value in tick['alarms']:
+                    logger.warning('Alarm on %s slot %s %s: %s', name, slot, side, value)
+            sink.write(tick, sums, rows, name)
+            state[name] = tick_record(tick, sums, rows, name)
+            if tick_logger.isEnabledFor(logging.INFO):
+                tick_logger.info(state[name])
+            state[name]['worker'] = {'running': True, 'stalled': False}
+        if status is not None:
+            status.publish(dict(state))
+
+        next_time += interval
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            stop_event.wait(delay)
+        else:
+            next_time = time.monotonic()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run one OCR worker process per instrument.')
+    parser.add_argument('--config', default='config.yaml', help='Config file')
+    parser.add_argument('--output', default='-', help="'-' for stdout, a file path, or a tcp:// address")
+    parser.add_argument('--stall-timeout', type=float, default=30, help='Restart a worker silent for this many seconds')
+    parser.add_argument('--pin-cpus', action='store_true', help='Pin each worker to its own core')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    level = logging.DEBUG if config['debug'] else logging.INFO
+    setup_logging(level, stream=sys.stderr, tick_log=config.get('tick_log'), fmt=LOG_FORMAT)
+
+    from daemon import open_sink
+    from status_server import StatusServer
+    publisher_config = config.get('publisher') or {}
+    sink = open_sink(args.output, publisher_config.get('instrument', 'default'), publisher_config.get('sndhwm', 100))
+    status = StatusServer.from_config(config)
+    if status is not None:
+        status.start()
+    alerts = AlertDispatcher.from_config(config, exclude=('sound',))
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    supervisor = Supervisor(config, args.stall_timeout, args.pin_cpus)
+    supervisor.start()
+    logger.info(f'Supervisor started {len(supervisor.instruments)} workers')
+    try:
+        run(supervisor, sink, config['interval'], stop_event, status, alerts)
+    finally:
+        supervisor.stop()
+        sink.close()
+        alerts.close()
+        if status is not None:
+            status.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Alarm threshold sweep
+
+Evaluates many time periods and ratio thresholds at once over a recorded tick
+history (the `tick_log` of config.yaml, or the ticks of replay.py), to tune
+`time_periods`, `alarm_threshold_bid` and `alarm_threshold_ask` offline.
+
+Usage
+    python sweep_alarms.py --ticks ticks.jsonl
+    python sweep_alarms.py --ticks ticks.jsonl.1 ticks.jsonl --periods 10 30 60 300 --thresholds 1.1 5 0.05
+    python sweep_alarms.py --ticks ticks.jsonl --events moves.txt --horizon 600 --json sweep.json
+
+The window sums of every period come from one prefix sum of the bid and ask
+series and the ratios are computed as `Aggregator` does, on the ticks where
+the period refreshes. The tick count restarts with each session of the log,
+split where no tick was logged for `--session-gap` seconds.
+
+For every side, period and threshold it reports
+
+- fires: number of refreshes at or above the threshold, as the alarms the
+  live app would have raised before the alert rate limits
+- hits: share of reference events preceded by a fire within `--horizon`
+  seconds, and lead: the median time from the first of those fires to the
+  event. Events are epoch times, one per line, in the `--events` file, or
+  by default the onsets of the newest value alarm of the same side with
+  the threshold of config.yaml.
+- overlap: for the best ranked combinations, the share of `--bucket` second
+  buckets with a fire that two combinations have in common (Jaccard)
+
+The history is parsed once into a .npz file next to each tick log.
+"""
+import os
+import sys
+import json
+import argparse
+import warnings
+
+import numpy as np
+
+from config_utils import load_config
+
+SIDES = ('bid', 'ask')
+
+
+def _parse_log(path, instrument=None):
+    timestamps, bid, ask = [], [], []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if instrument is not None and record.get('instrument') != instrument:
+                continue
+            timestamps.append(record['timestamp'])
+            bid.append(record['sums']['bid'])
+            ask.append(record['sums']['ask'])
+    return np.array(timestamps, np.float64), np.array(bid, np.float64), np.array(ask, np.float64)
+
+
+def load_ticks(paths, instrument=None):
+    """Return (timestamps, bid, ask) arrays of tick logs, in time order.
+
+    A parsed log is kept in `<path>.<instrument>.npz` and used while it is
+    newer than the log.
+    """
+    parts = []
+    for path in paths:
+        cache = f'{path}.{instrument or "all"}.npz'
+        if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+            with np.load(cache) as data:
+                parts.append((data['timestamps'], data['bid'], data['ask']))
+            continue
+        timestamps, bid, ask = _parse_log(path, instrument)
+        try:
+            np.savez(cache, timestamps=timestamps, bid=bid, ask=ask)
+        except OSError:
+            pass
+        parts.append((timestamps, bid, ask))
+    timestamps, bid, ask = (np.concatenate(arrays) for arrays in zip(*parts))
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], bid[order], ask[order]
+
+
+def sessions(timestamps, session_gap=60):
+    """[(start, stop)] index ranges of the runs of the app in a tick history."""
+    breaks = np.flatnonzero(np.diff(timestamps) > session_gap) + 1
+    bounds = np.concatenate(([0], breaks, [len(timestamps)]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def window_ratios(timestamps, bid, ask, period, bounds):
+    """Ratios of one period on every tick that refreshes it.
+
+    Returns (times, {'bid': ratios, 'ask': ratios}), NaN where a window sum
+    is 0, like `Aggregator._ratio`.
+    """
+    bid_sums = np.concatenate(([0.0], np.cumsum(bid)))
+    ask_sums = np.concatenate(([0.0], np.cumsum(ask)))
+    # Ticks where the step count of a session is a multiple of the period
+    ends = np.concatenate([np.arange(start + period, stop + 1, period) for start, stop in bounds]
+                          or [np.empty(0, np.int64)])
+    acc_bid = bid_sums[ends] - bid_sums[ends - period]
+    acc_ask = ask_sums[ends] - ask_sums[ends - period]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bid_ratio = np.where(acc_bid > acc_ask, np.round(acc_bid / acc_ask, 2), 1.0)
+        ask_ratio = np.where(acc_ask > acc_bid, np.round(acc_ask / acc_bid, 2), 1.0)
+    empty = (acc_bid == 0) | (acc_ask == 0)
+    bid_ratio[empty] = np.nan
+    ask_ratio[empty] = np.nan
+    return timestamps[ends - 1], {'bid': bid_ratio, 'ask': ask_ratio}
+
+
+def onsets(timestamps, values, threshold, bounds):
+    """Times where `values` reach `threshold` after a tick under it, or the start of a session."""
+    above = values >= threshold
+    starts = above.copy()
+    starts[1:] &= ~above[:-1]
+    starts[[start for start, _ in bounds]] = above[[start for start, _ in bounds]]
+    return timestamps[starts]
+
+
+def fire_counts(ratios, thresholds):
+    """Number of ratios at or above each threshold."""
+    ratios = np.sort(ratios[~np.isnan(ratios)])
+    return len(ratios) - np.searchsorted(ratios, thresholds, 'left')
+
+
+def lead_times(times, ratios, thresholds, events, horizon):
+    """Lead time of each threshold before each event.
+
+    Returns a (thresholds, events) array of the seconds from the first fire
+    within `horizon` before the event to the event, NaN without one.
+    """
+    leads = np.full((len(thresholds), len(events)), np.nan)
+    ratios = np.where(np.isnan(ratios), -np.inf, ratios)
+    lows = np.searchsorted(times, events - horizon, 'left')
+    highs = np.searchsorted(times, events, 'right')
+    for j, (event, low, high) in enumerate(zip(events, lows, highs)):
+        if low == high:
+            continue
+        # The first fire of a threshold is where the running max reaches it
+        running = np.maximum.accumulate(ratios[low:high])
+        first = np.searchsorted(running, thresholds, 'left')
+        hit = first < high - low
+        leads[hit, j] = event - times[low + first[hit]]
+    return leads
+
+
+def overlap(fire_times, bucket, origin):
+    """Jaccard index of the fire buckets of each pair of combinations."""
+    buckets = [np.unique(((times - origin) // bucket).astype(np.int64)) for times in fire_times]
+    n_buckets = max((int(b[-1]) + 1 for b in buckets if len(b)), default=0)
+    fired = np.zeros((len(buckets), n_buckets), np.float32)
+    for i, b in enumerate(buckets):
+        fired[i, b] = 1
+    common = fired @ fired.T
+    sizes = np.diag(common)
+    union = sizes[:, None] + sizes[None, :] - common
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, common / union, 0.0)
+
+
+def sweep(timestamps, bid, ask, periods, thresholds, events, horizon=300, session_gap=60):
+    """Evaluate every side, period and threshold.
+
+    Args
+    :events: {side: event times}
+
+    Returns [dict(side, period, threshold, fires, fires_per_day, hits, lead)]
+    and {(side, period): (times, ratios)} for the fire times.
+    """
+    bounds = sessions(timestamps, session_gap)
+    days = max(timestamps[-1] - timestamps[0], 1) / 86400
+    rows = []
+    series = {}
+    for period in periods:
+        times, ratios = window_ratios(timestamps, bid, ask, period, bounds)
+        for side in SIDES:
+            series[side, period] = (times, ratios[side])
+            counts = fire_counts(ratios[side], thresholds)
+            leads = lead_times(times, ratios[side], thresholds, events[side], horizon)
+            hit = ~np.isnan(leads)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                median = np.nanmedian(leads, axis=1) if len(events[side]) else np.full(len(thresholds), np.nan)
+            for k, threshold in enumerate(thresholds):
+                rows.append({
+                    'side': side,
+                    'period': int(period),
+                    'threshold': float(threshold),
+                    'fires': int(counts[k]),
+                    'fires_per_day': float(counts[k] / days),
+                    'hits': float(hit[k].mean()) if len(events[side]) else None,
+                    'lead': None if np.isnan(median[k]) else float(median[k]),
+                })
+    return rows, series
+
+
+def rank(rows):
+    """Best first: most events caught, then the fewest fires, then the longest lead."""
+    return sorted((row for row in rows if row['fires']),
+                  key=lambda row: (-(row['hits'] or 0), row['fires'], -(row['lead'] or 0)))
+
+
+def read_events(path):
+    with open(path) as f:
+        return np.array(sorted(float(line) for line in f if line.strip()), np.float64)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep the alarm periods and thresholds over a tick history.')
+    parser.add_argument('--ticks', nargs='+', required=True, help='Tick logs (JSON lines), oldest first')
+    parser.add_argument('--config', default='config.yaml', help='Config file with the current alarms')
+    parser.add_argument('--instrument', default=None, help='Only the ticks of this instrument')
+    parser.add_argument('--periods', type=int, nargs='+', default=None, help='Periods in ticks, default from config')
+    parser.add_argument('--thresholds', type=float, nargs=3, default=(1.1, 5.0, 0.05),
+                        metavar=('FIRST', 'LAST', 'STEP'), help='Ratio thresholds to try')
+    parser.add_argument('--events', default=None, help='File of reference event times, one per line')
+    parser.add_argument('--horizon', type=float, default=300, help='Seconds before an event a fire counts')
+    parser.add_argument('--session-gap', type=float, default=60, help='Seconds without ticks that start a session')
+    parser.add_argument('--bucket', type=float, default=60, help='Seconds of the overlap buckets')
+    parser.add_argument('--top', type=int, default=20, help='Combinations printed and compared for overlap')
+    parser.add_argument('--json', default=None, help='Also write every combination to this file')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    timestamps, bid, ask = load_ticks(args.ticks, args.instrument)
+    if not len(timestamps):
+        sys.exit('No tick in the history')
+    periods = args.periods or [int(x) for x in config['time_periods']]
+    first, last, step = args.thresholds
+    thresholds = np.round(np.arange(first, last + step / 2, step), 2)
+    if args.events:
+        events = dict.fromkeys(SIDES, read_events(args.events))
+    else:
+        bounds = sessions(timestamps, args.session_gap)
+        events = {'bid': onsets(timestamps, bid, config['alarm_threshold_bid'][0], bounds),
+                  'ask': onsets(timestamps, ask, config['alarm_threshold_ask'][0], bounds)}
+
+    rows, series = sweep(timestamps, bid, ask, periods, thresholds, events, args.horizon, args.session_gap)
+    best = rank(rows)[:args.top]
+    print(f'{len(timestamps)} ticks, {len(rows)} combinations, '
+          f'{len(events["bid"])} bid and {len(events["ask"])} ask reference events')
+    print(f'{"#":>3} {"side":<5}{"period":>7}{"threshold":>10}{"fires":>8}{"per day":>9}{"hits %":>8}{"lead s":>8}')
+    for i, row in enumerate(best):
+        hits = '-' if row['hits'] is None else f'{row["hits"] * 100:.0f}'
+        lead = '-' if row['lead'] is None else f'{row["lead"]:.0f}'
+        print(f'{i:>3} {row["side"]:<5}{row["period"]:>7}{row["threshold"]:>10.2f}{row["fires"]:>8}'
+              f'{row["fires_per_day"]:>9.1f}{hits:>8}{lead:>8}')
+
+    fire_times = []
+    for row in best:
+        times, ratios = series[row['side'], row['period']]
+        fire_times.append(times[ratios >= row['threshold']])
+    matrix = overlap(fire_times, args.bucket, timestamps[0]) if best else np.empty((0, 0))
+    if len(best) > 1:
+        print(f'\nOverlap of the fires in {args.bucket:.0f} s buckets (%)')
+        print('    ' + ''.join(f'{i:>4}' for i in range(len(best))))
+        for i, line in enumerate(matrix):
+            print(f'{i:>3} ' + ''.join(f'{value * 100:>4.0f}' for value in line))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'combinations': rows, 'top': best, 'overlap': matrix.round(3).tolist()}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import math
+
+import numpy as np
+
+from aggregator import Aggregator
+
+
+def make_config(periods=(2, 4)):
+    n_slots = len(periods) + 1
+    return {
+        'time_periods': list(periods),
+        'interval': 1,
+        'alarm_active': [True] * n_slots,
+        'alarm_threshold_bid': [100] + [2.0] * len(periods),
+        'alarm_threshold_ask': [100] + [2.0] * len(periods),
+    }
+
+
+def test_ratios_refresh_on_their_period():
+    aggregator = Aggregator(make_config())
+    sums = [(30, 10), (10, 10), (5, 10), (5, 10)]
+    ticks = [aggregator.update(bid, ask, timestamp=k) for k, (bid, ask) in enumerate(sums)]
+    assert [tick['refreshed'] for tick in ticks] == [[], [2], [], [2, 4]]
+    assert ticks[1]['ratios'][2] == (2.0, 1.0)
+    assert ticks[3]['ratios'][2] == (1.0, 2.0)
+    assert ticks[3]['ratios'][4] == (1.25, 1.0)
+    # Slot 1 is the first period
+    assert ticks[3]['alarms'] == [(1, 'ask', 2.0)]
+
+
+def test_empty_window_has_no_ratio():
+    aggregator = Aggregator(make_config())
+    aggregator.update(0, 10)
+    tick = aggregator.update(0, 10)
+    assert all(math.isnan(ratio) for ratio in tick['ratios'][2])
+    assert tick['alarms'] == []
+
+
+def test_set_periods_keeps_windows_and_fills_new_ones():
+    aggregator = Aggregator(make_config((2, 4)))
+    for bid, ask in [(1, 1), (2, 1), (3, 1), (4, 1)]:
+        aggregator.update(bid, ask)
+    kept = aggregator.history[2]
+    assert aggregator.set_periods([2, 3, 6]) == [2, 3, 6]
+    assert aggregator.history[2] is kept
+    # The last samples of the longest window, the 4 tick one
+    assert list(aggregator.history[3]['bid']) == [2, 3, 4]
+    assert aggregator.ratios[3] == (3.0, 1.0)
+    # Zeros where the longest window is too short
+    assert list(aggregator.history[6]['bid']) == [0, 0, 1, 2, 3, 4]
+    assert 4 not in aggregator.history and 4 not in aggregator.ratios
+
+
+def test_set_periods_before_the_first_tick():
+    aggregator = Aggregator(make_config((2,)))
+    aggregator.set_periods([5])
+    assert all(math.isnan(ratio) for ratio in aggregator.ratios[5])
+    assert np.array_equal(aggregator.history[5]['ask'], [0] * 5)
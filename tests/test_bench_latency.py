@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import bench_latency
+from config_utils import load_config
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.yaml')
+
+
+def test_late_read_adds_the_intervals_waited(monkeypatch):
+    versions = [([1] * bench_latency.N_ROWS, [2] * bench_latency.N_ROWS)] * 2
+    hold = 3
+
+    def fake_run(config, source, sink, interval, alerts=None, trace=None):
+        # Every tick takes 10 ms, the second version is only read on its third tick
+        clock = [0.0]
+        monkeypatch.setattr(bench_latency.time, 'perf_counter', lambda: clock[0])
+        for k in range(len(versions) * hold):
+            source.grab()
+            trace('captured')
+            clock[0] += 0.01
+            trace('parsed')
+            trace('aggregated')
+            sink.write(None, {'bid': 12 if k in (0, 5) else 0, 'ask': 24}, {})
+        return len(versions) * hold
+
+    monkeypatch.setattr(bench_latency, 'run', fake_run)
+    monkeypatch.setattr(bench_latency, 'render', lambda version: None)
+    latencies, misses = bench_latency.measure({'time_periods': [10]}, versions, hold, 2, 0, 0, gui=False)
+    assert misses == 0
+    waits = latencies['capture_wait']
+    assert abs(latencies['parsed'][0] - (waits[0] + 0.01)) < 1e-9
+    assert abs(latencies['parsed'][1] - (waits[1] + 2 * 2 + 0.01)) < 1e-9
+    # Without the main window, shown follows the aggregation
+    assert latencies['shown'][1] > latencies['aggregated'][1] and not latencies['gui_update']
+
+
+def test_main_window_probe_shows_the_sums(tmp_path, monkeypatch):
+    pytest.importorskip('PyQt5.QtWidgets')
+    monkeypatch.setenv('QT_QPA_PLATFORM', 'offscreen')
+    config = bench_latency.bench_config(load_config(CONFIG_FILE), str(tmp_path))
+    probe = bench_latency.MainWindowProbe(config)
+    try:
+        assert probe.update({'bid': 120.0, 'ask': 40.0}) > 0
+        assert probe.window.texts[0].split() == ['120.00', '40.00']
+    finally:
+        probe.close()
@@ -0,0 +1,46 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+import bench_ocr
+from color_key import ColorKeyStore
+from ocr_records import empty_cells
+
+
+def test_calibration_config_copies_the_app_file(tmp_path):
+    app_file = tmp_path / 'ladder_layout.json'
+    app_file.write_text(json.dumps({'bid': 'app'}))
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+    config = {'ladder_layout': {'enabled': True, 'file': str(app_file), 'psm': 7}}
+    local = bench_ocr.calibration_config(config, str(work_dir))
+    assert local['ladder_layout']['file'] == os.path.join(str(work_dir), 'ladder_layout.json')
+    assert json.load(open(local['ladder_layout']['file'])) == {'bid': 'app'}
+    assert config['ladder_layout']['file'] == str(app_file)
+
+
+def test_run_preset_reads_with_the_layout_and_a_copy_of_the_keys(monkeypatch):
+    class Layouts:
+        def get(self, col_name, image):
+            return f'layout of {col_name}'
+
+    seen = []
+    monkeypatch.setattr(bench_ocr, 'extract_data',
+                        lambda crop, conf_thresh, col_name, cache=None, preset=None, layout=None, keys=None:
+                        seen.append((layout, keys)) or empty_cells())
+    crops = [('0.png', {'bid': np.zeros((4, 4, 3), np.uint8)})]
+    keys = {'bid': 'key'}
+    bench_ocr.run_preset(crops, {}, layouts=Layouts(), keys=keys)
+    assert seen == [('layout of bid', keys)] and seen[0][1] is not keys
+
+
+
+def test_color_key_is_learned_before_timing(tmp_path):
+    crop = np.full((40, 60, 3), 255, np.uint8)
+    cv2.putText(crop, '123', (4, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 200), 1, cv2.LINE_AA)
+    keys = ColorKeyStore(str(tmp_path / 'color_key.json'))
+    bench_ocr.calibrate([('blank.png', {'bid': np.full((40, 60, 3), 255, np.uint8)}), ('0.png', {'bid': crop})],
+                        keys=keys)
+    assert list(keys.keys) == ['bid']
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+import pytest
+
+from color_key import ColorKey, color_index
+
+GREEN = (0, 150, 0)
+RED = (0, 0, 200)
+
+
+def ladder(colors):
+    # Anti-aliased rows of prices on white, one color per row in turn
+    image = np.full((120, 80, 3), 255, np.uint8)
+    for k in range(6):
+        cv2.putText(image, f'{k * 37 + 5}', (4, 16 + k * 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, colors[k % len(colors)],
+                    1, cv2.LINE_AA)
+    return image
+
+
+def test_two_color_crop_round_trips():
+    image = ladder([GREEN, RED])
+    key = ColorKey.calibrate(image)
+    assert len(key.text) == 2
+    assert not (~key.known[color_index(image)]).any()
+    result = key.apply(image, 2)
+    assert result is not None
+    gray, binary = result
+    assert binary.shape == (240, 160)
+    # Ink on both kinds of rows
+    assert (binary[:40] == 0).any() and (binary[40:80] == 0).any()
+
+
+def test_stored_key_gives_the_same_table():
+    key = ColorKey.calibrate(ladder([GREEN, RED]))
+    again = ColorKey.from_dict(key.to_dict())
+    assert np.array_equal(again.lut, key.lut) and np.array_equal(again.known, key.known)
+
+
+def test_crop_without_text_is_not_calibrated():
+    with pytest.raises(ValueError):
+        ColorKey.calibrate(np.full((20, 20, 3), 255, np.uint8))
@@ -0,0 +1,223 @@
+import os
+import copy
+
+import pytest
+import yaml
+
+import daemon
+from config_service import ConfigService, config_changes
+from ocr_records import empty_cells
+
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.yaml')
+
+
+def load_default():
+    with open(CONFIG_FILE) as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+class WatchedDict(dict):
+    # Records the number of keys after every removal
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.sizes = []
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.sizes.append(len(self))
+
+    def clear(self):
+        super().clear()
+        self.sizes.append(0)
+
+
+def test_apply_swaps_values_in_place(tmp_path):
+    config = WatchedDict(load_default())
+    config['stale'] = 1
+    service = ConfigService(config, str(tmp_path / 'config.yaml'))
+    new = copy.deepcopy(dict(config))
+    del new['stale']
+    new['conf_thresh'] = 70
+    new['rois']['left'] = [1, 2, 3, 4]
+    assert service.apply(new) == ['conf_thresh', 'rois', 'stale']
+    assert config['conf_thresh'] == 70 and 'stale' not in config
+    # Never empty while the values are swapped
+    assert 0 not in config.sizes
+    # The live dict does not share objects with the caller's
+    new['rois']['left'][0] = 9
+    assert config['rois']['left'] == [1, 2, 3, 4]
+
+
+def test_invalid_config_is_ignored():
+    config = load_default()
+    service = ConfigService(config, 'missing.yaml')
+    assert service.apply(dict(config, interval=0)) is None
+    assert config_changes(config, load_default()) == []
+
+
+class FakeSource:
+    def __init__(self, n_frames):
+        self.n_frames = n_frames
+        self.screens = []
+
+    def grab(self):
+        if not self.n_frames:
+            return None
+        self.n_frames -= 1
+        return object()
+
+    def set_screen(self, screen_id):
+        self.screens.append(screen_id)
+
+
+class FakeService:
+    def __init__(self, config, changes):
+        self.config = config
+        self.changes = changes
+
+    def check(self):
+        if not self.changes:
+            return None
+        key, value = self.changes.pop(0)
+        self.config[key] = value
+        return [key]
+
+
+class ListSink:
+    def __init__(self):
+        self.ticks = []
+
+    def write(self, tick, sums, rows, instrument=None):
+        self.ticks.append(tick)
+
+
+def test_daemon_applies_interval_and_screen_id(monkeypatch):
+    config = load_default()
+    for section in ('roi_tracking', 'ladder_layout', 'color_key', 'consensus'):
+        config.pop(section, None)
+    monkeypatch.setattr(daemon, 'extract_rois', lambda *args: {'bid': empty_cells(), 'ask': empty_cells()})
+    waits = []
+    monkeypatch.setattr(daemon.time, 'monotonic', lambda: 0.0)
+
+    class Stop:
+        def is_set(self):
+            return False
+
+        def wait(self, delay):
+            waits.append(delay)
+
+    source = FakeSource(3)
+    service = FakeService(config, [('screen_id', 3), ('interval', 5)])
+    n_ticks = daemon.run(config, source, ListSink(), 1, stop_event=Stop(), service=service)
+    assert n_ticks == 3
+    assert source.screens == [3]
+    # The second tick waits the new interval
+    assert waits == [1, 6, 11]
+
+
+def test_live_value_is_kept_until_the_file_changes_it(tmp_path):
+    path = tmp_path / 'config.yaml'
+    with open(path, 'w') as f:
+        yaml.dump(load_default(), f)
+    config = load_default()
+    service = ConfigService(config, str(path))
+    # Moved by the RoI tracking
+    config['rois'] = {'left': [10, 10, 20, 20], 'right': [30, 10, 40, 20]}
+    new = load_default()
+    new['conf_thresh'] = 70
+    assert service.apply(new) == ['conf_thresh']
+    assert config['rois']['left'] == [10, 10, 20, 20]
+    new = copy.deepcopy(new)
+    new['rois']['left'] = [1, 2, 3, 4]
+    assert service.apply(new) == ['rois']
+    assert config['rois']['left'] == [1, 2, 3, 4]
+
+
+class FakeLocator:
+    def __init__(self, rois):
+        self.rois = rois
+        self.n_ticks = 0
+        self.resets = []
+
+    def update(self, frame):
+        self.n_ticks += 1
+        if self.n_ticks == 1:
+            for col_name, (x1, y1, x2, y2) in list(self.rois.items()):
+                self.rois[col_name] = (x1 + 5, y1, x2 + 5, y2)
+            return True
+        return False
+
+    def reset(self, rois=None):
+        self.resets.append(rois)
+        if rois is not None:
+            self.rois = rois
+
+
+def test_daemon_keeps_tracked_rois_over_other_changes(monkeypatch):
+    config = load_default()
+    config['rois'] = {'left': [0, 0, 10, 10], 'right': [20, 0, 30, 10]}
+    for section in ('ladder_layout', 'color_key', 'consensus'):
+        config.pop(section, None)
+    locators = []
+    monkeypatch.setattr(daemon.RoiLocator, 'from_config',
+                        classmethod(lambda cls, config, rois: locators.append(FakeLocator(rois)) or locators[-1]))
+    read = []
+    monkeypatch.setattr(daemon, 'extract_rois', lambda frame, rois, *args: read.append(dict(rois)) or {})
+
+    service = FakeService(config, [('conf_thresh', 70), ('conf_thresh', 60)])
+    daemon.run(config, FakeSource(3), ListSink(), 0, service=service)
+    assert read[1] == read[2] == {'bid': (5, 0, 15, 10), 'ask': (25, 0, 35, 10)}
+    assert config['rois'] == {'left': [5, 0, 15, 10], 'right': [25, 0, 35, 10]}
+    assert locators[0].resets == []
+
+
+def test_daemon_flags_a_stall_when_nothing_is_read(monkeypatch):
+    config = load_default()
+    for section in ('roi_tracking', 'ladder_layout', 'color_key', 'consensus'):
+        config.pop(section, None)
+    config['stall_timeout'] = 10
+    clock = [0.0]
+    monkeypatch.setattr(daemon.time, 'monotonic', lambda: clock[0])
+    # Every column timed out from the second tick to the fourth
+    read = [True, False, False, False, True]
+    monkeypatch.setattr(daemon, 'extract_rois', lambda *args: {'bid': empty_cells()} if read.pop(0) else {})
+
+    class Status:
+        def __init__(self):
+            self.states = []
+
+        def publish(self, state):
+            self.states.append(state)
+            clock[0] += 6
+
+    status = Status()
+    daemon.run(config, FakeSource(5), ListSink(), 0, status=status)
+    assert [state['worker']['stalled'] for state in status.states] == [False, False, True, True, False]
+
+
+def test_settings_save_keeps_tracked_rois_out(tmp_path, monkeypatch):
+    QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+    monkeypatch.setenv('QT_QPA_PLATFORM', 'offscreen')
+    import main
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    config = load_default()
+    path = str(tmp_path / 'config.yaml')
+    service = ConfigService(config, path)
+    changes = []
+    service.subscribe(changes.append)
+    monkeypatch.setattr(main, 'config', config)
+    monkeypatch.setattr(main, 'config_service', service)
+    applied = copy.deepcopy(config['rois'])
+    # Moved by the tracking of the ladder window
+    config['rois'] = {'left': [5, 0, 15, 10], 'right': [25, 0, 35, 10]}
+
+    window = main.SettingWindow()
+    window.interval_val_spin.setValue(config['interval'] + 1)
+    window.save_button_handler()
+    assert changes == [['interval']]
+    assert config['rois'] == {'left': [5, 0, 15, 10], 'right': [25, 0, 35, 10]}
+    with open(path) as f:
+        assert yaml.load(f, Loader=yaml.FullLoader)['rois'] == applied
+    window.close()
@@ -0,0 +1,61 @@
+from consensus import Consensus
+
+
+def row(text, conf=95):
+    return [(0, 0, 10, 10, text, conf)]
+
+
+def texts(rows):
+    return [' '.join(cell[4] for cell in cells) for cells in rows]
+
+
+def test_one_frame_misread_is_outvoted():
+    consensus = Consensus(window=3, recheck=False)
+    for _ in range(2):
+        consensus.vote('bid', [row('100'), row('200'), row('300')], 80)
+    voted = consensus.vote('bid', [row('100'), row('290', 85), row('300')], 80)
+    assert texts(voted) == ['100', '200', '300']
+    # The cells carry the confidence of the winner
+    assert voted[1][0][5] == 95
+
+
+def test_rechecked_change_is_taken_at_once():
+    consensus = Consensus(window=3)
+    for _ in range(2):
+        consensus.vote('bid', [row('100'), row('200'), row('300')], 80)
+    rechecked = []
+
+    def recheck(k):
+        rechecked.append(k)
+        return row('250', 90)
+
+    voted = consensus.vote('bid', [row('100'), row('250'), row('300')], 80, recheck)
+    assert rechecked == [1]
+    assert texts(voted) == ['100', '250', '300']
+
+
+def test_low_confidence_row_is_replaced_by_a_better_reading():
+    consensus = Consensus(window=3)
+    voted = consensus.vote('bid', [row('1OO', 40)], 80, lambda k: row('100', 90))
+    assert texts(voted) == ['100']
+    assert voted[0][0][5] == 90
+
+
+def test_scrolled_ladder_drops_the_history():
+    consensus = Consensus(window=3, recheck=False)
+    for _ in range(2):
+        consensus.vote('bid', [row('100'), row('200'), row('300')], 80)
+    voted = consensus.vote('bid', [row('200'), row('300'), row('400')], 80)
+    assert texts(voted) == ['200', '300', '400']
+
+
+def test_columns_are_voted_apart():
+    consensus = Consensus(window=3, recheck=False)
+    consensus.vote('bid', [row('1')], 80)
+    assert texts(consensus.vote('ask', [row('2')], 80)) == ['2']
+    assert texts(consensus.vote('bid', [row('1'), row('5')], 80)) == ['1', '5']
+
+
+def test_empty_rows_stay_empty():
+    consensus = Consensus(window=3, recheck=False)
+    assert consensus.vote('bid', [[], row('')], 80) == [[], []]
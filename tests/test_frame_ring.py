@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from frame_ring import FrameRing
+
+
+@pytest.fixture
+def frames():
+    ring = FrameRing(f'l2easy_test_frames_{os.getpid()}', (6, 8), n_slots=3, create=True)
+    yield ring
+    ring.close()
+
+
+def test_frame_ring_latest_and_still_valid(frames):
+    assert frames.latest() is None
+    frame = np.full((6, 8, 4), 7, np.uint8)
+    frames.write(frame, timestamp=5.0)
+    n, timestamp, view = frames.latest()
+    assert (n, timestamp) == (0, 5.0)
+    assert (view == 7).all()
+    assert not view.flags.writeable
+    assert frames.latest(after=0) is None
+    for _ in range(3):
+        frames.write(frame.tobytes())
+    # Slot 0 now holds frame 3
+    assert not frames.still_valid(0)
+    assert frames.still_valid(3)
+
+
+def test_frame_being_written_is_not_returned(frames):
+    frames.write(np.zeros((6, 8, 4), np.uint8))
+    frames.meta['seq'][0] = 1
+    assert frames.latest() is None
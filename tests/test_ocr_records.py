@@ -0,0 +1,39 @@
+import math
+
+import numpy as np
+
+from aggregator import column_values
+from ocr_records import CELL_DTYPE, empty_cells, make_cells, parse_value
+
+
+def test_parse_value():
+    assert parse_value('1,234') == 1234.0
+    assert parse_value('12.5') == 12.5
+    assert math.isnan(parse_value('l2'))
+    assert math.isnan(parse_value(''))
+
+
+def test_make_cells_sorts_and_numbers_rows():
+    cells = make_cells([(0, 30, 9, 40, '3', '91.5'), (0, 10, 9, 20, '1,000', 96)], roi=1)
+    assert cells.dtype == CELL_DTYPE
+    assert cells['text'].tolist() == ['1,000', '3']
+    assert cells['value'].tolist() == [1000.0, 3.0]
+    assert cells['conf'].tolist() == [96.0, 91.5]
+    assert cells['row'].tolist() == [0, 1]
+    assert (cells['roi'] == 1).all()
+
+
+def test_make_cells_keeps_given_rows():
+    cells = make_cells([(0, 30, 9, 40, '3', 90), (0, 10, 9, 20, '1', 90)], rows=[4, 2])
+    assert cells['row'].tolist() == [2, 4]
+
+
+def test_no_cells():
+    assert len(make_cells([])) == 0
+    assert empty_cells().dtype == CELL_DTYPE
+    assert np.isnan(make_cells([(0, 0, 1, 1, 'x', 90)])['value']).all()
+
+
+def test_column_values_skips_text_that_is_not_a_number():
+    cells = make_cells([(0, 0, 5, 5, '1,200', 90), (0, 20, 5, 25, 'l2', 90), (0, 10, 5, 15, '30', '95')])
+    assert column_values(cells) == (1230.0, [1200.0, 30.0])
@@ -0,0 +1,57 @@
+import math
+import struct
+
+import pytest
+
+from publisher import decode_tick, encode_tick
+
+
+def test_round_trip():
+    payload = encode_tick(1697704200.25, {'bid': 1234.0, 'ask': 56.5},
+                          {'bid': [1000.0, 234.0], 'ask': [56.5]}, {10: (2.5, 1.0), 60: (1.0, 1.25)})
+    assert decode_tick(payload) == {
+        'timestamp': 1697704200.25,
+        'sums': {'bid': 1234.0, 'ask': 56.5},
+        'rows': {'bid': [1000.0, 234.0], 'ask': [56.5]},
+        'ratios': {10: (2.5, 1.0), 60: (1.0, 1.25)},
+    }
+
+
+def test_empty_windows_and_missing_rows():
+    tick = decode_tick(encode_tick(0.0, {'ES bid': 0.0}, {}, {30: (math.nan, math.nan)}))
+    assert tick['sums'] == {'ES bid': 0.0}
+    assert tick['rows'] == {'ES bid': []}
+    assert all(math.isnan(ratio) for ratio in tick['ratios'][30])
+
+
+def test_non_ascii_roi_names():
+    tick = decode_tick(encode_tick(0.0, {'käufer': 1.0}, {'käufer': [1.0]}, {}))
+    assert tick['rows'] == {'käufer': [1.0]}
+
+
+def test_other_wire_version_is_rejected():
+    payload = bytearray(encode_tick(0.0, {}, {}, {}))
+    payload[0] = 99
+    with pytest.raises(ValueError):
+        decode_tick(bytes(payload))
+
+
+def test_payload_size():
+    payload = encode_tick(0.0, {'bid': 1.0}, {'bid': [1.0, 2.0]}, {10: (1.0, 1.0)})
+    # header, name length and name, sum and row count, rows, one ratio
+    assert len(payload) == struct.calcsize('<BdHH') + 1 + 3 + 10 + 16 + 20
+
+
+def test_publish_past_the_high_water_mark_does_not_block():
+    zmq = pytest.importorskip('zmq')
+    from publisher import TickPublisher, subscribe
+    publisher = TickPublisher('tcp://127.0.0.1:*', 'ES', sndhwm=1)
+    endpoint = publisher.socket.getsockopt(zmq.LAST_ENDPOINT).decode()
+    subscriber = subscribe(endpoint, rcvhwm=1)
+    try:
+        # The subscriber never reads, ZeroMQ drops what does not fit
+        for k in range(1000):
+            publisher.publish(float(k), {'bid': 1.0}, {'bid': [1.0]}, {})
+    finally:
+        subscriber.close()
+        publisher.close()
@@ -0,0 +1,34 @@
+import os
+import copy
+
+import replay
+from config_utils import default_config
+
+
+class FakeRecording:
+    def __init__(self, times):
+        self.times = times
+
+    def close(self):
+        pass
+
+
+def test_replay_leaves_the_live_config_and_files_alone(tmp_path, monkeypatch):
+    config = copy.deepcopy(default_config)
+    config['color_key'] = {'enabled': True, 'file': 'color_key.json'}
+    original = copy.deepcopy(config)
+    seen = {}
+
+    def fake_run(config, source, sink, interval, alerts=None):
+        seen['files'] = [config[section]['file'] for section in ('ladder_layout', 'color_key')]
+        seen['dirs_exist'] = [os.path.isdir(os.path.dirname(f)) for f in seen['files']]
+        # Like the RoI tracking does
+        config['rois']['left'][0] += 5
+        return 0
+
+    monkeypatch.setattr(replay, 'run', fake_run)
+    replay.replay(config, FakeRecording([0.0]), str(tmp_path / 'ticks.jsonl'), str(tmp_path / 'alarms.jsonl'))
+    assert config == original
+    assert [os.path.basename(f) for f in seen['files']] == ['ladder_layout.json', 'color_key.json']
+    assert all(os.path.isabs(f) for f in seen['files']) and all(seen['dirs_exist'])
+    assert not os.path.exists(os.path.dirname(seen['files'][0]))
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from shm_ring import ResultRing, record_rows
+
+
+@pytest.fixture
+def ring():
+    ring = ResultRing(f'l2easy_test_{os.getpid()}', n_slots=4, create=True)
+    yield ring
+    ring.close()
+
+
+def test_read_since_returns_records_in_order(ring):
+    for k in range(3):
+        ring.write(100.0 + k, 10.0 * k, 5.0, [1.0, 2.0], [3.0])
+    records, last_seq = ring.read_since(0)
+    assert last_seq == 3
+    assert [float(record['timestamp']) for record in records] == [100.0, 101.0, 102.0]
+    sums, rows = record_rows(records[2])
+    assert sums == {'bid': 20.0, 'ask': 5.0}
+    assert rows == {'bid': [1.0, 2.0], 'ask': [3.0]}
+    assert ring.read_since(last_seq) == ([], 3)
+
+
+def test_reader_behind_the_ring_skips_overwritten_records(ring):
+    for k in range(10):
+        ring.write(float(k), 0.0, 0.0, [], [])
+    records, last_seq = ring.read_since(0)
+    assert last_seq == 10
+    assert [float(record['timestamp']) for record in records] == [6.0, 7.0, 8.0, 9.0]
+    assert float(ring.latest()['timestamp']) == 9.0
+
+
+def test_slot_being_written_is_not_read(ring):
+    ring.write(1.0, 1.0, 1.0, [], [])
+    # The writer made the sequence number odd and has not finished
+    ring.slots['seq'][0] = 1
+    assert ring.latest() is None
+    assert ring.read_since(0) == ([], 1)
+
+
+def test_attached_ring_sees_the_writes(ring):
+    reader = ResultRing(ring.name)
+    try:
+        assert reader.n_slots == 4
+        ring.write(7.0, 1.0, 2.0, [1.0], [2.0])
+        assert float(reader.latest()['bid_sum']) == 1.0
+    finally:
+        reader.close()
+
+
+def test_rows_beyond_max_rows_are_cut(ring):
+    ring.write(0.0, 0.0, 0.0, list(range(100)), [])
+    _, rows = record_rows(ring.latest())
+    assert rows['bid'] == list(range(32))
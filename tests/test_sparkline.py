@@ -0,0 +1,65 @@
+import os
+import math
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+
+from sparkline import ASK, BID, Sparkline, per_pixel
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def column_colors(chart, x):
+    image = chart.pixmap.toImage()
+    return {image.pixelColor(x, y).name() for y in range(image.height())}
+
+
+def test_per_pixel():
+    # Two hours of one second values on 120 pixels
+    assert per_pixel(7200, 120, 1) == 60
+    assert per_pixel(7200, 120, 3600) == 1
+    assert per_pixel(0, 120, 1) == 1
+
+
+def test_columns_keep_the_range_of_their_values(app):
+    chart = Sparkline(10, per_pixel=3, scale=1.0)
+    for value in [0.5, -0.2, 0.1, 0.3, math.nan, math.nan, math.nan]:
+        chart.add(value)
+    assert list(chart.columns) == [(-0.2, 0.5, 0.1), (0.3, 0.3, 0.3), None]
+    # The third column is still open
+    chart.add(0.4)
+    assert list(chart.columns)[-1] == (0.4, 0.4, 0.4)
+    chart.add(0.6)
+    assert list(chart.columns)[-1] == (0.4, 0.6, 0.6)
+    chart.add(0.1)
+    assert len(chart.columns) == 4
+
+
+def test_history_is_bounded_by_the_width(app):
+    chart = Sparkline(5, per_pixel=60)
+    for k in range(60 * 20):
+        chart.add(math.sin(k / 50))
+    assert len(chart.columns) == 5
+
+
+def test_bid_and_ask_colors(app):
+    chart = Sparkline(4, height=21, per_pixel=2, scale=1.0)
+    for value in [-0.8, 0.8, 0.5, 0.5]:
+        chart.add(value)
+    # The first column spans the axis, the second stays above it
+    assert {BID.name(), ASK.name()} <= column_colors(chart, 2)
+    assert BID.name() in column_colors(chart, 3) and ASK.name() not in column_colors(chart, 3)
+
+
+def test_set_per_pixel_clears(app):
+    chart = Sparkline(4, per_pixel=1)
+    chart.add(1.0)
+    chart.set_per_pixel(1)
+    assert len(chart.columns) == 1
+    chart.set_per_pixel(10)
+    assert len(chart.columns) == 0
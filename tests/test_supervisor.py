@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import supervisor
+from shm_ring import ResultRing
+
+
+class FakeSupervisor:
+    def __init__(self, ring, writes):
+        self.config = {
+            'time_periods': [2], 'interval': 1, 'stall_timeout': 3,
+            'alarm_active': [True, True], 'alarm_threshold_bid': [5, 100], 'alarm_threshold_ask': [100, 100],
+        }
+        self.ring = ring
+        # Record written before each interval, None when the worker wrote nothing
+        self.writes = writes
+
+    @property
+    def instruments(self):
+        return ['ES']
+
+    def check(self):
+        pass
+
+    def is_running(self, name):
+        return False
+
+    def latest(self):
+        timestamp = self.writes.pop(0)
+        if timestamp is not None:
+            self.ring.write(timestamp, 10.0, 1.0, [10.0], [1.0])
+        record = self.ring.latest()
+        return {'ES': record} if record is not None else {}
+
+
+class Stop:
+    # Stops after `n` intervals, each one second on `clock`
+    def __init__(self, n, clock):
+        self.n = n
+        self.clock = clock
+
+    def is_set(self):
+        return self.n <= 0
+
+    def wait(self, delay):
+        self.n -= 1
+        self.clock[0] += 1
+
+
+class Sink:
+    def __init__(self):
+        self.ticks = []
+
+    def write(self, tick, sums, rows, instrument=None):
+        self.ticks.append(sums)
+
+
+class Status:
+    def __init__(self):
+        self.states = []
+
+    def publish(self, state):
+        self.states.append({name: dict(s['worker']) for name, s in state.items()})
+
+
+@pytest.fixture
+def ring():
+    ring = ResultRing(f'l2easy_test_supervisor_{os.getpid()}', n_slots=4, create=True)
+    yield ring
+    ring.close()
+
+
+def test_old_results_are_not_aggregated_again(ring, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(supervisor.time, 'monotonic', lambda: clock[0])
+    stop = Stop(6, clock)
+    sink, status = Sink(), Status()
+    fake = FakeSupervisor(ring, [100.0, None, None, None, None, 105.0])
+    alarms = []
+    monkeypatch.setattr(supervisor.logger, 'warning', lambda *args: alarms.append(args))
+    supervisor.run(fake, sink, 1, stop, status)
+    # Only the two new records are ticks, and alarmed on
+    assert len(sink.ticks) == 2
+    assert len(alarms) == 2
+    assert [state['ES']['stalled'] for state in status.states] == [False, False, False, True, True, False]
+    assert status.states[3]['ES']['running'] is False
@@ -0,0 +1,69 @@
+import math
+
+import numpy as np
+
+from aggregator import Aggregator
+from sweep_alarms import fire_counts, lead_times, onsets, rank, sessions, window_ratios
+
+
+def aggregator_ratios(bid, ask, period):
+    # Ratios of `period` on the ticks that refresh it, one Aggregator per session
+    config = {'time_periods': [period], 'interval': 1, 'alarm_active': [False, False],
+              'alarm_threshold_bid': [0, 0], 'alarm_threshold_ask': [0, 0]}
+    aggregator = Aggregator(config)
+    ratios = []
+    for b, a in zip(bid, ask):
+        tick = aggregator.update(b, a)
+        if period in tick['refreshed']:
+            ratios.append(tick['ratios'][period])
+    return ratios
+
+
+def test_window_ratios_match_the_aggregator():
+    rng = np.random.default_rng(1)
+    n = 500
+    timestamps = np.arange(n, dtype=np.float64)
+    timestamps[300:] += 1000     # a second session
+    bid = rng.integers(0, 50, n).astype(np.float64)
+    ask = rng.integers(0, 50, n).astype(np.float64)
+    bid[40:60] = 0               # empty windows
+    bounds = sessions(timestamps, 60)
+    assert bounds == [(0, 300), (300, 500)]
+    for period in (1, 7, 30, 60):
+        times, ratios = window_ratios(timestamps, bid, ask, period, bounds)
+        expected = []
+        for start, stop in bounds:
+            expected += aggregator_ratios(bid[start:stop], ask[start:stop], period)
+        assert len(times) == len(expected)
+        for k, (bid_ratio, ask_ratio) in enumerate(expected):
+            if math.isnan(bid_ratio):
+                assert np.isnan(ratios['bid'][k]) and np.isnan(ratios['ask'][k])
+            else:
+                assert (ratios['bid'][k], ratios['ask'][k]) == (bid_ratio, ask_ratio)
+
+
+def test_fire_counts():
+    ratios = np.array([1.0, 2.0, np.nan, 3.0, 2.0])
+    assert fire_counts(ratios, np.array([1.5, 2.0, 3.5])).tolist() == [3, 3, 0]
+
+
+def test_lead_times_from_the_first_fire_within_the_horizon():
+    times = np.arange(10, dtype=np.float64) * 10
+    ratios = np.array([1, 1, 2, 1, 3, 1, 1, 1, 1, 1], np.float64)
+    leads = lead_times(times, ratios, np.array([2.0, 3.0, 4.0]), np.array([50.0, 95.0]), horizon=40)
+    assert leads[:, 0].tolist()[:2] == [30.0, 10.0]
+    assert np.isnan(leads[2, 0])
+    # Both fires are more than 40 s before the second event
+    assert np.isnan(leads[:, 1]).all()
+
+
+def test_onsets():
+    timestamps = np.arange(6, dtype=np.float64)
+    values = np.array([5, 5, 0, 5, 0, 5], np.float64)
+    assert onsets(timestamps, values, 5, [(0, 4), (4, 6)]).tolist() == [0.0, 3.0, 5.0]
+
+
+def test_rank():
+    rows = [{'hits': 0.5, 'fires': 10, 'lead': 5}, {'hits': 0.5, 'fires': 4, 'lead': 1},
+            {'hits': 1.0, 'fires': 40, 'lead': 2}, {'hits': None, 'fires': 0, 'lead': None}]
+    assert [row['fires'] for row in rank(rows)] == [40, 4, 10]
@@ -0,0 +1,36 @@
+from tune_ocr import ADAPTIVE_ONLY, SEARCH_SPACE, pareto_front, sample_settings, search_space, select
+
+
+def candidate(name, accuracy, latency_ms):
+    return {'name': name, 'accuracy': accuracy, 'latency_ms': latency_ms}
+
+
+def names(candidates):
+    return [c['name'] for c in candidates]
+
+
+def test_pareto_front_drops_dominated_candidates():
+    candidates = [candidate('slow', 0.99, 30), candidate('fast', 0.90, 5), candidate('worse', 0.85, 10),
+                  candidate('middle', 0.97, 12), candidate('tie', 0.97, 20)]
+    assert names(pareto_front(candidates)) == ['fast', 'middle', 'slow']
+
+
+def test_equal_latency_keeps_the_more_accurate():
+    assert names(pareto_front([candidate('a', 0.9, 5), candidate('b', 0.95, 5)])) == ['b']
+
+
+def test_select_fastest_within_tolerance():
+    front = pareto_front([candidate('fast', 0.90, 5), candidate('middle', 0.985, 12), candidate('slow', 0.99, 30)])
+    assert select(front, 0.005)['name'] == 'middle'
+    assert select(front, 0.0)['name'] == 'slow'
+    assert select(front, 0.1)['name'] == 'fast'
+
+
+def test_color_keyed_search_leaves_out_the_adaptive_parameters():
+    space = search_space({'color_key': {'enabled': True}})
+    assert not set(ADAPTIVE_ONLY) & set(space)
+    assert search_space({}) is SEARCH_SPACE
+    settings = sample_settings(20, space=space)
+    assert len(settings) == 20
+    assert all(set(setting) == set(space) for setting in settings)
+    assert len({tuple(setting.values()) for setting in settings}) == 20
@@ -0,0 +1,194 @@
+"""Offline training of the neural digit recognizer
+
+Builds a dataset of ladder cells from recorded frames, labeled by the
+current Tesseract pipeline, and trains the small CRNN of `dnn_ocr` on it.
+Training needs PyTorch, which the app itself does not use: the trained model
+is exported to ONNX and run with `cv2.dnn`.
+
+Usage
+    python train_digits.py export --source ./frames --out ./digits_dataset
+    python train_digits.py train --dataset ./digits_dataset --out models/digits_crnn.onnx
+    python train_digits.py train --dataset ./digits_dataset --init models/digits_crnn.pt   # fine-tune
+
+The dataset is a directory of gray cell images and a labels.tsv of
+`file name<TAB>text`. Only cells Tesseract read as one number with at least
+`--min-conf` are kept, so the labels can be checked or corrected by hand
+before training.
+
+Then set `ocr_engine: {name: dnn, model: models/digits_crnn.onnx}` in config.yaml.
+"""
+import os
+import re
+import random
+import logging
+import argparse
+
+import cv2
+import numpy as np
+
+from capture_utils import DirectorySource
+from config_utils import load_config
+from dnn_ocr import ALPHABET, INPUT_HEIGHT, INPUT_WIDTH, ctc_decode, prepare_cell
+from ladder_layout import LayoutStore
+from ocr_presets import resolve_preset
+from ocr_utils import cell_boxes, extract_data, to_gray
+
+logger = logging.getLogger('root')
+
+NUMBER = re.compile(r'^[0-9][0-9,.]*$')
+
+
+def export_dataset(source, out_dir, config, min_conf=90):
+    """Write the cells of recorded frames and their Tesseract labels, replacing labels.tsv.
+
+    Returns the number of cells written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rois = {'bid': config['rois']['left'], 'ask': config['rois']['right']}
+    layouts = LayoutStore.from_config(config)
+    preset = resolve_preset('accurate')
+    scale = preset['scale']
+    frames = DirectorySource(source)
+    n_cells = 0
+    with open(os.path.join(out_dir, 'labels.tsv'), 'w') as labels:
+        for filename in frames.files:
+            frame = frames.grab()
+            stem = os.path.splitext(os.path.basename(filename))[0]
+            for col_name, (x1, y1, x2, y2) in rois.items():
+                img = frame[y1:y2, x1:x2]
+                layout = layouts.get(col_name, img) if layouts is not None else None
+                words = extract_data(img, min_conf, col_name, cache=None, preset=preset, layout=layout)
+                gray = to_gray(img, 1)
+                for k, (bx1, by1, bx2, by2) in enumerate(cell_boxes(img, layout)):
+                    # Words of the cell, by the center of their box in crop pixels
+                    centers = (words['y1'] + words['y2']) / 2 / scale
+                    texts = words['text'][(centers >= by1) & (centers < by2)]
+                    if len(texts) != 1 or not NUMBER.match(texts[0]):
+                        continue
+                    name = f'{stem}_{col_name}_{k:02d}.png'
+                    cv2.imwrite(os.path.join(out_dir, name), gray[by1:by2, bx1:bx2])
+                    labels.write(f'{name}\t{texts[0]}\n')
+                    n_cells += 1
+    return n_cells
+
+
+def load_dataset(dataset):
+    """Return (images, labels) of a dataset directory, images prepared for the model."""
+    images, labels = [], []
+    with open(os.path.join(dataset, 'labels.tsv')) as f:
+        for line in f:
+            name, text = line.rstrip('\n').split('\t')
+            gray = cv2.imread(os.path.join(dataset, name), cv2.IMREAD_GRAYSCALE)
+            if gray is None or not text:
+                continue
+            images.append(prepare_cell(gray))
+            labels.append([ALPHABET.index(c) + 1 for c in text])
+    return np.stack(images)[:, None], labels
+
+
+def build_model():
+    """Fully convolutional CRNN, (N, 1, 32, 128) -> (N, 32, classes) log probabilities.
+
+    No recurrent layer, so that `cv2.dnn` runs every layer of it.
+    """
+    import torch
+    from torch import nn
+
+    class CRNN(nn.Module):
+        def __init__(self, n_classes):
+            super().__init__()
+            self.features = nn.Sequential(
+                nn.Conv2d(1, 32, 3, padding=1), nn.ReLU(), nn.MaxPool2d(2),              # 16 x 64
+                nn.Conv2d(32, 64, 3, padding=1), nn.ReLU(), nn.MaxPool2d(2),             # 8 x 32
+                nn.Conv2d(64, 128, 3, padding=1), nn.BatchNorm2d(128), nn.ReLU(),
+                nn.MaxPool2d((2, 1)),                                                     # 4 x 32
+                nn.Conv2d(128, 128, 3, padding=1), nn.ReLU(), nn.MaxPool2d((4, 1)),      # 1 x 32
+                nn.Conv2d(128, 128, (1, 3), padding=(0, 1)), nn.ReLU(),
+                nn.Conv2d(128, n_classes, 1),
+            )
+
+        def forward(self, x):
+            x = self.features(x).squeeze(2).permute(0, 2, 1)
+            return torch.log_softmax(x, dim=2)
+
+    return CRNN(len(ALPHABET) + 1)
+
+
+def train(dataset, out, init=None, epochs=30, batch_size=64, seed=0):
+    """Train or fine-tune the CRNN and export it to ONNX.
+
+    The PyTorch weights are also kept next to `out` (.pt) for fine-tuning.
+    """
+    import torch
+
+    torch.manual_seed(seed)
+    images, labels = load_dataset(dataset)
+    order = list(range(len(labels)))
+    random.Random(seed).shuffle(order)
+    n_val = max(1, len(order) // 10)
+    val, train_ids = order[:n_val], order[n_val:]
+
+    model = build_model()
+    if init:
+        model.load_state_dict(torch.load(init))
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    ctc = torch.nn.CTCLoss(blank=0, zero_infinity=True)
+    x_all = torch.from_numpy(images)
+
+    for epoch in range(epochs):
+        model.train()
+        random.shuffle(train_ids)
+        total = 0.0
+        for start in range(0, len(train_ids), batch_size):
+            ids = train_ids[start:start + batch_size]
+            log_probs = model(x_all[ids]).permute(1, 0, 2)     # (T, N, classes) for CTCLoss
+            targets = torch.tensor([c for i in ids for c in labels[i]])
+            target_lengths = torch.tensor([len(labels[i]) for i in ids])
+            input_lengths = torch.full((len(ids),), log_probs.shape[0], dtype=torch.long)
+            loss = ctc(log_probs, targets, input_lengths, target_lengths)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(ids)
+
+        model.eval()
+        with torch.no_grad():
+            probs = model(x_all[val]).exp().numpy()
+        correct = sum(ctc_decode(p)[0] == ''.join(ALPHABET[c - 1] for c in labels[i]) for p, i in zip(probs, val))
+        logger.info(f'Epoch {epoch + 1}/{epochs}: loss {total / len(train_ids):.4f}, '
+                    f'validation accuracy {correct / len(val) * 100:.1f}%')
+
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    torch.save(model.state_dict(), os.path.splitext(out)[0] + '.pt')
+    torch.onnx.export(model, torch.zeros(1, 1, INPUT_HEIGHT, INPUT_WIDTH), out, opset_version=11,
+                      input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+    logger.info(f'Wrote {out}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build a digit dataset and train the CRNN digit recognizer.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='Write labeled cells of recorded frames')
+    export.add_argument('--config', default='config.yaml', help='Config file with the RoIs')
+    export.add_argument('--source', required=True, help='Directory of recorded full-screen frames')
+    export.add_argument('--out', default='digits_dataset', help='Dataset directory')
+    export.add_argument('--min-conf', type=float, default=90, help='Lowest Tesseract confidence of a label')
+    fit = commands.add_parser('train', help='Train the model and export it to ONNX')
+    fit.add_argument('--dataset', default='digits_dataset', help='Dataset directory')
+    fit.add_argument('--out', default='models/digits_crnn.onnx', help='ONNX file to write')
+    fit.add_argument('--init', default=None, help='.pt weights to fine-tune from')
+    fit.add_argument('--epochs', type=int, default=30)
+    fit.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'export':
+        n_cells = export_dataset(args.source, args.out, load_config(args.config), args.min_conf)
+        logger.info(f'Wrote {n_cells} labeled cells to {args.out}')
+    else:
+        train(args.dataset, args.out, args.init, args.epochs, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
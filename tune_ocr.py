@@ -0,0 +1,243 @@
+"""Offline OCR auto-tuner
+
+Searches the preprocessing and Tesseract parameters of `ocr_presets` over
+recorded frames, on all cores, and writes the settings that are best for
+accuracy and latency into a per-RoI profile that the app loads
+(`ocr_profile` in config.yaml).
+
+Usage
+    python tune_ocr.py --source ./frames --labels labels.json
+    python tune_ocr.py --source ./frames --trials 500 --out ocr_profile.yaml
+
+Every trial is one setting of scale, blur, threshold block and C, line
+removal, erode/dilate, psm, oem and whitelist. The three presets are always
+tried, the other trials are drawn at random from `SEARCH_SPACE`. Each trial
+reads every frame once; `conf_thresh` only filters the words afterwards, so
+all of `CONF_THRESHOLDS` are scored from the same reading.
+
+Accuracy is scored as in `bench_ocr`, against the labels or the `--reference`
+preset. Latency is the mean time of one column read, measured while every
+core is busy, so it is higher than the live pipeline sees but comparable
+between trials.
+
+Frames are read with the ladder layout and color key of the app, as in
+`bench_ocr`. With a layout its grid mask replaces `line_share`. A crop in the
+learned colors is binarized by its color key, which only takes `scale` from
+the setting, so blur, block, c, line_share, erode and dilate only matter for
+the crops that fall back to the adaptive threshold. With `color_key` enabled
+they are not searched, the balanced preset's values are kept.
+
+The profile keeps, per RoI, the Pareto front (no other setting is both more
+accurate and faster) and selects the fastest setting within `--tolerance` of
+the best accuracy.
+"""
+import os
+import copy
+import time
+import shutil
+import random
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from aggregator import column_values
+from bench_ocr import calibrate, calibration_config, load_labels, read_frames, run_preset, score_rows
+from color_key import ColorKeyStore
+from config_utils import load_config
+from ladder_layout import LayoutStore
+from ocr_presets import PRESETS, resolve_preset
+from ocr_utils import extract_data
+
+SEARCH_SPACE = {
+    'scale': [2, 3, 4, 6],
+    'blur': [0, 3, 5],
+    'block': [15, 31, 45],
+    'c': [2, 5, 8],
+    'line_share': [0, 0.4, 0.6],
+    'erode': [0, 3],
+    'dilate': [0, 3, 5],
+    'psm': [4, 6, 11],
+    'oem': [None, 1],
+    'whitelist': ['', '0123456789,.'],
+}
+
+# Parameters of the adaptive threshold, a color-keyed crop does not use them
+ADAPTIVE_ONLY = ('blur', 'block', 'c', 'line_share', 'erode', 'dilate')
+
+CONF_THRESHOLDS = [50, 60, 70, 80, 90]
+
+# Frames, expected values, layouts and color keys of a pool process, set by `_init_worker`
+_crops = None
+_expected = None
+_layouts = None
+_keys = None
+
+
+def search_space(config):
+    """`SEARCH_SPACE` without the parameters the app does not use with this config."""
+    if (config.get('color_key') or {}).get('enabled', False):
+        return {key: values for key, values in SEARCH_SPACE.items() if key not in ADAPTIVE_ONLY}
+    return SEARCH_SPACE
+
+
+def sample_settings(trials, seed=0, space=SEARCH_SPACE):
+    """Return the presets and random settings of `space`, `trials` in all.
+
+    Parameters left out of `space` keep the value of the default preset.
+    """
+    settings = []
+    seen = set()
+    for preset in PRESETS.values():
+        setting = {key: preset[key] for key in space}
+        if tuple(setting.values()) not in seen:
+            settings.append(setting)
+            seen.add(tuple(setting.values()))
+    rng = random.Random(seed)
+    n_combinations = 1
+    for values in space.values():
+        n_combinations *= len(values)
+    while len(settings) < min(trials, n_combinations):
+        setting = {key: rng.choice(values) for key, values in space.items()}
+        if tuple(setting.values()) not in seen:
+            seen.add(tuple(setting.values()))
+            settings.append(setting)
+    return settings
+
+
+def _init_worker(source, rois, expected, layouts, keys):
+    global _crops, _expected, _layouts, _keys
+    # One core per process, as in the supervisor workers
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    import cv2
+    cv2.setNumThreads(1)
+    _crops = read_frames(source, rois)
+    _expected = expected
+    _layouts = layouts
+    _keys = keys
+
+
+def evaluate(setting):
+    """Read every frame with one setting.
+
+    Returns
+    :scores: {col_name: {'latency': seconds per read, 'rows': {conf_thresh: (matches, total)}}}
+    """
+    preset = resolve_preset(dict(setting, conf_thresh=None))
+    # Every trial starts from the calibrated keys, see `bench_ocr.run_preset`
+    keys = copy.deepcopy(_keys)
+    scores = {}
+    for filename, columns in _crops:
+        for col_name, crop in columns.items():
+            layout = _layouts.get(col_name, crop) if _layouts is not None else None
+            t0 = time.perf_counter()
+            # Every word is kept, the thresholds are applied below
+            cells = extract_data(crop, -1, col_name, cache=None, preset=preset, layout=layout, keys=keys)
+            elapsed = time.perf_counter() - t0
+            score = scores.setdefault(col_name, {'latency': 0.0, 'reads': 0,
+                                                 'rows': {t: (0, 0) for t in CONF_THRESHOLDS}})
+            score['latency'] += elapsed
+            score['reads'] += 1
+            expected = _expected.get((filename, col_name))
+            if expected is None:
+                continue
+            for thresh in CONF_THRESHOLDS:
+                values = column_values(cells[cells['conf'] > thresh])[1]
+                matches, total = score_rows(values, expected)
+                m, n = score['rows'][thresh]
+                score['rows'][thresh] = (m + matches, n + total)
+    for score in scores.values():
+        score['latency'] /= max(1, score.pop('reads'))
+    return scores
+
+
+def pareto_front(candidates):
+    """Return the candidates no other is both more accurate and faster than, fastest first.
+
+    Args
+    :candidates: [{'accuracy', 'latency_ms', ...}]
+    """
+    front = []
+    for candidate in sorted(candidates, key=lambda c: (c['latency_ms'], -c['accuracy'])):
+        if not front or candidate['accuracy'] > front[-1]['accuracy']:
+            front.append(candidate)
+    return front
+
+
+def select(front, tolerance):
+    """Fastest candidate of the front within `tolerance` of its best accuracy."""
+    best = max(candidate['accuracy'] for candidate in front)
+    return next(candidate for candidate in front if candidate['accuracy'] >= best - tolerance)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search OCR settings on recorded frames and write a per-RoI profile.')
+    parser.add_argument('--source', required=True, help='Directory of recorded full-screen frames')
+    parser.add_argument('--labels', default=None, help='JSON file of the expected values per frame')
+    parser.add_argument('--reference', default='accurate', help='Preset taken as correct without labels')
+    parser.add_argument('--trials', type=int, default=200, help='Number of settings to try')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random settings')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes, one per core by default')
+    parser.add_argument('--tolerance', type=float, default=0.005, help='Accuracy given up for speed')
+    parser.add_argument('--out', default='ocr_profile.yaml', help='Profile file to write')
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    rois = {'bid': config['rois']['left'], 'ask': config['rois']['right']}
+    work_dir = tempfile.mkdtemp(prefix='tune_ocr_')
+    try:
+        local = calibration_config(config, work_dir)
+        layouts = LayoutStore.from_config(local)
+        keys = ColorKeyStore.from_config(local)
+        crops = read_frames(args.source, rois)
+        # Calibrated once here, not in every process
+        calibrate(crops, layouts, keys)
+        if args.labels:
+            expected = {(filename, col_name): values
+                        for filename, columns in load_labels(args.labels).items()
+                        for col_name, values in columns.items()}
+        else:
+            _, expected = run_preset(crops, resolve_preset(args.reference), config['conf_thresh'], layouts=layouts,
+                                     keys=keys)
+
+        settings = sample_settings(args.trials, args.seed, search_space(config))
+        print(f'Trying {len(settings)} settings on {args.workers} processes')
+        candidates = {'bid': [], 'ask': []}
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                                 initargs=(args.source, rois, expected, layouts, keys)) as pool:
+            for k, (setting, scores) in enumerate(zip(settings, pool.map(evaluate, settings, chunksize=4)), 1):
+                for col_name, score in scores.items():
+                    for thresh, (matches, total) in score['rows'].items():
+                        candidates[col_name].append({
+                            'preset': dict(setting, conf_thresh=thresh),
+                            'accuracy': matches / total if total else 0.0,
+                            'latency_ms': score['latency'] * 1000,
+                        })
+                if k % 20 == 0:
+                    print(f'{k}/{len(settings)} settings, {time.perf_counter() - t0:.0f} s')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    profile = {}
+    for col_name, side in (('bid', 'left'), ('ask', 'right')):
+        if not candidates[col_name]:
+            continue
+        front = pareto_front(candidates[col_name])
+        selected = select(front, args.tolerance)
+        profile[side] = {
+            'selected': dict(selected['preset']),
+            'accuracy': selected['accuracy'],
+            'latency_ms': selected['latency_ms'],
+            'front': front,
+        }
+        print(f'{side}: {len(front)} settings on the Pareto front, selected '
+              f'{selected["accuracy"] * 100:.1f}% at {selected["latency_ms"]:.1f} ms')
+    with open(args.out, 'w') as f:
+        yaml.dump(profile, f)
+    print(f'Wrote {args.out}, set ocr_profile: {args.out} in config.yaml to use it')
+
+
+if __name__ == '__main__':
+    main()